@@ -0,0 +1,89 @@
+"""Tuning of the SQLite connections.
+
+The PRAGMAs in SQLITE_PRAGMAS are applied to every new SQLite connection:
+
+- WAL lets readers continue while one connection writes, instead of locking
+  the whole file during a write.
+- synchronous=NORMAL only syncs the WAL at checkpoints, which is safe in WAL
+  mode and saves an fsync per transaction.
+- busy_timeout makes a writer wait for the lock instead of failing with
+  "database is locked".
+- mmap_size and cache_size keep more of the database in memory.
+
+Together with CONN_MAX_AGE the connections, and so their PRAGMAs and page
+caches, are reused between requests.
+
+The replica, see bwb/routers.py, is a snapshot that is replaced as a whole
+file, so it keeps its rollback journal and is opened read-only with
+REPLICA_PRAGMAS. Its connections are not reused, because they would keep
+reading the replaced file."""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+import os
+import sqlite3
+
+BUSY_TIMEOUT = 20  # seconds
+
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', BUSY_TIMEOUT * 1000),
+    ('mmap_size', 256 * 1024 * 1024),
+    # negative values are in KiB
+    ('cache_size', -64 * 1024))
+
+REPLICA_PRAGMAS = (
+    ('query_only', 1),
+    ('busy_timeout', BUSY_TIMEOUT * 1000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -64 * 1024))
+
+
+def copy_database(source, path):
+    """Copy the database of the DB-API connection source to the file at
+    path. The copy is written next to it and then renamed, so that readers
+    of the old file are not disturbed."""
+    temporary_path = path + '.new'
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    target = sqlite3.connect(temporary_path)
+    try:
+        if hasattr(source, 'backup'):
+            # the backup API of Python 3.7
+            source.backup(target)
+        else:
+            # needs SQLite 3.27, iterdump() cannot copy the FTS tables
+            source.execute('VACUUM INTO ?', (temporary_path,))
+        target.execute('PRAGMA journal_mode = DELETE').fetchall()
+    finally:
+        target.close()
+    os.rename(temporary_path, path)
+
+
+def apply_pragmas(cursor, pragmas):
+    """Execute the (name, value) PRAGMAs with the DB-API cursor."""
+    for name, value in pragmas:
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+        # some PRAGMAs, e.g. journal_mode, return the new value
+        cursor.fetchall()
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    # pylint: disable=unused-argument
+    if connection.vendor != 'sqlite':
+        return
+
+    if connection.alias == getattr(settings, 'DATABASE_REPLICA', None):
+        pragmas = REPLICA_PRAGMAS
+    else:
+        pragmas = getattr(settings, 'SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+
+    # the raw cursor, so that the PRAGMAs do not show up in the query log
+    cursor = connection.connection.cursor()
+    try:
+        apply_pragmas(cursor, pragmas)
+    finally:
+        cursor.close()
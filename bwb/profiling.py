@@ -0,0 +1,142 @@
+"""Profiling of requests.
+
+ProfilingMiddleware measures the time of every request spent in SQL
+queries, in rendering templates and in the view, and sends it in the
+Server-Timing header. Requests slower than PROFILING_SLOW_REQUEST seconds
+are logged together with the queries that were repeated most often, which
+usually point to an N+1 problem.
+
+The middleware is only active if PROFILING_ENABLED is set. Otherwise it
+removes itself when the middleware is loaded and costs nothing."""
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+import logging
+import re
+import threading
+import timeit
+
+logger = logging.getLogger(__name__)
+
+# number of repeated queries that are logged for slow requests
+TOP_QUERIES = 5
+
+LITERAL_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '))
+
+_render_state = threading.local()
+
+
+def get_fingerprint(sql):
+    """Return the SQL statement without its literal values, so that the
+    same query with different parameters has the same fingerprint."""
+    for pattern, replacement in LITERAL_PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def get_repeated_queries(queries, number=TOP_QUERIES):
+    """Return pairs of the number of executions and the fingerprint of the
+    queries that were executed more than once, most frequent first."""
+    counts = Counter(get_fingerprint(query['sql']) for query in queries)
+    return [(count, fingerprint)
+            for fingerprint, count in counts.most_common(number)
+            if count > 1]
+
+
+def timed_render(render):
+    """Wrap Template._render to add the time of the outermost templates to
+    the render time of the current thread. Included templates are already
+    part of the time of the template that includes them."""
+    def _render(self, context):
+        depth = getattr(_render_state, 'depth', 0)
+        if depth:
+            return render(self, context)
+
+        _render_state.depth = 1
+        start = timeit.default_timer()
+        try:
+            return render(self, context)
+        finally:
+            _render_state.depth = 0
+            _render_state.time = getattr(_render_state, 'time', 0) + (
+                timeit.default_timer() - start)
+    _render.profiled = True
+    return _render
+
+
+def get_timing_header(timings):
+    return ', '.join('%s;dur=%.1f;desc="%s"' % (name, duration * 1000,
+                                                description)
+                     for name, duration, description in timings)
+
+
+class ProfilingMiddleware(object):
+    """Has to be the first middleware, so that the total time includes the
+    other ones."""
+
+    def __init__(self):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+
+        self.slow_request = getattr(settings, 'PROFILING_SLOW_REQUEST', 1.0)
+
+        if not getattr(Template._render, 'profiled', False):
+            Template._render = timed_render(Template._render)
+
+    def process_request(self, request):
+        # pairs of the state of the debug cursor and the position in the
+        # query log of every connection
+        request.profiling_connections = []
+        for connection in connections.all():
+            request.profiling_connections.append(
+                (connection.force_debug_cursor, len(connection.queries_log)))
+            connection.force_debug_cursor = True
+        _render_state.time = 0
+        request.profiling_start = timeit.default_timer()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profiling_view_start = timeit.default_timer()
+
+    def process_response(self, request, response):
+        start = getattr(request, 'profiling_start', None)
+        if start is None:
+            # an earlier middleware answered the request
+            return response
+
+        end = timeit.default_timer()
+        total = end - start
+        view = end - getattr(request, 'profiling_view_start', end)
+
+        queries = []
+        for connection, (force_debug_cursor, position) in zip(
+                connections.all(), request.profiling_connections):
+            queries.extend(list(connection.queries_log)[position:])
+            connection.force_debug_cursor = force_debug_cursor
+            if not (force_debug_cursor or settings.DEBUG):
+                # nobody else reads the log
+                connection.queries_log.clear()
+        sql = sum(float(query['time']) for query in queries)
+        render = getattr(_render_state, 'time', 0)
+
+        response['Server-Timing'] = get_timing_header((
+            ('sql', sql, '%s queries' % len(queries)),
+            ('render', render, 'templates'),
+            ('view', view, 'view'),
+            ('total', total, 'total')))
+
+        if total >= self.slow_request:
+            repeated = get_repeated_queries(queries)
+            logger.warning(
+                "Slow request %s %s: %.0f ms total, %.0f ms in %s queries, "
+                "%.0f ms rendering%s", request.method, request.path,
+                total * 1000, sql * 1000, len(queries), render * 1000,
+                ''.join('\n  %sx %s' % (count, fingerprint)
+                        for count, fingerprint in repeated))
+
+        return response
@@ -0,0 +1,104 @@
+"""Routing of reporting reads to a read-only replica.
+
+All queries go to the primary database unless they are made inside
+use_replica(), which the staff overviews, exports and sidebar windows use.
+The replica is the alias named by the setting DATABASE_REPLICA, e.g. an
+SQLite snapshot refreshed by ./manage.py refresh_replica. Without that
+setting everything stays on the primary.
+
+The replica lags behind, so paths that read what was just written stay on
+the primary:
+
+- Writes always go to the primary, and so do reads outside of use_replica(),
+  e.g. the duplicate checks in the forms and CandidateMixin.
+- use_primary() pins the reads of a block to the primary inside of
+  use_replica(), e.g. for data that is cached.
+- PinPrimaryMiddleware keeps a client on the primary for REPLICA_MAX_LAG
+  seconds after it has posted a form, so that it sees its own changes."""
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from functools import wraps
+import threading
+import time
+
+PIN_SESSION_KEY = 'read-from-primary-until'
+
+_state = threading.local()
+
+
+def get_replica():
+    """Return the alias of the replica or None."""
+    return getattr(settings, 'DATABASE_REPLICA', None)
+
+
+@contextmanager
+def _read_from_replica(value):
+    previous = getattr(_state, 'replica', False)
+    _state.replica = value
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def use_replica():
+    """Read from the replica inside the block, if there is one."""
+    return _read_from_replica(True)
+
+
+def use_primary():
+    """Read from the primary inside the block."""
+    return _read_from_replica(False)
+
+
+def is_pinned(request):
+    session = getattr(request, 'session', None)
+    return bool(session) and session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def reads_from_replica(method):
+    """Decorator for view methods that read from the replica, unless the
+    client has just written something."""
+    @wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        if is_pinned(request):
+            return method(self, request, *args, **kwargs)
+        with use_replica():
+            return method(self, request, *args, **kwargs)
+    return wrapper
+
+
+class PrimaryReplicaRouter(object):
+
+    def db_for_read(self, model, **hints):
+        # pylint: disable=unused-argument
+        if getattr(_state, 'replica', False) and get_replica():
+            return get_replica()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # pylint: disable=unused-argument
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # pylint: disable=unused-argument
+        # the replica is a copy of the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # pylint: disable=unused-argument
+        # the replica is copied from the primary, including the schema
+        return db != get_replica()
+
+
+class PinPrimaryMiddleware(object):
+    """Has to come after SessionMiddleware."""
+
+    def process_response(self, request, response):
+        if (request.method == 'POST' and response.status_code < 400 and
+                getattr(request, 'session', None) is not None and
+                get_replica()):
+            request.session[PIN_SESSION_KEY] = time.time() + getattr(
+                settings, 'REPLICA_MAX_LAG', 300)
+        return response
@@ -104,6 +104,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # keep the connections open between requests
+        'CONN_MAX_AGE': 60,
+        # seconds to wait for a lock, see bwb/database.py for the PRAGMAs
+        'OPTIONS': {'timeout': 20},
     }
 }
 
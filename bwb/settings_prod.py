@@ -65,8 +65,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'bwb.profiling.ProfilingMiddleware',
+    'register.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'bwb.routers.PinPrimaryMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -104,6 +107,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # keep the connections open between requests
+        'CONN_MAX_AGE': 600,
+        # seconds to wait for a lock, see bwb/database.py for the PRAGMAs
+        'OPTIONS': {'timeout': 20},
+    },
+    # read-only snapshot for the staff overviews, see bwb/routers.py
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        # a connection keeps reading the file it opened, so it is closed
+        # after every request to see the snapshots of refresh_replica
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {'timeout': 20},
+    }
+}
+
+DATABASE_ROUTERS = ['bwb.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA = 'replica'
+# ./manage.py refresh_replica runs this often, e.g. from cron
+REPLICA_MAX_LAG = 300
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+# The cache is shared by all worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/cache/bwb',
     }
 }
 
@@ -164,6 +197,20 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'resources/'), )
 
 
+# Profiling of requests, see bwb/profiling.py. Set BWB_PROFILING to turn it
+# on, slow requests are logged.
+
+PROFILING_ENABLED = bool(os.environ.get('BWB_PROFILING'))
+PROFILING_SLOW_REQUEST = 1.0
+
+
+# Metrics at staff/metrics, see register/metrics.py. Scrapers authenticate
+# with the header 'Authorization: Bearer <METRICS_TOKEN>'.
+
+METRICS_TOKEN = os.environ.get('BWB_METRICS_TOKEN')
+METRICS_FLUSH_INTERVAL = 10
+
+
 # Logging
 # https://docs.djangoproject.com/en/1.9/topics/logging/
 
@@ -183,5 +230,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': True,
         },
+        'bwb.profiling': {
+            'handlers': ['file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
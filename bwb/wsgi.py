@@ -14,3 +14,7 @@ import os
 os.environ['DJANGO_SETTINGS_MODULE'] = 'bwb.settings_prod'
 
 application = get_wsgi_application()  # pylint: disable=invalid-name
+
+# imported after the setup of Django, it needs the settings
+from register.metrics import flush_at_exit  # noqa
+flush_at_exit()
@@ -1,62 +1,44 @@
 #!/usr/bin/env python
+"""Fill the database with a synthetic dataset, e.g.
 
-from datetime import timedelta
-from django.utils.dateparse import parse_date
-import os
-import random
-
-from faker import Faker
-
-
-test_email = 'michael.b001@gmx.de'
-
-fake = Faker('de')
-fake.seed(1)
-random.seed(1)
-
-
-def get_random_date():
-    return parse_date('1983-03-31') + timedelta(days=random.randint(-5000,
-                                                                    1000))
-
-
-def populate():
-    for _ in range(100):
-        candidate = add_candidate(first_name=fake.first_name(),
-                                  last_name=fake.last_name(),
-                                  date_of_birth=get_random_date())
-
-        add_registration(candidate=candidate,
-                         bicycle_kind=random.randint(1, 4),
-                         email=fake.email())
-
-
-def add_candidate(first_name, last_name, date_of_birth):
-    return Candidate.objects.create(first_name=first_name,
-                                    last_name=last_name,
-                                    date_of_birth=date_of_birth)
-
-
-def add_registration(candidate, bicycle_kind, email):
-    return UserRegistration.objects.create(candidate=candidate,
-                                           bicycle_kind=bicycle_kind,
-                                           email=email)
+    ./populate.py --candidates 200000 --events 500 --invite-rate 0.4 \\
+        --handout-rate 0.6
 
+See register/dataset.py for the generator.
+"""
+import argparse
+import logging
+import os
 
-def add_event(due_date):
-    return HandoutEvent.objects.create(due_date=due_date)
 
+def get_arguments():
+    parser = argparse.ArgumentParser(description=__doc__.split(',')[0] + '.')
+    parser.add_argument('--candidates', type=int, default=100,
+                        help="Number of candidates with registrations.")
+    parser.add_argument('--events', type=int, default=0,
+                        help="Number of handout events.")
+    parser.add_argument('--invite-rate', type=float, default=0.0,
+                        help="Share of the candidates that are invited.")
+    parser.add_argument('--handout-rate', type=float, default=0.0,
+                        help="Probability that an invited candidate "
+                        "receives a bicycle at the event.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="Number of rows per transaction.")
+    return parser.parse_args()
 
-def add_bicycle():
-    b = Bicycle.objects.create()
-    return b
 
 # Start execution here!
 if __name__ == '__main__':
-    print("Starting FIRST_APP population script...")
+    arguments = get_arguments()
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bwb.settings')
     import django
     django.setup()
-    from register.models import UserRegistration, Candidate, Bicycle
-    from register.models import HandoutEvent
-    populate()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    from register.dataset import populate
+    populate(candidates=arguments.candidates,
+             events=arguments.events,
+             invite_rate=arguments.invite_rate,
+             handout_rate=arguments.handout_rate,
+             seed=arguments.seed,
+             batch_size=arguments.batch_size)
@@ -2,7 +2,8 @@ from django.contrib import admin
 
 from register.models import SiteConfiguration
 from register.models import Candidate, UserRegistration, Bicycle, HandoutEvent
-from register.models import Invitation
+from register.models import Invitation, QueuePosition, OutgoingMessage
+from register.models import LineCounter, MetricSample, LotteryDraw
 
 
 admin.site.register(Candidate)
@@ -10,4 +11,9 @@ admin.site.register(UserRegistration)
 admin.site.register(HandoutEvent)
 admin.site.register(Bicycle)
 admin.site.register(Invitation)
+admin.site.register(LotteryDraw)
+admin.site.register(QueuePosition)
+admin.site.register(OutgoingMessage)
+admin.site.register(LineCounter)
+admin.site.register(MetricSample)
 admin.site.register(SiteConfiguration)
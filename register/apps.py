@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RegisterConfig(AppConfig):
     name = 'register'
+
+    def ready(self):
+        # the models can only be imported once the apps are loaded
+        from register.search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
+
+        # connect the handler that tunes the SQLite connections
+        import bwb.database  # noqa pylint: disable=unused-import
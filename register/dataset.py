@@ -0,0 +1,288 @@
+"""Generation of synthetic datasets.
+
+The data is generated deterministically from a seed and written with
+bulk_create in batches, so that datasets of production size can be created
+to reproduce performance problems locally. It is used by populate.py and by
+the benchmarks."""
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import logging
+import random
+
+from faker import Faker
+
+from register.models import UserRegistration, Candidate, Bicycle
+from register.models import HandoutEvent, Invitation, LineCounter
+from register.models import QueuePosition, normalize_name
+from register.phone import MOBILE_PHONE_PREFIXES
+
+logger = logging.getLogger(__name__)
+
+fake = Faker('de')
+
+# relative frequencies of the bicycle kinds men's, ladies', children's small
+# and children's big bicycle
+BICYCLE_KIND_WEIGHTS = ((1, 45), (2, 35), (3, 8), (4, 12))
+
+# share of registrations with only an email, only a mobile phone number or
+# both
+CONTACT_WEIGHTS = (('email', 60), ('phone', 30), ('both', 10))
+
+# probability that an invited candidate who did not show up is invited again
+REINVITE_RATE = 0.3
+
+REGISTRATION_PERIOD = timedelta(days=2 * 365)
+
+COLORS = ('red', 'blue', 'black', 'white', 'green', 'silver', 'yellow')
+BRANDS = ('Gazelle', 'Kalkhoff', 'Hercules', 'Peugeot', 'Diamant', 'Puky')
+
+
+def get_random_date():
+    return parse_date('1983-03-31') + timedelta(days=random.randint(-5000,
+                                                                    1000))
+
+
+def weighted_choice(weights):
+    total = sum(weight for _, weight in weights)
+    value = random.uniform(0, total)
+    for choice, weight in weights:
+        value -= weight
+        if value <= 0:
+            return choice
+    return weights[-1][0]
+
+
+def get_mobile_number():
+    prefix = random.choice(MOBILE_PHONE_PREFIXES)
+    return '+49%s%07d' % (prefix[1:], random.randint(0, 9999999))
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Allow setting the given auto_now_add fields, which bulk_create would
+    otherwise overwrite with the current time."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def get_date_field(model, name):
+    return model._meta.get_field(name)
+
+
+def bulk_create(model, objects):
+    """Save the objects and return their ids in the order of the objects.
+
+    bulk_create does not return the ids on SQLite, but they are assigned in
+    the order of insertion."""
+    last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    with transaction.atomic():
+        model.objects.bulk_create(objects)
+    return list(model.objects.filter(id__gt=last_id).order_by(
+        'id').values_list('id', flat=True))
+
+
+def create_candidates(number, now, batch_size):
+    """Create number candidates with registrations and return pairs of the
+    candidate id and the date of registration, oldest first.
+
+    batch_size candidates are written in one transaction. Django splits
+    them into statements small enough for SQLite."""
+    keys = set()
+    start = now - REGISTRATION_PERIOD
+    registered = []
+
+    while len(registered) < number:
+        candidates = []
+        registrations = []
+        while len(candidates) < min(batch_size, number - len(registered)):
+            first_name, last_name = fake.first_name(), fake.last_name()
+            date_of_birth = get_random_date()
+
+            # Candidate.get_matching would not allow the duplicate, another
+            # one is drawn instead
+            key = (normalize_name(first_name), normalize_name(last_name),
+                   date_of_birth)
+            if key in keys:
+                continue
+            keys.add(key)
+
+            candidate = Candidate(first_name=first_name, last_name=last_name,
+                                  date_of_birth=date_of_birth)
+            candidate.normalize_names()
+            candidates.append(candidate)
+
+            contact = weighted_choice(CONTACT_WEIGHTS)
+            registrations.append(UserRegistration(
+                bicycle_kind=weighted_choice(BICYCLE_KIND_WEIGHTS),
+                email=fake.email() if contact != 'phone' else '',
+                mobile_number=(get_mobile_number() if contact != 'email'
+                               else ''),
+                date_of_registration=start + timedelta(
+                    seconds=random.randint(
+                        0, int(REGISTRATION_PERIOD.total_seconds())))))
+
+        ids = bulk_create(Candidate, candidates)
+        for candidate_id, registration in zip(ids, registrations):
+            registration.candidate_id = candidate_id
+            registered.append((candidate_id,
+                               registration.date_of_registration))
+
+        with explicit_dates(get_date_field(UserRegistration,
+                                           'date_of_registration')):
+            with transaction.atomic():
+                UserRegistration.objects.bulk_create(registrations)
+
+        logger.info("%s candidates", len(registered))
+
+    registered.sort(key=lambda pair: pair[1])
+    return registered
+
+
+def create_events(number, now):
+    """Create events evenly spread over the registration period and return
+    them ordered by due date."""
+    if not number:
+        return []
+
+    start = now - REGISTRATION_PERIOD
+    interval = REGISTRATION_PERIOD // number
+    events = [HandoutEvent(due_date=start + interval * (index + 1))
+              for index in range(number)]
+    ids = bulk_create(HandoutEvent, events)
+    for event_id, event in zip(ids, events):
+        event.id = event_id
+
+    logger.info("%s events", len(events))
+    return events
+
+
+def get_invitations(candidate_id, date_of_registration, events, due_dates,
+                    handout_rate):
+    """Return the invitations of the candidate and the event at which the
+    bicycle was handed over or None."""
+    # events after the registration
+    first = bisect_left(due_dates, date_of_registration)
+
+    invitations = []
+    while first < len(events):
+        index = random.randint(first, len(events) - 1)
+        event = events[index]
+        invitations.append(Invitation(
+            candidate_id=candidate_id, handout_event_id=event.id,
+            date_of_invitation=event.due_date - timedelta(days=7)))
+
+        if random.random() < handout_rate:
+            return invitations, event
+
+        if random.random() >= REINVITE_RATE:
+            break
+        first = index + 1
+
+    return invitations, None
+
+
+def create_invitations(registered, events, invite_rate, handout_rate,
+                       batch_size):
+    """Invite a share of the candidates and hand over bicycles to a share of
+    the invited ones."""
+    invitations = []
+    bicycles = []
+    number_of_invitations = 0
+    number_of_bicycles = 0
+    due_dates = [event.due_date for event in events]
+
+    def flush():
+        with explicit_dates(get_date_field(Invitation, 'date_of_invitation'),
+                            get_date_field(Bicycle, 'date_of_handout')):
+            with transaction.atomic():
+                Invitation.objects.bulk_create(invitations)
+                Bicycle.objects.bulk_create(bicycles)
+        del invitations[:]
+        del bicycles[:]
+
+    for candidate_id, date_of_registration in registered:
+        if not events or random.random() >= invite_rate:
+            continue
+
+        candidate_invitations, handout_event = get_invitations(
+            candidate_id, date_of_registration, events, due_dates,
+            handout_rate)
+        invitations += candidate_invitations
+        number_of_invitations += len(candidate_invitations)
+
+        if handout_event is not None:
+            number_of_bicycles += 1
+            bicycles.append(add_bicycle(
+                candidate_id=candidate_id,
+                bicycle_number=number_of_bicycles,
+                date_of_handout=handout_event.due_date,
+                save=False))
+
+        if len(invitations) >= batch_size:
+            flush()
+
+    flush()
+    logger.info("%s invitations, %s bicycles", number_of_invitations,
+                number_of_bicycles)
+
+
+def populate(candidates=100, events=0, invite_rate=0.0, handout_rate=0.0,
+             seed=1, batch_size=1000):
+    """Generate the dataset. The same arguments always give the same data."""
+    fake.seed_instance(seed)
+    random.seed(seed)
+
+    # all dates are relative to a fixed point, so that the data does not
+    # depend on the day it is generated
+    now = timezone.make_aware(timezone.datetime(2016, 6, 1, 12),
+                              timezone.utc)
+
+    registered = create_candidates(candidates, now, batch_size)
+    handout_events = create_events(events, now)
+    create_invitations(registered, handout_events, invite_rate,
+                       handout_rate, batch_size)
+
+    # bulk_create does not send signals, so the derived data is computed
+    # once for everything
+    Candidate.update_all_statuses()
+    LineCounter.rebuild()
+    QueuePosition.rebuild()
+
+
+def add_candidate(first_name, last_name, date_of_birth):
+    return Candidate.objects.create(first_name=first_name,
+                                    last_name=last_name,
+                                    date_of_birth=date_of_birth)
+
+
+def add_registration(candidate, bicycle_kind, email):
+    return UserRegistration.objects.create(candidate=candidate,
+                                           bicycle_kind=bicycle_kind,
+                                           email=email)
+
+
+def add_event(due_date):
+    return HandoutEvent.objects.create(due_date=due_date)
+
+
+def add_bicycle(candidate_id, bicycle_number, date_of_handout=None,
+                save=True):
+    bicycle = Bicycle(candidate_id=candidate_id,
+                      bicycle_number=bicycle_number,
+                      lock_combination=random.randint(0, 9999),
+                      color=random.choice(COLORS),
+                      brand=random.choice(BRANDS),
+                      date_of_handout=date_of_handout)
+    if save:
+        bicycle.save()
+    return bicycle
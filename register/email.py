@@ -1,11 +1,15 @@
 from django.conf import settings
 from django.conf.global_settings import DATETIME_FORMAT
-from django.core.mail import EmailMessage, send_mail
+from django.core.mail import EmailMessage, get_connection
 from django.core.urlresolvers import reverse
 from django.utils import translation, formats
 from django.utils.translation import ugettext
 
 import logging
+import smtplib
+import socket
+
+from register.metrics import timed_delivery
 
 logger = logging.getLogger(__name__)
 
@@ -37,14 +41,15 @@ def get_url_parameter(name, value):
     return ""
 
 
-def send_message(registration, subject, message):
-
+def get_email_message(registration, subject, message, connection=None):
+    """Return the email that delivers the message to the registration, either
+    directly or via the SMS gateway."""
     if registration.email:
-        send_mail(subject=subject,
-                  message=message,
-                  from_email=settings.EMAIL_FROM_ADDRESS,
-                  recipient_list=[registration.email],
-                  fail_silently=False)
+        return EmailMessage(subject=subject,
+                            body=message,
+                            from_email=settings.EMAIL_FROM_ADDRESS,
+                            to=[registration.email],
+                            connection=connection)
 
     elif registration.mobile_number:
         smsgate_headers = {
@@ -57,44 +62,118 @@ def send_message(registration, subject, message):
             logger.warning("WARNING: Sending an SMS with more than 160 " \
                            "characters. The message may get cut off.")
 
-        email = EmailMessage(subject=subject,
-                             body=message,
-                             headers=smsgate_headers,
-                             from_email=settings.EMAIL_FROM_ADDRESS,
-                             to=[settings.SMS_GATEWAY_ADDRESS])
-
-        email.send(fail_silently=False)
+        return EmailMessage(subject=subject,
+                            body=message,
+                            headers=smsgate_headers,
+                            from_email=settings.EMAIL_FROM_ADDRESS,
+                            to=[settings.SMS_GATEWAY_ADDRESS],
+                            connection=connection)
     else:
         assert False, "Messages other than email or sms are currently not " \
                       "supported."
 
 
-def send_message_after_invitation(candidate, handout_event):
+def get_channel(registration):
+    """Return how messages reach the registration, 'email' or 'sms'."""
+    return 'email' if registration.email else 'sms'
+
+
+def send_message(registration, subject, message, connection=None):
+    with timed_delivery(get_channel(registration)):
+        get_email_message(registration, subject, message,
+                          connection=connection).send(fail_silently=False)
+
+
+def close_connection(connection):
+    try:
+        connection.close()
+    except (smtplib.SMTPException, socket.error):
+        pass
+
+
+def is_connection_error(error):
+    """Is the error about the connection to the mail server rather than the
+    message? On Python 3 every SMTPException is a socket.error as well."""
+    return (isinstance(error, smtplib.SMTPServerDisconnected) or
+            (isinstance(error, socket.error) and
+             not isinstance(error, smtplib.SMTPException)))
+
+
+def send_over_connection(connection, email):
+    """Send the email and reconnect once if the connection has dropped."""
+    try:
+        connection.open()
+        connection.send_messages([email])
+    except (smtplib.SMTPServerDisconnected, socket.error) as error:
+        if not is_connection_error(error):
+            raise
+        logger.info("Connection to the mail server lost, reconnecting.")
+        close_connection(connection)
+        connection.open()
+        connection.send_messages([email])
+
+
+def send_messages(messages, connection=None):
+    """Send all (registration, subject, message) triples over a single
+    connection to the mail server.
+
+    Returns a list with one entry per message, which is None if the message
+    has been sent and the exception otherwise."""
+    if connection is None:
+        connection = get_connection(fail_silently=False)
+
+    messages = list(messages)
+    errors = []
+    try:
+        for registration, subject, message in messages:
+            try:
+                email = get_email_message(registration, subject, message)
+                with timed_delivery(get_channel(registration)):
+                    send_over_connection(connection, email)
+            except Exception as error:  # pylint: disable=broad-except
+                if is_connection_error(error):
+                    # the mail server is not reachable, give up on the batch
+                    logger.exception("Connection to the mail server failed.")
+                    errors += [error] * (len(messages) - len(errors))
+                    break
+                logger.exception("Sending message to %s failed.",
+                                 registration)
+                errors.append(error)
+            else:
+                errors.append(None)
+    finally:
+        close_connection(connection)
+
+    return errors
+
+
+def get_message_after_invitation(candidate, handout_event):
+    """Return subject and text of the notification about an invitation."""
     registration = candidate.user_registration
 
-    if registration:
-        with translation.override(registration.language):
-            name = "%s %s" % (candidate.first_name, candidate.last_name)
-            header = "%s %s," % (ugettext("Hello"), name)
+    with translation.override(registration.language):
+        name = "%s %s" % (candidate.first_name, candidate.last_name)
+        header = "%s %s," % (ugettext("Hello"), name)
 
-            body = (
-                ugettext("We have a ") +
-                registration.get_bicycle_kind_display() +
-                ugettext(" that is reserved for you. Please come by on ") +
-                formats.date_format(handout_event.due_date, DATETIME_FORMAT) +
-                ugettext(", so that we can fix it together with your help."))
+        body = (
+            ugettext("We have a ") +
+            registration.get_bicycle_kind_display() +
+            ugettext(" that is reserved for you. Please come by on ") +
+            formats.date_format(handout_event.due_date, DATETIME_FORMAT) +
+            ugettext(", so that we can fix it together with your help."))
 
-            newline = "\n"
-            footer = ugettext("Your,") + newline + ugettext('BwB-Team')
+        newline = "\n"
+        footer = ugettext("Your,") + newline + ugettext('BwB-Team')
 
-            message = newline.join((header, newline, body, newline, footer))
+        message = newline.join((header, newline, body, newline, footer))
 
-            subject = ugettext('BwB - Get your bike')
+        subject = ugettext('BwB - Get your bike')
 
-        send_message(registration, subject, message)
+    return subject, message
 
 
-def send_message_after_registration(registration, request):
+def get_message_after_registration(registration, request):
+    """Return subject and text of the notification about a registration."""
     candidate = registration.candidate
 
     name = "%s %s" % (candidate.first_name, candidate.last_name)
@@ -124,4 +203,4 @@ def send_message_after_registration(registration, request):
     message = newline.join((header, newline, body, newline, footer))
     subject = ugettext('BwB - Registration')
 
-    send_message(registration, subject, message)
+    return subject, message
@@ -6,15 +6,30 @@ from django.core.exceptions import ValidationError
 from django.forms.widgets import SelectDateWidget, TextInput
 from django.utils.translation import ugettext as _, ugettext_lazy
 from phonenumber_field.formfields import PhoneNumberField
-import phonenumbers
-from phonenumbers.phonenumberutil import NumberParseException
 
 from register.models import UserRegistration, Candidate, SiteConfiguration
+from register.models import LineCounter
+# pylint: disable=unused-import
+from register.phone import BAD_FORMAT_NUMBER, INVALID_NUMBER  # noqa
+from register.phone import INVALID_MOBILE_NUMBER  # noqa
+from register.phone import MOBILE_PHONE_PREFIXES  # noqa
+from register.phone import parse_mobile_number  # noqa
+from register.phone import parse_phone_number
 
 
-# ToDo: Only take people into account that do not have a bicycle.
 def open_for_registration():
-    return Candidate.total_in_line() < SiteConfiguration.get_solo(
+    return LineCounter.get_value() < SiteConfiguration.get_solo(
+    ).max_number_of_registrations
+
+
+def line_within_limit():
+    """Whether the line, including the registrations of the current
+    transaction, does not exceed the maximum number of registrations.
+
+    Creating a Candidate increments the counter and locks it until the end
+    of the transaction, so concurrent registrations cannot exceed the
+    limit."""
+    return LineCounter.get_value() <= SiteConfiguration.get_solo(
     ).max_number_of_registrations
 
 
@@ -22,10 +37,6 @@ TOO_MANY_REGISTRATIONS_ERROR = _(
     'Due to too many registrations, it is currently not possible to register '
     'for a bicycle.')
 
-BAD_FORMAT_NUMBER = _('This is not a properly formatted phone number.')
-INVALID_NUMBER = _('This is not a valid phone number.')
-INVALID_MOBILE_NUMBER = _('This is not a valid mobile phone number.')
-
 TERMS_AND_CONDITIONS_ERROR = _(
     'You need to agree with the terms and conditions.')
 MULTIPLE_REGISTRATION_ERROR = _(
@@ -34,72 +45,13 @@ MULTIPLE_REGISTRATION_ERROR = _(
 EMAIL_OR_PHONE_ERROR = _('Please fill out email or mobile phone number.')
 
 
-# ToDo: get these prefixes from somewhere else, otherwise they will
-# eventually become outdated
-MOBILE_PHONE_PREFIXES = ['01511',  # Deutsche Telekom
-                         '01512',
-                         '01514',
-                         '01515',
-                         '01516',
-                         '01517',
-                         '0160',
-                         '0170',
-                         '0171',
-                         '0175',
-                         '01520',  # Vodafone
-                         '01521',
-                         '01522',
-                         '01523',
-                         '01525',
-                         '01526',
-                         '01529',
-                         '0162',
-                         '0172',
-                         '0173',
-                         '0174',
-                         '01570',  # E-Plus
-                         '01573',
-                         '01575',
-                         '01577',
-                         '01578',
-                         '01579',
-                         '0163',
-                         '0177',
-                         '0178',
-                         '01590',  # O2
-                         '0176',
-                         '0179']
-
-
-def parse_mobile_number(value):
-    def is_mobile_number(parsed_number):
-        for prefix in MOBILE_PHONE_PREFIXES:
-            if str(parsed_number.national_number).startswith(prefix[1:]):
-                return True
-        return False
-
-    try:
-        parsed_number = phonenumbers.parse(value, 'DE')
-    except NumberParseException:
-        raise ValidationError(BAD_FORMAT_NUMBER)
-
-    if not phonenumbers.is_valid_number_for_region(parsed_number, 'de'):
-        raise ValidationError(INVALID_NUMBER)
-
-    if not is_mobile_number(parsed_number):
-        raise ValidationError(INVALID_MOBILE_NUMBER)
-
-    return phonenumbers.format_number(parsed_number,
-                                      phonenumbers.PhoneNumberFormat.INTERNATIONAL)
-
-
 class MyPhoneNumberField(PhoneNumberField):
 
     def to_python(self, value):
-        if value:
-            value = parse_mobile_number(value)
+        if value in self.empty_values:
+            return super(MyPhoneNumberField, self).to_python(value)
 
-        return super(MyPhoneNumberField, self).to_python(value)
+        return parse_phone_number(value)
 
 
 class SelectDateOfBirthWidget(SelectDateWidget):
@@ -187,12 +139,8 @@ class RegistrationForm(forms.ModelForm):
                                      css_class='col-xs-3 btn-info'))
 
     def clean_mobile_number(self):
-        mobile_number_uncleaned = self.data.get('mobile_number')
-
-        if mobile_number_uncleaned:
-            return parse_mobile_number(mobile_number_uncleaned)
-
-        return None
+        # already parsed by MyPhoneNumberField
+        return self.cleaned_data.get('mobile_number') or None
 
     def clean_agree(self):
         agree = bool(self.data.get('agree'))
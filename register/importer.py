@@ -0,0 +1,217 @@
+"""Bulk import of Candidates with their registrations from CSV files.
+
+The rows are read as a stream and handled in chunks. Every chunk is
+validated with a few queries and written with bulk_create, which does not
+send any signals, so the derived data is updated once at the end."""
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.dateparse import parse_date
+import csv
+from itertools import islice
+
+from register.forms import MULTIPLE_REGISTRATION_ERROR, EMAIL_OR_PHONE_ERROR
+from register.models import Candidate, UserRegistration, LineCounter
+from register.models import QueuePosition, MAX_NAME_LENGTH, normalize_name
+from register.phone import validate_many
+from register.utils import CHUNK_SIZE
+
+
+COLUMNS = ('first_name', 'last_name', 'date_of_birth', 'bicycle_kind',
+           'email', 'mobile_number', 'language')
+REQUIRED_COLUMNS = ('first_name', 'last_name', 'date_of_birth',
+                    'bicycle_kind')
+
+BICYCLE_KINDS = dict((str(kind), kind)
+                     for kind, _ in UserRegistration.BICYCLE_CHOICES)
+
+
+class ImportResult(object):
+
+    def __init__(self):
+        self.imported = 0
+        # pairs of line number and error message
+        self.rejected = []
+        # why the rest of the file could not be read, None if it was read
+        self.error = None
+
+    def reject(self, line_number, error):
+        self.rejected.append((line_number, force_text(error)))
+
+
+def get_key(first_name, last_name, date_of_birth):
+    """Key of a Candidate with the semantics of Candidate.get_matching."""
+    return date_of_birth, normalize_name(first_name), normalize_name(last_name)
+
+
+def validate_row(row):
+    """Return the cleaned values of the row without the mobile phone number
+    or raise a ValidationError."""
+    values = dict((column, (row.get(column) or '').strip())
+                  for column in COLUMNS)
+
+    for column in REQUIRED_COLUMNS:
+        if not values[column]:
+            raise ValidationError('%s is missing.' % column)
+
+    for column in ('first_name', 'last_name'):
+        if len(values[column]) > MAX_NAME_LENGTH:
+            raise ValidationError('%s is too long.' % column)
+
+    try:
+        values['date_of_birth'] = parse_date(values['date_of_birth'])
+    except ValueError:
+        values['date_of_birth'] = None
+    if values['date_of_birth'] is None:
+        raise ValidationError('date_of_birth is not a valid date.')
+
+    if values['bicycle_kind'] not in BICYCLE_KINDS:
+        raise ValidationError('bicycle_kind is not one of %s.' % ', '.join(
+            sorted(BICYCLE_KINDS)))
+    values['bicycle_kind'] = BICYCLE_KINDS[values['bicycle_kind']]
+
+    if values['email']:
+        validate_email(values['email'])
+
+    if not (values['email'] or values['mobile_number']):
+        raise ValidationError(EMAIL_OR_PHONE_ERROR)
+
+    return values
+
+
+def get_existing_keys(rows):
+    """Return the keys of the Candidates in the database that match one of
+    the rows."""
+    dates = set(row['date_of_birth'] for row in rows)
+    existing = Candidate.objects.filter(date_of_birth__in=dates).values_list(
+        'date_of_birth', 'first_name_norm', 'last_name_norm')
+    return set(existing)
+
+
+def import_chunk(numbered_rows, seen_keys, result):
+    """Validate and write a chunk of (line number, row) pairs."""
+    valid_rows = []
+    mobile_numbers = validate_many(
+        [row.get('mobile_number') or '' for _, row in numbered_rows
+         if (row.get('mobile_number') or '').strip()])
+    mobile_numbers = iter(mobile_numbers)
+
+    for line_number, row in numbered_rows:
+        mobile_number, error = None, None
+        if (row.get('mobile_number') or '').strip():
+            mobile_number, error = next(mobile_numbers)
+
+        try:
+            if error:
+                raise ValidationError(error)
+            values = validate_row(row)
+        except ValidationError as validation_error:
+            result.reject(line_number, '; '.join(
+                force_text(message) for message in validation_error.messages))
+            continue
+
+        values['mobile_number'] = mobile_number
+        values['line_number'] = line_number
+        valid_rows.append(values)
+
+    existing_keys = get_existing_keys(valid_rows)
+
+    new_rows = {}
+    for values in valid_rows:
+        key = get_key(values['first_name'], values['last_name'],
+                      values['date_of_birth'])
+        if key in existing_keys or key in seen_keys:
+            result.reject(values['line_number'], MULTIPLE_REGISTRATION_ERROR)
+            continue
+        seen_keys.add(key)
+        new_rows[key] = values
+
+    if not new_rows:
+        return []
+
+    candidates = []
+    for values in new_rows.values():
+        candidate = Candidate(first_name=values['first_name'],
+                              last_name=values['last_name'],
+                              date_of_birth=values['date_of_birth'])
+        candidate.normalize_names()
+        candidates.append(candidate)
+
+    with transaction.atomic():
+        Candidate.objects.bulk_create(candidates)
+
+        # bulk_create does not set the ids on SQLite, the keys are unique
+        candidate_ids = dict(
+            ((date_of_birth, first_name_norm, last_name_norm), candidate_id)
+            for candidate_id, date_of_birth, first_name_norm, last_name_norm
+            in Candidate.objects.filter(
+                date_of_birth__in=set(key[0] for key in new_rows)).values_list(
+                    'id', 'date_of_birth', 'first_name_norm', 'last_name_norm')
+            if (date_of_birth, first_name_norm, last_name_norm) in new_rows)
+
+        registrations = []
+        for key, values in new_rows.items():
+            registration = UserRegistration(
+                candidate_id=candidate_ids[key],
+                bicycle_kind=values['bicycle_kind'],
+                email=values['email'],
+                mobile_number=values['mobile_number'] or '')
+            if values['language']:
+                registration.language = values['language']
+            registrations.append(registration)
+        UserRegistration.objects.bulk_create(registrations)
+
+        LineCounter.add(len(candidates))
+
+    result.imported += len(candidates)
+    return list(candidate_ids.values())
+
+
+def decode_row(row):
+    """Return the row of a CSV reader of Python 2 with text values."""
+    return dict((key, value.decode('utf-8') if isinstance(value, bytes)
+                 else value) for key, value in row.items())
+
+
+def read_chunks(lines, chunk_size):
+    """Yield lists of (line number, row) pairs of the CSV lines."""
+    if six.PY2:
+        # the csv module of Python 2 only reads byte strings
+        reader = csv.DictReader(line.encode('utf-8') for line in lines)
+        rows = ((reader.line_num, decode_row(row)) for row in reader)
+    else:
+        reader = csv.DictReader(lines)
+        rows = ((reader.line_num, row) for row in reader)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_candidates(lines, chunk_size=CHUNK_SIZE):
+    """Import the Candidates of the CSV lines, which need a header with the
+    columns of COLUMNS. The columns email, mobile_number and language are
+    optional.
+
+    Returns an ImportResult. If the file cannot be decoded or parsed, the
+    chunks before the error stay imported and the error is recorded."""
+    result = ImportResult()
+    seen_keys = set()
+    imported_ids = []
+
+    try:
+        for chunk in read_chunks(lines, chunk_size):
+            imported_ids += import_chunk(chunk, seen_keys, result)
+    except (UnicodeDecodeError, csv.Error) as error:
+        result.error = force_text(error)
+    finally:
+        # the chunks are already committed and need their derived data
+        if imported_ids:
+            Candidate.update_statuses(imported_ids)
+            QueuePosition.rebuild()
+
+    result.rejected.sort()
+    return result
@@ -0,0 +1,43 @@
+from django.db import transaction
+from django.utils import timezone
+
+from register.lottery import draw_winners, get_pool, new_seed
+from register.models import Candidate, Invitation, LotteryDraw
+from register.models import SiteConfiguration
+from register.outbox import queue_messages_after_invitation
+from register.utils import chunks
+
+
+def invite_winners(event, number_of_winners, notify=True, seed=None):
+    """Invite the winners of a lottery to the event.
+
+    number_of_winners maps each kind of bicycle to the number of candidates
+    to invite. Without a seed a new one is drawn. Returns the ids of the
+    invited candidates."""
+    if seed is None:
+        seed = new_seed()
+    date_of_draw = timezone.now()
+    pool = get_pool([event], date_of_draw)
+    winners = draw_winners(pool, number_of_winners, seed,
+                           SiteConfiguration.get_solo(
+                           ).max_number_of_autoinvites)
+
+    with transaction.atomic():
+        LotteryDraw.objects.create(handout_event=event, seed=seed,
+                                   date_of_draw=date_of_draw,
+                                   pool_size=len(pool.candidate_ids),
+                                   number_of_winners=len(winners))
+        # bulk_create does not send post_save, so the status is updated here
+        Invitation.objects.bulk_create(
+            [Invitation(handout_event=event, candidate_id=candidate_id)
+             for candidate_id in winners])
+        Candidate.update_statuses(winners)
+
+        if notify:
+            for chunk in chunks(winners):
+                queue_messages_after_invitation(
+                    candidates=Candidate.objects.filter(
+                        id__in=chunk).select_related('user_registration'),
+                    handout_event=event)
+
+    return winners
@@ -0,0 +1,125 @@
+"""Lottery of the automatic invitations.
+
+The pool holds everybody who may be invited to some events as NumPy
+arrays. The chance of a candidate grows with the time since the
+registration and shrinks with every invitation the candidate already got,
+down to nothing at max_number_of_autoinvites. The winners are drawn
+without replacement with the method of Efraimidis and Spirakis, which
+takes a few milliseconds for a pool of a million candidates.
+
+The winners only depend on the pool, the numbers of winners and the seed.
+invite_winners() and register.planner record the seed and the time of
+the draw, which the waiting times are measured against, in a LotteryDraw."""
+from collections import namedtuple
+from datetime import datetime
+from django.db.models import Count, F, Func, IntegerField
+from django.utils import timezone
+from itertools import chain
+import numpy as np
+import random
+
+from register.models import Candidate, UserRegistration
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# everybody has the chance of somebody waiting this many days more
+BASE_WAITING_DAYS = 1
+
+# RandomState accepts seeds below 2 ** 32, PositiveIntegerField below 2 ** 31
+MAX_SEED = 2 ** 31 - 1
+
+Pool = namedtuple('Pool', ['candidate_ids', 'bicycle_kinds',
+                           'waiting_days', 'invitation_counts'])
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class EpochSeconds(Func):
+    """Seconds since 1970 of a datetime, in SQLite. The '%' of the format
+    is doubled twice, for the template and for the query parameters."""
+    function = 'strftime'
+    template = "CAST(%(function)s('%%%%s', %(expressions)s) AS INTEGER)"
+
+    def __init__(self, expression, **extra):
+        super(EpochSeconds, self).__init__(
+            expression, output_field=IntegerField(), **extra)
+
+
+def new_seed():
+    return random.SystemRandom().randint(0, MAX_SEED)
+
+
+def get_pool(events, now):
+    """Return the candidates with a registration and without a bicycle that
+    have not been invited to any of the events, ordered by id."""
+    rows = Candidate.objects.filter(
+        bicycle__isnull=True,
+        user_registration__isnull=False).exclude(
+            invitations__handout_event__in=events).annotate(
+                number_of_invitations=Count('invitations'),
+                registered=EpochSeconds(
+                    F('user_registration__date_of_registration'))).order_by(
+                        'id').values_list(
+                            'id', 'user_registration__bicycle_kind',
+                            'registered', 'number_of_invitations').iterator()
+
+    # the rows are read straight into one array of four columns
+    columns = np.fromiter(chain.from_iterable(rows),
+                          dtype=np.int64).reshape(-1, 4).T
+    return Pool(
+        candidate_ids=columns[0].copy(),
+        bicycle_kinds=columns[1].copy(),
+        waiting_days=((now - EPOCH).total_seconds() - columns[2]) /
+        SECONDS_PER_DAY,
+        invitation_counts=columns[3].copy())
+
+
+def get_weights(pool, max_number_of_autoinvites):
+    """Return the chances of the candidates of the pool, relative to each
+    other."""
+    waiting = np.maximum(pool.waiting_days, 0) + BASE_WAITING_DAYS
+    remaining = np.maximum(max_number_of_autoinvites - pool.invitation_counts,
+                           0) / float(max(max_number_of_autoinvites, 1))
+    return waiting * remaining
+
+
+def draw(candidate_ids, weights, number, random_state):
+    """Draw up to number of the candidates without replacement, each with a
+    chance proportional to its weight. Candidates of weight 0 are never
+    drawn. Returns the ids of the winners in the order they were drawn."""
+    number = min(number, np.count_nonzero(weights > 0))
+    if number <= 0:
+        return candidate_ids[:0]
+
+    # the winners have the largest keys u ** (1 / weight), here their logs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keys = np.log(1.0 - random_state.random_sample(len(weights))) / weights
+    keys[weights <= 0] = -np.inf
+
+    winners = np.argpartition(-keys, number - 1)[:number]
+    winners = winners[np.argsort(-keys[winners], kind='mergesort')]
+    return candidate_ids[winners]
+
+
+def draw_by_kind(pool, number_of_winners, seed, max_number_of_autoinvites):
+    """Return a dict of the ids of the winners of the lottery, in the order
+    they were drawn, by kind of bicycle. number_of_winners maps each kind of
+    bicycle to the number of candidates to draw."""
+    random_state = np.random.RandomState(seed)
+    weights = get_weights(pool, max_number_of_autoinvites)
+
+    winners = {}
+    for kind, _ in UserRegistration.BICYCLE_CHOICES:
+        of_kind = pool.bicycle_kinds == kind
+        winners[kind] = draw(pool.candidate_ids[of_kind], weights[of_kind],
+                             number_of_winners.get(kind, 0),
+                             random_state).tolist()
+    return winners
+
+
+def draw_winners(pool, number_of_winners, seed, max_number_of_autoinvites):
+    """Return the ids of the winners of the lottery."""
+    winners = draw_by_kind(pool, number_of_winners, seed,
+                           max_number_of_autoinvites)
+    return sum((winners[kind]
+                for kind, _ in UserRegistration.BICYCLE_CHOICES), [])
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+import time
+
+from register.metrics import registry
+from register.outbox import deliver_due_messages, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = ("Deliver the pending messages of the outbox. To try it out "
+            "locally, start a debugging server with 'python -m smtpd -n -c "
+            "DebuggingServer localhost:1025' and set EMAIL_HOST to "
+            "'localhost', EMAIL_PORT to 1025 and EMAIL_USE_TLS to False.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running and poll the outbox.")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to wait if the outbox is empty.")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Maximum number of messages per round.")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help="Give up on a message after so many "
+                                 "failures.")
+
+    def handle(self, *args, **options):
+        try:
+            self.deliver(options)
+        finally:
+            # the metrics of the last round would get lost otherwise
+            registry.flush()
+
+    def deliver(self, options):
+        while True:
+            sent, failed = deliver_due_messages(
+                limit=options['batch_size'],
+                max_attempts=options['max_attempts'])
+
+            if sent or failed:
+                self.stdout.write("%s sent, %s failed" % (sent, failed))
+
+            if not options['loop']:
+                break
+
+            if sent + failed < options['batch_size']:
+                # the registry only flushes on the next increment
+                registry.flush()
+                time.sleep(options['interval'])
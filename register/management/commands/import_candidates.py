@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+import csv
+import io
+
+from register.importer import COLUMNS, import_candidates
+from register.utils import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = ("Import candidates with their registrations from a CSV file "
+            "with the columns %s." % ', '.join(COLUMNS))
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file encoded in UTF-8.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help="Number of rows per transaction.")
+        parser.add_argument('--rejected',
+                            help="Write the rejected lines to this CSV file.")
+
+    def handle(self, *args, **options):
+        # utf-8-sig drops the byte order mark that Excel writes
+        with io.open(options['path'], encoding='utf-8-sig',
+                     newline='') as lines:
+            result = import_candidates(lines,
+                                       chunk_size=options['chunk_size'])
+
+        self.stdout.write("%s imported, %s rejected" % (
+            result.imported, len(result.rejected)))
+
+        if options['rejected']:
+            with io.open(options['rejected'], 'w', encoding='utf-8',
+                         newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(('line', 'error'))
+                writer.writerows(result.rejected)
+        else:
+            for line_number, error in result.rejected:
+                self.stderr.write("line %s: %s" % (line_number, error))
+
+        if result.error:
+            raise CommandError(
+                "The file could not be read after %s were imported: %s" % (
+                    result.imported, result.error))
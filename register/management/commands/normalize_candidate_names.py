@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from register.models import Candidate
+
+
+class Command(BaseCommand):
+    help = ("Fill the normalized names of all candidates, which are used to "
+            "find duplicate registrations.")
+
+    def handle(self, *args, **options):
+        Candidate.update_normalized_names()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from register.models import LineCounter
+
+
+class Command(BaseCommand):
+    help = "Count the candidates without a bicycle and store the result."
+
+    def handle(self, *args, **options):
+        LineCounter.rebuild()
+        self.stdout.write("%s in line" % LineCounter.get_value())
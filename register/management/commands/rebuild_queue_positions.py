@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from register.models import QueuePosition, UserRegistration
+
+
+class Command(BaseCommand):
+    help = "Rebuild the index of the positions in line of all registrations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of rows inserted per query.")
+
+    def handle(self, *args, **options):
+        QueuePosition.rebuild(batch_size=options['batch_size'])
+
+        for kind, name in UserRegistration.BICYCLE_CHOICES:
+            self.stdout.write("%s: %s in line" % (
+                name, QueuePosition.objects.filter(bicycle_kind=kind).count()))
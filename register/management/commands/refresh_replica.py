@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from bwb.database import copy_database
+
+
+class Command(BaseCommand):
+    help = ("Replace the SQLite replica with a snapshot of the primary "
+            "database. Run it at least every REPLICA_MAX_LAG seconds.")
+
+    def handle(self, *args, **options):
+        replica = getattr(settings, 'DATABASE_REPLICA', None)
+        if replica is None:
+            raise CommandError("DATABASE_REPLICA is not set.")
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        primary.ensure_connection()
+        copy_database(primary.connection,
+                      connections[replica].settings_dict['NAME'])
+        self.stdout.write("Copied %s to %s" % (
+            primary.settings_dict['NAME'],
+            connections[replica].settings_dict['NAME']))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from register.models import Candidate
+
+
+class Command(BaseCommand):
+    help = "Recompute the status of all candidates, e.g. after a bulk import."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help="Number of candidates per statement.")
+
+    def handle(self, *args, **options):
+        Candidate.update_all_statuses(chunk_size=options['chunk_size'])
+
+        for status, name in Candidate.CANDIDATE_STATUS:
+            self.stdout.write("%s: %s" % (
+                name, Candidate.objects.filter(status=status).count()))
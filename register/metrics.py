@@ -0,0 +1,231 @@
+"""Metrics in the Prometheus exposition format.
+
+Every process counts in memory and adds its increments to the shared
+MetricSample rows at most every METRICS_FLUSH_INTERVAL seconds, so the
+metrics of all WSGI workers are aggregated in the database without a write
+per event. Histograms are stored as their cumulative buckets, sum and count,
+like Prometheus does. Gauges are computed when the metrics are read.
+Long-running processes flush the rest when they exit, see flush_at_exit().
+
+register.models imports register.email, which reports to this module, so
+the models are imported where they are used."""
+from collections import defaultdict
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+import atexit
+import threading
+import time
+import timeit
+
+FLUSH_INTERVAL = getattr(settings, 'METRICS_FLUSH_INTERVAL', 10)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500)
+
+REGISTRATIONS = 'bwb_registrations_total'
+INVITATIONS = 'bwb_invitations_total'
+INVITATIONS_PER_RUN = 'bwb_invitations_per_run'
+MESSAGE_LATENCY = 'bwb_message_send_seconds'
+MESSAGE_FAILURES = 'bwb_message_failures_total'
+REQUEST_LATENCY = 'bwb_request_seconds'
+QUEUE_LENGTH = 'bwb_queue_length'
+LINE_LENGTH = 'bwb_line_length'
+
+# type and help text of every metric
+METRICS = {
+    REGISTRATIONS: ('counter', "Registrations by bicycle kind."),
+    INVITATIONS: ('counter', "Invitations by source."),
+    INVITATIONS_PER_RUN: ('histogram',
+                          "Number of invitations per automatic run."),
+    MESSAGE_LATENCY: ('histogram',
+                      "Time to hand a message to the mail server."),
+    MESSAGE_FAILURES: ('counter', "Messages that could not be sent."),
+    REQUEST_LATENCY: ('histogram', "Response time by URL name."),
+    QUEUE_LENGTH: ('gauge', "Registrations in line by bicycle kind."),
+    LINE_LENGTH: ('gauge', "Candidates without a bicycle.")}
+
+HISTOGRAM_SUFFIXES = ('_bucket', '_sum', '_count')
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def format_labels(labels):
+    """Return the label pairs in the Prometheus format, sorted by name."""
+    return ','.join('%s="%s"' % (name, escape(value))
+                    for name, value in sorted(labels.items()))
+
+
+def get_bucket_labels(labels, bound):
+    """Return the labels of a histogram bucket, le comes last."""
+    bound = '+Inf' if bound == float('inf') else repr(float(bound))
+    return ','.join(filter(None, (format_labels(labels),
+                                  'le="%s"' % bound)))
+
+
+class Registry(object):
+    """Increments of this process that have not been written yet."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = defaultdict(float)
+        self.last_flush = time.time()
+
+    def add(self, name, value=1, **labels):
+        with self.lock:
+            self.pending[(name, format_labels(labels))] += value
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Add the value to the histogram."""
+        with self.lock:
+            # empty buckets are added as well, so that all of them exist
+            for bound in buckets + (float('inf'),):
+                self.pending[(name + '_bucket', get_bucket_labels(
+                    labels, bound))] += 1 if value <= bound else 0
+            self.pending[(name + '_sum', format_labels(labels))] += value
+            self.pending[(name + '_count', format_labels(labels))] += 1
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Add the pending increments to the shared values."""
+        from register.models import MetricSample
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+            self.last_flush = time.time()
+
+        for (name, labels), value in sorted(pending.items()):
+            with transaction.atomic():
+                if MetricSample.objects.filter(
+                        name=name, labels=labels).update(
+                            value=F('value') + value):
+                    continue
+                try:
+                    with transaction.atomic():
+                        MetricSample.objects.create(name=name, labels=labels,
+                                                    value=value)
+                except IntegrityError:
+                    # another process created it in the meantime
+                    MetricSample.objects.filter(
+                        name=name, labels=labels).update(
+                            value=F('value') + value)
+
+
+registry = Registry()
+
+
+def flush_at_exit():
+    """Write the pending increments of this process when it exits, e.g. when
+    a WSGI worker is recycled."""
+    atexit.register(registry.flush)
+
+
+def count_registration(registration):
+    registry.add(REGISTRATIONS, bicycle_kind=registration.bicycle_kind)
+
+
+def count_invitations(number, source):
+    registry.add(INVITATIONS, number, source=source)
+    if source == 'auto':
+        registry.observe(INVITATIONS_PER_RUN, number, buckets=SIZE_BUCKETS)
+
+
+class timed_delivery(object):
+    """Context manager that records the time of sending a message over the
+    channel and counts the failures."""
+    # pylint: disable=invalid-name
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.start = None
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        registry.observe(MESSAGE_LATENCY,
+                         timeit.default_timer() - self.start,
+                         channel=self.channel)
+        if exc_type is not None:
+            registry.add(MESSAGE_FAILURES, channel=self.channel)
+        return False
+
+
+def get_gauges():
+    """Return triples of name, labels and value of the gauges."""
+    from register.models import QueuePosition, LineCounter
+    gauges = [(QUEUE_LENGTH, format_labels({'bicycle_kind': kind}), length)
+              for kind, length in QueuePosition.objects.values_list(
+                  'bicycle_kind').annotate(length=Count('id')).order_by(
+                      'bicycle_kind')]
+    gauges.append((LINE_LENGTH, '', LineCounter.get_value()))
+    return gauges
+
+
+def get_family(name):
+    """Return the name of the metric a sample belongs to."""
+    if name not in METRICS:
+        for suffix in HISTOGRAM_SUFFIXES:
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                return name[:-len(suffix)]
+    return name
+
+
+def get_sort_key(sample):
+    """Order the samples of a histogram like Prometheus: buckets by bound,
+    then sum and count."""
+    name, labels, _ = sample
+    family = get_family(name)
+    bound = 0.0
+    if name.endswith('_bucket'):
+        labels, _, bound = labels.rpartition('le="')
+        labels = labels.rstrip(',')
+        bound = float(bound.rstrip('"').replace('Inf', 'inf'))
+    suffix = name[len(family):]
+    order = HISTOGRAM_SUFFIXES.index(suffix) if suffix else 0
+    return family, labels, order, bound
+
+
+def render_metrics():
+    """Return all metrics of all processes in the Prometheus text format."""
+    from register.models import MetricSample
+    registry.flush()
+
+    samples = list(MetricSample.objects.values_list('name', 'labels',
+                                                    'value'))
+    samples += get_gauges()
+    samples.sort(key=get_sort_key)
+
+    lines = []
+    family = None
+    for name, labels, value in samples:
+        if get_family(name) != family:
+            family = get_family(name)
+            metric_type, help_text = METRICS.get(family, ('untyped', ''))
+            lines.append('# HELP %s %s' % (family, help_text))
+            lines.append('# TYPE %s %s' % (family, metric_type))
+        lines.append('%s%s %s' % (name, '{%s}' % labels if labels else '',
+                                  repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware(object):
+    """Record the response time of every request by URL name."""
+
+    def process_request(self, request):
+        request.metrics_start = timeit.default_timer()
+
+    def process_response(self, request, response):
+        start = getattr(request, 'metrics_start', None)
+        resolver_match = getattr(request, 'resolver_match', None)
+        if start is not None and resolver_match is not None:
+            registry.observe(REQUEST_LATENCY,
+                             timeit.default_timer() - start,
+                             url_name=resolver_match.view_name)
+        return response
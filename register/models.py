@@ -1,16 +1,20 @@
 from __future__ import unicode_literals
 
-from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.core.cache import cache
+from django.db import connection, models, router, transaction
+from django.db.models import F, Max, Q
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver, Signal
 from django.utils import timezone
 import hashlib
 import os
+import time
 from phonenumber_field.modelfields import PhoneNumberField
 from solo.models import SingletonModel
 
 from bwb.settings import LANGUAGE_CODE
 from register.email import get_url_parameter
+from register.utils import chunks
 
 
 MAX_NAME_LENGTH = 100
@@ -21,13 +25,28 @@ def get_hash_value():
     return hashlib.sha224(os.urandom(64)).hexdigest()[:IDENTIFIER_LENGTH]
 
 
+# Sent after Candidates have been changed with QuerySet.update() or
+# bulk_create(), which do not send post_save. candidate_ids is None if all
+# Candidates may have changed.
+candidates_updated = Signal(providing_args=['candidate_ids'])
+
+
+def normalize_name(name):
+    """Return the case-folded name, which is compared to find duplicates."""
+    try:
+        return name.casefold()
+    except AttributeError:
+        # Python 2
+        return name.lower()
+
+
 def datetime_min():
     return timezone.make_aware(timezone.datetime.min,
                                timezone.get_default_timezone())
 
 
 class HandoutEvent(models.Model):
-    due_date = models.DateTimeField()
+    due_date = models.DateTimeField(db_index=True)
 
     def __unicode__(self):
         return str(self.due_date)
@@ -38,8 +57,15 @@ class HandoutEvent(models.Model):
 
 
 class Candidate(models.Model):
-    first_name = models.CharField(max_length=MAX_NAME_LENGTH)
-    last_name = models.CharField(max_length=MAX_NAME_LENGTH)
+    # the indexes serve the sorted pages of the staff tables
+    first_name = models.CharField(max_length=MAX_NAME_LENGTH, db_index=True)
+    last_name = models.CharField(max_length=MAX_NAME_LENGTH, db_index=True)
+
+    # case folding may turn one character into up to three
+    first_name_norm = models.CharField(max_length=3 * MAX_NAME_LENGTH,
+                                       default='', editable=False)
+    last_name_norm = models.CharField(max_length=3 * MAX_NAME_LENGTH,
+                                      default='', editable=False)
 
     date_of_birth = models.DateField()
 
@@ -57,12 +83,26 @@ class Candidate(models.Model):
         (NOT_SHOWING_UP, "not showing up"))
 
     status = models.IntegerField(choices=CANDIDATE_STATUS,
-                                 default=WAITING)
+                                 default=WAITING, db_index=True)
+
+    class Meta(object):
+        index_together = [('date_of_birth', 'first_name_norm',
+                           'last_name_norm')]
 
     def __unicode__(self):
         return "%s %s %s %s" % (self.first_name, self.last_name,
                                 self.date_of_birth, self.get_status_display())
 
+    def normalize_names(self):
+        """Update the normalized names. This needs to be called before
+        bulk_create(), which does not call save()."""
+        self.first_name_norm = normalize_name(self.first_name)
+        self.last_name_norm = normalize_name(self.last_name)
+
+    def save(self, *args, **kwargs):
+        self.normalize_names()
+        super(Candidate, self).save(*args, **kwargs)
+
     @property
     def has_bicycle(self):
         """Does this Candidate have a bicycle."""
@@ -71,26 +111,57 @@ class Candidate(models.Model):
         except Bicycle.DoesNotExist:
             return False
 
-    # ToDo: add missing statuses
-    def get_status(self):
-        number_of_invitations = self.invitations.count()
-        if self.has_bicycle:
-            return self.WITH_BICYCLE
-        elif number_of_invitations > 0:
-            return self.INVITED
-        else:
-            return self.WAITING
-
     def update_status(self):
-        new_status = self.get_status()
-        if self.status != new_status:
-            self.status = new_status
-            self.save()  # pylint: disable=no-member
+        self.update_statuses([self.id])
+        self.refresh_from_db(fields=['status'])
 
     @classmethod
-    def get_status_and_candidates(cls):
-        return [(val, cls.objects.filter(status=key).all())
-                for key, val in cls.CANDIDATE_STATUS]
+    def get_status_update_sql(cls):
+        """SQL statement that recomputes the status of the Candidates matched
+        by the WHERE clause that has to be appended."""
+        # ToDo: add missing statuses
+        return (
+            "UPDATE {candidate} SET status = CASE "
+            "WHEN EXISTS (SELECT 1 FROM {bicycle} "
+            "WHERE {bicycle}.candidate_id = {candidate}.id) THEN %s "
+            "WHEN EXISTS (SELECT 1 FROM {invitation} "
+            "WHERE {invitation}.candidate_id = {candidate}.id) THEN %s "
+            "ELSE %s END WHERE ").format(
+                candidate=cls._meta.db_table,
+                bicycle=Bicycle._meta.db_table,
+                invitation=Invitation._meta.db_table)
+
+    @classmethod
+    def update_statuses(cls, candidate_ids):
+        """Recompute the status of the Candidates with the given ids."""
+        candidate_ids = list(candidate_ids)
+        statuses = [cls.WITH_BICYCLE, cls.INVITED, cls.WAITING]
+
+        with connection.cursor() as cursor:
+            for chunk in chunks(candidate_ids):
+                cursor.execute(
+                    cls.get_status_update_sql() + "id IN (%s)" % ", ".join(
+                        ["%s"] * len(chunk)),
+                    statuses + chunk)
+
+        if candidate_ids:
+            candidates_updated.send(sender=cls, candidate_ids=candidate_ids)
+
+    @classmethod
+    def update_all_statuses(cls, chunk_size=10000):
+        """Recompute the status of all Candidates, chunk_size rows per
+        statement."""
+        statuses = [cls.WITH_BICYCLE, cls.INVITED, cls.WAITING]
+        last_id = cls.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        with connection.cursor() as cursor:
+            for start in range(0, last_id, chunk_size):
+                with transaction.atomic():
+                    cursor.execute(cls.get_status_update_sql() +
+                                   "id > %s AND id <= %s",
+                                   statuses + [start, start + chunk_size])
+
+        candidates_updated.send(sender=cls, candidate_ids=None)
 
     @property
     def events_not_invited_to(self):
@@ -108,18 +179,36 @@ class Candidate(models.Model):
     def registered_and_without_bicycle(cls, kind):
         """Return all Candidates that do not have a bicycle and are registered
         for this kind of bicycle."""
-        without_bicycles = cls.objects.filter(bicycle__isnull=True)
-        registered = without_bicycles.filter(user_registration__isnull=False)
-        return [candidate for candidate in registered
-                if candidate.user_registration.bicycle_kind == kind]
+        return cls.objects.filter(bicycle__isnull=True,
+                                  user_registration__bicycle_kind=kind)
 
     @classmethod
     def get_matching(cls, first_name, last_name, date_of_birth):
         """Return all Candidates with the same name and date of birth.
         The matching of the name is case-insensitive."""
-        return cls.objects.filter(date_of_birth=date_of_birth,
-                                  first_name__iexact=first_name,
-                                  last_name__iexact=last_name)
+        if first_name is None or last_name is None:
+            return cls.objects.none()
+        # duplicate checks have to see the latest writes, not a replica
+        return cls.objects.using(router.db_for_write(cls)).filter(
+            date_of_birth=date_of_birth,
+            first_name_norm=normalize_name(first_name),
+            last_name_norm=normalize_name(last_name))
+
+    @classmethod
+    def update_normalized_names(cls):
+        """Recompute the normalized names of all Candidates, e.g. after
+        adding the columns to an existing database."""
+        candidates = cls.objects.only('id', 'first_name', 'last_name',
+                                      'first_name_norm', 'last_name_norm')
+        with transaction.atomic():
+            for candidate in candidates.iterator():
+                first_name_norm = normalize_name(candidate.first_name)
+                last_name_norm = normalize_name(candidate.last_name)
+                if (first_name_norm, last_name_norm) != (
+                        candidate.first_name_norm, candidate.last_name_norm):
+                    cls.objects.filter(id=candidate.id).update(
+                        first_name_norm=first_name_norm,
+                        last_name_norm=last_name_norm)
 
 
 class UserRegistration(models.Model):
@@ -160,15 +249,9 @@ class UserRegistration(models.Model):
 
     def number_in_line(self):
         """Current number of people in line waiting for this kind of
-        bicycle."""
-        cls = self.__class__
-        i = 0
-        for registration in cls.objects.filter(bicycle_kind=self.bicycle_kind):
-            if not registration.candidate.has_bicycle:
-                i += 1
-            if self.candidate == registration.candidate:
-                return i
-        assert False, "Could not find object in database."
+        bicycle. Returns None if this registration is not in line (anymore)."""
+        return QueuePosition.objects.filter(registration=self).values_list(
+            'position', flat=True).first()
 
     def validate_email(self):
         """Flag email address for validated and store current time."""
@@ -192,11 +275,27 @@ class Invitation(models.Model):
         return '%s %s' % (self.candidate, self.handout_event)
 
 
+class LotteryDraw(models.Model):
+    """Seed and reference time of a lottery of automatic invitations, with
+    which register.lottery draws the same winners from the same pool."""
+    handout_event = models.ForeignKey(HandoutEvent,
+                                      on_delete=models.CASCADE,
+                                      related_name='lottery_draws')
+
+    seed = models.PositiveIntegerField()
+    date_of_draw = models.DateTimeField()
+    pool_size = models.PositiveIntegerField()
+    number_of_winners = models.PositiveIntegerField()
+
+    def __unicode__(self):
+        return '%s seed %s' % (self.handout_event, self.seed)
+
+
 class Bicycle(models.Model):
     candidate = models.OneToOneField(Candidate, on_delete=models.CASCADE,
                                      related_name='bicycle')
 
-    bicycle_number = models.PositiveIntegerField()
+    bicycle_number = models.PositiveIntegerField(db_index=True)
     lock_combination = models.PositiveIntegerField()
     color = models.CharField(max_length=200)
     brand = models.CharField(max_length=200)
@@ -223,31 +322,234 @@ class Bicycle(models.Model):
         return '%s\n%s' % (self, add_info)
 
 
+class QueuePosition(models.Model):
+    """Position of a registration in the line for its kind of bicycle.
+
+    The positions of each kind are dense and start at 1. The line is ordered
+    by the date of registration; candidates with a bicycle are not in line."""
+    registration = models.OneToOneField(UserRegistration,
+                                        on_delete=models.CASCADE,
+                                        related_name='queue_position')
+    bicycle_kind = models.IntegerField(
+        choices=UserRegistration.BICYCLE_CHOICES)
+    position = models.PositiveIntegerField()
+
+    class Meta(object):
+        index_together = [('bicycle_kind', 'position')]
+
+    def __unicode__(self):
+        return "%s %s" % (self.position, self.registration)
+
+    @classmethod
+    def enqueue(cls, registration):
+        """Insert the registration at its place in line."""
+        with transaction.atomic():
+            entry = cls.objects.filter(registration=registration).first()
+            if entry:
+                return entry
+
+            ahead = cls.objects.filter(
+                bicycle_kind=registration.bicycle_kind).filter(
+                    Q(registration__date_of_registration__lt=registration
+                      .date_of_registration) |
+                    Q(registration__date_of_registration=registration
+                      .date_of_registration,
+                      registration__identifier__lt=registration.identifier))
+            position = ahead.count() + 1
+
+            cls.objects.filter(
+                bicycle_kind=registration.bicycle_kind,
+                position__gte=position).update(position=F('position') + 1)
+            return cls.objects.create(registration=registration,
+                                      bicycle_kind=registration.bicycle_kind,
+                                      position=position)
+
+    @classmethod
+    def dequeue(cls, registration):
+        """Remove the registration from the line and move up everybody
+        behind it."""
+        with transaction.atomic():
+            for entry in cls.objects.filter(registration=registration):
+                entry.delete()
+                cls.objects.filter(
+                    bicycle_kind=entry.bicycle_kind,
+                    position__gt=entry.position).update(
+                        position=F('position') - 1)
+
+    @classmethod
+    def rebuild(cls, batch_size=1000):
+        """Recreate the whole index from the registrations."""
+        with transaction.atomic():
+            cls.objects.all().delete()
+            for kind, _ in UserRegistration.BICYCLE_CHOICES:
+                identifiers = UserRegistration.objects.filter(
+                    bicycle_kind=kind,
+                    candidate__bicycle__isnull=True).order_by(
+                        'date_of_registration', 'identifier').values_list(
+                            'identifier', flat=True)
+                cls.objects.bulk_create(
+                    (cls(registration_id=identifier, bicycle_kind=kind,
+                         position=position)
+                     for position, identifier in enumerate(identifiers,
+                                                           start=1)),
+                    batch_size=batch_size)
+
+
+class LineCounter(models.Model):
+    """Number of Candidates without a bicycle.
+
+    The single row is kept up to date by the signal handlers, so that the
+    line does not need to be counted for every registration."""
+    in_line = models.IntegerField(default=0)
+
+    COUNTER_ID = 1
+
+    def __unicode__(self):
+        return "%s in line" % self.in_line
+
+    @classmethod
+    def rebuild(cls):
+        """Count the line and store the result."""
+        cls.objects.update_or_create(
+            id=cls.COUNTER_ID,
+            defaults={'in_line': Candidate.total_in_line()})
+
+    @classmethod
+    def add(cls, number):
+        if not cls.objects.filter(id=cls.COUNTER_ID).update(
+                in_line=F('in_line') + number):
+            cls.rebuild()
+
+    @classmethod
+    def get_value(cls):
+        in_line = cls.objects.filter(id=cls.COUNTER_ID).values_list(
+            'in_line', flat=True).first()
+        if in_line is None:
+            cls.rebuild()
+            return cls.get_value()
+        return in_line
+
+
 @receiver(post_save, sender=Candidate)
-def handler_on_save(
+def handler_on_candidate_save(
+        instance, created, **kwargs):  # pylint: disable=unused-argument
+    if created:
+        LineCounter.add(1)
+
+
+@receiver(post_delete, sender=Candidate)
+def handler_on_candidate_delete(
         instance, **kwargs):  # pylint: disable=unused-argument
-    instance.update_status()
+    # a bicycle of the candidate is deleted before and has added one
+    LineCounter.add(-1)
 
 
 @receiver(post_save, sender=UserRegistration)
 def handler_on_registration_save(
+        instance, created, **kwargs):  # pylint: disable=unused-argument
+    if created:
+        if not instance.candidate.has_bicycle:
+            QueuePosition.enqueue(instance)
+    elif QueuePosition.objects.filter(registration=instance).exclude(
+            bicycle_kind=instance.bicycle_kind).exists():
+        # the kind of bicycle has changed
+        QueuePosition.dequeue(instance)
+        QueuePosition.enqueue(instance)
+
+
+@receiver(pre_delete, sender=UserRegistration)
+@receiver(post_delete, sender=UserRegistration)
+def handler_on_registration_delete(
         instance, **kwargs):  # pylint: disable=unused-argument
-    instance.candidate.update_status()
+    # The signals are also sent when the candidate is deleted. In that case
+    # the deletion of the bicycle may put the registration back in line
+    # before the registration itself is deleted, hence the second dequeue.
+    QueuePosition.dequeue(instance)
 
 
 @receiver(post_save, sender=Invitation)
-def handler_on_invitation_save(
+@receiver(post_delete, sender=Invitation)
+def handler_on_invitation_change(
         instance, **kwargs):  # pylint: disable=unused-argument
-    instance.candidate.update_status()
+    Candidate.update_statuses([instance.candidate_id])
 
 
 @receiver(post_save, sender=Bicycle)
 def handler_on_bicycle_save(
+        instance, created, **kwargs):  # pylint: disable=unused-argument
+    Candidate.update_statuses([instance.candidate_id])
+
+    if created:
+        LineCounter.add(-1)
+        for registration in UserRegistration.objects.filter(
+                candidate_id=instance.candidate_id):
+            QueuePosition.dequeue(registration)
+
+
+@receiver(post_delete, sender=Bicycle)
+def handler_on_bicycle_delete(
         instance, **kwargs):  # pylint: disable=unused-argument
-    instance.candidate.update_status()
+    Candidate.update_statuses([instance.candidate_id])
+    LineCounter.add(1)
+
+    # bicycle has been refunded, so the candidate is waiting again
+    for registration in UserRegistration.objects.filter(
+            candidate_id=instance.candidate_id):
+        QueuePosition.enqueue(registration)
+
+
+class OutgoingMessage(models.Model):
+    """Notification waiting in the outbox to be delivered by the worker."""
+    registration = models.ForeignKey(UserRegistration,
+                                     on_delete=models.CASCADE,
+                                     related_name='outgoing_messages')
+    subject = models.CharField(max_length=200)
+    message = models.TextField()
+
+    PENDING = 1
+    SENT = 2
+    FAILED = 3
+
+    MESSAGE_STATUS = (
+        (PENDING, "pending"),
+        (SENT, "sent"),
+        (FAILED, "failed"))
+
+    status = models.IntegerField(choices=MESSAGE_STATUS, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    date_of_creation = models.DateTimeField(auto_now_add=True)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    date_of_delivery = models.DateTimeField(null=True, blank=True)
+
+    class Meta(object):
+        index_together = [('status', 'next_attempt')]
+
+    def __unicode__(self):
+        return "%s %s %s" % (self.subject, self.registration,
+                             self.get_status_display())
+
+
+class MetricSample(models.Model):
+    """Value of a counter, shared by all processes. The processes add their
+    increments with register.metrics."""
+    name = models.CharField(max_length=100)
+    # label pairs in the Prometheus format, e.g. channel="email"
+    labels = models.CharField(max_length=200, blank=True, default='')
+    value = models.FloatField(default=0)
+
+    class Meta(object):
+        unique_together = [('name', 'labels')]
+
+    def __unicode__(self):
+        return "%s{%s} %s" % (self.name, self.labels, self.value)
 
 
 class SiteConfiguration(SingletonModel):
+    """The configuration is cached in every process. The copy is used for
+    CHECK_INTERVAL seconds, after that it is compared to a version in the
+    shared cache, which is replaced whenever the configuration is saved."""
     # so many people can be registered without a bicycle
     max_number_of_registrations = models.PositiveIntegerField(default=200)
     # maximum number of times people will be invited to events
@@ -256,5 +558,48 @@ class SiteConfiguration(SingletonModel):
     maintenance_mode = models.BooleanField(default=False)
     maintenance_message = models.TextField(default="")
 
+    VERSION_KEY = 'site-configuration-version'
+    CHECK_INTERVAL = 1
+
+    # version, time of the last check and instance of the local copy
+    _local_copy = None
+
     def __unicode__(self):
         return "Site Configuration"
+
+    @classmethod
+    def get_version(cls):
+        version = cache.get(cls.VERSION_KEY)
+        if version is None:
+            cache.add(cls.VERSION_KEY, get_hash_value(), None)
+            version = cache.get(cls.VERSION_KEY)
+        return version
+
+    @classmethod
+    def get_solo(cls):
+        now = time.time()
+        local_copy = cls._local_copy
+
+        if local_copy is not None:
+            version, checked, instance = local_copy
+            if now - checked < cls.CHECK_INTERVAL:
+                return instance
+            if version == cls.get_version():
+                cls._local_copy = (version, now, instance)
+                return instance
+
+        version = cls.get_version()
+        instance = super(SiteConfiguration, cls).get_solo()
+        cls._local_copy = (version, now, instance)
+        return instance
+
+    @classmethod
+    def clear_cache(cls):
+        """Make all processes read the configuration again."""
+        cls._local_copy = None
+        cache.set(cls.VERSION_KEY, get_hash_value(), None)
+
+    def save(self, *args, **kwargs):
+        super(SiteConfiguration, self).save(*args, **kwargs)
+        # other processes must not read the configuration before the commit
+        transaction.on_commit(self.clear_cache)
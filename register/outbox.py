@@ -0,0 +1,123 @@
+"""Outbox for notifications.
+
+Messages are written to the database in the same transaction as the data
+they are about and are delivered later by the deliver_messages management
+command, so that no request has to wait for the mail server. Every run of
+the command claims its messages before sending them, so that several of
+them can run at the same time without sending anything twice."""
+from datetime import timedelta
+from django.utils import timezone
+
+from register.email import send_messages, get_message_after_invitation
+from register.email import get_message_after_registration
+from register.models import OutgoingMessage, UserRegistration
+
+
+MAX_ATTEMPTS = 5
+# seconds to wait after the first failed attempt, doubled after each failure
+RETRY_DELAY = 60
+# seconds a claimed message is left to the process that claimed it before
+# it is due again, in case that process died while sending
+CLAIM_TIMEOUT = 10 * 60
+
+
+def queue_message_after_registration(registration, request):
+    subject, message = get_message_after_registration(registration, request)
+    return OutgoingMessage.objects.create(registration=registration,
+                                          subject=subject,
+                                          message=message)
+
+
+def get_invitation_message(candidate, handout_event):
+    """Return the unsaved message for the invited candidate or None if the
+    candidate has not registered any contact information."""
+    try:
+        registration = candidate.user_registration
+    except UserRegistration.DoesNotExist:
+        return None
+
+    subject, message = get_message_after_invitation(candidate, handout_event)
+    return OutgoingMessage(registration=registration,
+                           subject=subject,
+                           message=message)
+
+
+def queue_message_after_invitation(candidate, handout_event):
+    outgoing_message = get_invitation_message(candidate, handout_event)
+    if outgoing_message:
+        outgoing_message.save()
+    return outgoing_message
+
+
+def queue_messages_after_invitation(candidates, handout_event):
+    """Queue the notifications of all invited candidates with one query."""
+    outgoing_messages = [get_invitation_message(candidate, handout_event)
+                         for candidate in candidates]
+    return OutgoingMessage.objects.bulk_create(
+        [m for m in outgoing_messages if m])
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def record_result(outgoing_message, error, max_attempts=MAX_ATTEMPTS):
+    """Store the result of a delivery attempt."""
+    outgoing_message.attempts += 1
+
+    if error is None:
+        outgoing_message.status = OutgoingMessage.SENT
+        outgoing_message.date_of_delivery = timezone.now()
+    else:
+        outgoing_message.last_error = repr(error)
+        if outgoing_message.attempts >= max_attempts:
+            outgoing_message.status = OutgoingMessage.FAILED
+        else:
+            outgoing_message.next_attempt = timezone.now() + get_retry_delay(
+                outgoing_message.attempts)
+
+    outgoing_message.save()
+
+
+def get_due_messages(limit):
+    return OutgoingMessage.objects.filter(
+        status=OutgoingMessage.PENDING,
+        next_attempt__lte=timezone.now()).select_related(
+            'registration').order_by('next_attempt', 'id')[:limit]
+
+
+def claim_due_messages(limit):
+    """Return up to limit messages that are due after postponing them by
+    CLAIM_TIMEOUT, so that no other process delivers them at the same time.
+    Messages another process claimed first are left out."""
+    now = timezone.now()
+    ids = list(get_due_messages(limit).values_list('id', flat=True))
+    if not ids:
+        return []
+
+    claimed_until = now + timedelta(seconds=CLAIM_TIMEOUT)
+    OutgoingMessage.objects.filter(
+        id__in=ids, status=OutgoingMessage.PENDING,
+        next_attempt__lte=now).update(next_attempt=claimed_until)
+    return list(OutgoingMessage.objects.filter(
+        id__in=ids, status=OutgoingMessage.PENDING,
+        next_attempt=claimed_until).select_related(
+            'registration').order_by('id'))
+
+
+def deliver_due_messages(limit=100, max_attempts=MAX_ATTEMPTS):
+    """Deliver up to limit messages that are due over one connection.
+
+    Returns the number of sent and of failed attempts."""
+    outgoing_messages = claim_due_messages(limit)
+    if not outgoing_messages:
+        return 0, 0
+
+    errors = send_messages([(m.registration, m.subject, m.message)
+                            for m in outgoing_messages])
+
+    for outgoing_message, error in zip(outgoing_messages, errors):
+        record_result(outgoing_message, error, max_attempts=max_attempts)
+
+    failed = len([error for error in errors if error is not None])
+    return len(errors) - failed, failed
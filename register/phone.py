@@ -0,0 +1,120 @@
+"""Validation of German mobile phone numbers.
+
+The mobile phone prefixes are read from data/mobile_phone_prefixes.txt into
+a trie. Parsed numbers are cached, so a number that is validated several
+times, e.g. by a form field and by the form, is only parsed once."""
+from django.core.exceptions import ValidationError
+from django.utils.translation import ugettext as _
+from phonenumber_field.phonenumber import PhoneNumber
+import os
+import phonenumbers
+from phonenumbers.phonenumberutil import NumberParseException
+
+# To support Python 2 and 3
+try:
+    from functools import lru_cache
+except ImportError:
+    def lru_cache(maxsize):  # pylint: disable=unused-argument
+        """Python 2 does without the cache."""
+        return lambda function: function
+
+
+BAD_FORMAT_NUMBER = _('This is not a properly formatted phone number.')
+INVALID_NUMBER = _('This is not a valid phone number.')
+INVALID_MOBILE_NUMBER = _('This is not a valid mobile phone number.')
+
+PREFIX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'mobile_phone_prefixes.txt')
+
+REGION = 'DE'
+CACHE_SIZE = 4096
+
+
+def load_prefixes(path=PREFIX_FILE):
+    """Return the prefixes of the file, ignoring comments and empty lines."""
+    with open(path) as prefix_file:
+        lines = (line.split('#')[0].strip() for line in prefix_file)
+        return [line for line in lines if line]
+
+
+def build_trie(prefixes):
+    """Return a trie of nested dicts over the digits of the prefixes
+    without the trunk prefix 0. The key None marks the end of a prefix."""
+    trie = {}
+    for prefix in prefixes:
+        node = trie
+        for digit in prefix[1:]:
+            node = node.setdefault(digit, {})
+        node[None] = True
+    return trie
+
+
+MOBILE_PHONE_PREFIXES = load_prefixes()
+MOBILE_PHONE_TRIE = build_trie(MOBILE_PHONE_PREFIXES)
+
+
+def is_mobile_number(national_number, trie=MOBILE_PHONE_TRIE):
+    """Whether the national number starts with a mobile phone prefix."""
+    node = trie
+    for digit in str(national_number):
+        if None in node:
+            return True
+        node = node.get(digit)
+        if node is None:
+            return False
+    return None in node
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_cached(value):
+    """Return the parsed number and None or None and the error message."""
+    try:
+        parsed_number = phonenumbers.parse(value, REGION)
+    except NumberParseException:
+        return None, BAD_FORMAT_NUMBER
+
+    if not phonenumbers.is_valid_number_for_region(parsed_number, REGION):
+        return None, INVALID_NUMBER
+
+    if not is_mobile_number(parsed_number.national_number):
+        return None, INVALID_MOBILE_NUMBER
+
+    return parsed_number, None
+
+
+def parse_phone_number(value):
+    """Return a new PhoneNumber of the valid mobile phone number or raise a
+    ValidationError."""
+    parsed_number, error = parse_cached(value)
+    if error:
+        raise ValidationError(error)
+
+    # the cached number must not be handed out, it could be modified
+    phone_number = PhoneNumber()
+    phone_number.merge_from(parsed_number)
+    return phone_number
+
+
+def parse_mobile_number(value):
+    """Return the valid mobile phone number in international format or raise
+    a ValidationError."""
+    parsed_number, error = parse_cached(value)
+    if error:
+        raise ValidationError(error)
+
+    return phonenumbers.format_number(
+        parsed_number, phonenumbers.PhoneNumberFormat.INTERNATIONAL)
+
+
+def validate_many(values):
+    """Validate many numbers at once, e.g. for an import.
+
+    Returns a list with a pair of the number in international format and
+    None or None and the error message for every value."""
+    results = []
+    for value in values:
+        try:
+            results.append((parse_mobile_number(value), None))
+        except ValidationError as error:
+            results.append((None, error.messages[0]))
+    return results
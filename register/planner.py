@@ -0,0 +1,189 @@
+"""Planning of the automatic invitations to several events at once.
+
+plan_invitations() draws the winners for all events in a single lottery
+and hands them out in the order of the events: the first winners of every
+kind of bicycle are invited to the earliest event. Nobody is planned twice
+and candidates already invited to one of the events are left out. The
+capacity of an event is reduced by the invitations it already has.
+
+The plan can be shown before commit_plan() makes all invitations in one
+transaction."""
+from collections import OrderedDict
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from register.lottery import draw_by_kind, get_pool, new_seed
+from register.models import Candidate, HandoutEvent, Invitation
+from register.models import LotteryDraw, SiteConfiguration, UserRegistration
+from register.outbox import queue_messages_after_invitation
+from register.utils import chunks
+
+
+class Plan(object):
+    """Invitations drawn in one lottery. allocation is a list of triples of
+    event id, kind of bicycle and the ids of the candidates to invite, in
+    the order of the events. capacities are the numbers of bicycles the
+    plan was made for, see get_capacity_list()."""
+
+    def __init__(self, seed, date_of_draw, pool_size, allocation,
+                 capacities):
+        self.seed = seed
+        self.date_of_draw = date_of_draw
+        self.pool_size = pool_size
+        self.allocation = allocation
+        self.capacities = capacities
+
+    @property
+    def number_of_invitations(self):
+        return sum(len(candidate_ids)
+                   for _, _, candidate_ids in self.allocation)
+
+    def to_dict(self):
+        """Return the plan in a form that can be stored in the session."""
+        return {'seed': self.seed,
+                'date_of_draw': self.date_of_draw.isoformat(),
+                'pool_size': self.pool_size,
+                'allocation': [list(item) for item in self.allocation],
+                'capacities': [list(item) for item in self.capacities]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['seed'], parse_datetime(data['date_of_draw']),
+                   data['pool_size'],
+                   [tuple(item) for item in data['allocation']],
+                   [tuple(item) for item in data['capacities']])
+
+
+def get_capacity_list(capacities):
+    """Return the numbers of bicycles of the capacities as sorted triples of
+    event id, kind of bicycle and number, leaving out zeros."""
+    return sorted((event.id, kind, number)
+                  for event, numbers in capacities.items()
+                  for kind, number in numbers.items() if number)
+
+
+def get_free_places(capacities):
+    """Return the number of bicycles of each kind at each event that have
+    not been promised to anybody yet, by pairs of event id and kind."""
+    free = dict(((event.id, kind), number)
+                for event, numbers in capacities.items()
+                for kind, number in numbers.items())
+
+    invited = Invitation.objects.filter(
+        handout_event__in=list(capacities)).values_list(
+            'handout_event', 'candidate__user_registration__bicycle_kind'
+        ).annotate(number=Count('id')).order_by()
+    for event_id, kind, number in invited:
+        if (event_id, kind) in free:
+            free[(event_id, kind)] = max(free[(event_id, kind)] - number, 0)
+    return free
+
+
+def plan_invitations(capacities, seed=None):
+    """Return the Plan of the invitations to the events.
+
+    capacities maps each HandoutEvent to a dict of the number of bicycles of
+    each kind. Without a seed a new one is drawn."""
+    if seed is None:
+        seed = new_seed()
+    events = sorted(capacities, key=lambda event: (event.due_date, event.id))
+    kinds = [kind for kind, _ in UserRegistration.BICYCLE_CHOICES]
+
+    free = get_free_places(capacities)
+    date_of_draw = timezone.now()
+    pool = get_pool(events, date_of_draw)
+    winners = draw_by_kind(
+        pool,
+        dict((kind, sum(free.get((event.id, kind), 0) for event in events))
+             for kind in kinds),
+        seed, SiteConfiguration.get_solo().max_number_of_autoinvites)
+
+    allocation = []
+    for event in events:
+        for kind in kinds:
+            number = free.get((event.id, kind), 0)
+            candidate_ids = winners[kind][:number]
+            winners[kind] = winners[kind][number:]
+            if candidate_ids:
+                allocation.append((event.id, kind, candidate_ids))
+
+    return Plan(seed, date_of_draw, len(pool.candidate_ids), allocation,
+                get_capacity_list(capacities))
+
+
+def get_preview(plan):
+    """Return the events of the plan with the candidates to invite, as
+    triples of event, name of the kind of bicycle and list of candidates."""
+    events = HandoutEvent.objects.in_bulk(
+        [event_id for event_id, _, _ in plan.allocation])
+    candidate_ids = [candidate_id for _, _, candidate_ids in plan.allocation
+                     for candidate_id in candidate_ids]
+    candidates = {}
+    for chunk in chunks(candidate_ids):
+        candidates.update(Candidate.objects.in_bulk(chunk))
+
+    kind_names = dict(UserRegistration.BICYCLE_CHOICES)
+    return [(events[event_id], kind_names[kind],
+             [candidates[candidate_id] for candidate_id in candidate_ids
+              if candidate_id in candidates])
+            for event_id, kind, candidate_ids in plan.allocation
+            if event_id in events]
+
+
+def get_eligible(candidate_ids, event_ids):
+    """Return the ids of the candidates that still have no bicycle and no
+    invitation to any of the events."""
+    eligible = set()
+    for chunk in chunks(candidate_ids):
+        eligible.update(Candidate.objects.filter(
+            id__in=chunk, bicycle__isnull=True).exclude(
+                invitations__handout_event__in=event_ids).values_list(
+                    'id', flat=True))
+    return eligible
+
+
+def commit_plan(plan, notify=True):
+    """Make the invitations of the plan in one transaction. Candidates who
+    got a bicycle or an invitation to one of the events since the plan was
+    made are left out.
+
+    Returns the ids of the invited candidates by event id."""
+    event_ids = sorted(set(event_id for event_id, _, _ in plan.allocation))
+
+    with transaction.atomic():
+        events = HandoutEvent.objects.in_bulk(event_ids)
+        eligible = get_eligible(
+            [candidate_id for _, _, candidate_ids in plan.allocation
+             for candidate_id in candidate_ids], event_ids)
+
+        invited = OrderedDict()
+        for event_id, _, candidate_ids in plan.allocation:
+            if event_id in events:
+                invited.setdefault(event_id, []).extend(
+                    candidate_id for candidate_id in candidate_ids
+                    if candidate_id in eligible)
+
+        # bulk_create does not send post_save, so the status is updated here
+        Invitation.objects.bulk_create(
+            [Invitation(handout_event_id=event_id, candidate_id=candidate_id)
+             for event_id, candidate_ids in invited.items()
+             for candidate_id in candidate_ids])
+        LotteryDraw.objects.bulk_create(
+            [LotteryDraw(handout_event_id=event_id, seed=plan.seed,
+                         date_of_draw=plan.date_of_draw,
+                         pool_size=plan.pool_size,
+                         number_of_winners=len(candidate_ids))
+             for event_id, candidate_ids in invited.items()])
+        Candidate.update_statuses(sum(invited.values(), []))
+
+        if notify:
+            for event_id, candidate_ids in invited.items():
+                for chunk in chunks(candidate_ids):
+                    queue_messages_after_invitation(
+                        candidates=Candidate.objects.filter(
+                            id__in=chunk).select_related('user_registration'),
+                        handout_event=events[event_id])
+
+    return invited
@@ -0,0 +1,107 @@
+"""Full-text search over the names of the Candidates.
+
+On SQLite with FTS5 the names are indexed in an external content table,
+which triggers keep in sync with the candidate table. This also covers
+changes made with bulk_create() and QuerySet.update()."""
+from django.db import connections
+from django.db.utils import OperationalError
+
+from register.models import Candidate
+
+
+FTS_TABLE = 'register_candidate_fts'
+
+CREATE_STATEMENTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "first_name, last_name, content='{candidate}', content_rowid='id')",
+
+    "CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {candidate} "
+    "BEGIN "
+    "INSERT INTO {fts}(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {candidate} "
+    "BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS {fts}_update "
+    "AFTER UPDATE OF first_name, last_name ON {candidate} "
+    "BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, first_name, last_name) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name); "
+    "INSERT INTO {fts}(rowid, first_name, last_name) "
+    "VALUES (new.id, new.first_name, new.last_name); "
+    "END",
+
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+# aliases of the databases known to have the index
+_databases_with_index = set()
+
+
+def create_search_index(using='default',
+                        **kwargs):  # pylint: disable=unused-argument
+    """Create and fill the index, if the database supports it."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        try:
+            for statement in CREATE_STATEMENTS:
+                cursor.execute(statement.format(
+                    fts=FTS_TABLE, candidate=Candidate._meta.db_table))
+        except OperationalError:
+            # SQLite has been compiled without FTS5
+            return
+
+    _databases_with_index.add(using)
+
+
+def has_search_index(using):
+    if using in _databases_with_index:
+        return True
+
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       [FTS_TABLE])
+        if cursor.fetchone():
+            _databases_with_index.add(using)
+            return True
+    return False
+
+
+def get_match_expression(value):
+    """Turn the words of the search into an FTS5 query that matches names
+    starting with any of them."""
+    return " OR ".join('"%s"*' % word.replace('"', '""')
+                       for word in value.split())
+
+
+def search_candidates(queryset, value):
+    """Filter the candidates whose first or last name starts with one of the
+    words in value, ordered by relevance.
+
+    Returns None if the database has no search index."""
+    if not has_search_index(queryset.db):
+        return None
+
+    condition = ("{candidate}.id IN (SELECT rowid FROM {fts} "
+                 "WHERE {fts} MATCH %s)")
+    rank = ("SELECT rank FROM {fts} "
+            "WHERE {fts} MATCH %s AND rowid = {candidate}.id")
+    tables = {'fts': FTS_TABLE, 'candidate': Candidate._meta.db_table}
+    expression = get_match_expression(value)
+
+    return queryset.extra(
+        select={'search_rank': rank.format(**tables)},
+        select_params=[expression],
+        where=[condition.format(**tables)],
+        params=[expression]).order_by('search_rank')
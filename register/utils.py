@@ -0,0 +1,8 @@
+# stay well below the maximum number of variables of a SQLite statement
+CHUNK_SIZE = 500
+
+
+def chunks(sequence, size=CHUNK_SIZE):
+    """Split the sequence into consecutive slices of at most size items."""
+    for start in range(0, len(sequence), size):
+        yield sequence[start:start + size]
@@ -1,14 +1,21 @@
 from django.core.urlresolvers import reverse_lazy
+from django.db import transaction
 from django.http import Http404
 from django.shortcuts import render, get_object_or_404
 from django.utils.translation import get_language
 from django.views.generic import View
 from django.views.generic.edit import FormView
 
-from register.email import send_message_after_registration
 from register.forms import RegistrationForm, open_for_registration
+from register.forms import line_within_limit
 from register.forms import TOO_MANY_REGISTRATIONS_ERROR
+from register.metrics import count_registration
 from register.models import UserRegistration, Candidate
+from register.outbox import queue_message_after_registration
+
+
+class RegistrationClosed(Exception):
+    pass
 
 
 class GreetingsView(View):
@@ -28,34 +35,24 @@ class RegistrationView(FormView):
     success_url = reverse_lazy('index')
 
     def form_valid(self, form):
-        assert open_for_registration(), TOO_MANY_REGISTRATIONS_ERROR
-
         form_data = {
             'first_name': form.cleaned_data['first_name'],
             'last_name': form.cleaned_data['last_name'],
             'date_of_birth': form.cleaned_data['date_of_birth']}
 
-        candidate = Candidate.objects.create(**form_data)
-
-        creation_dict = {'candidate': candidate,
-                         'bicycle_kind': form.cleaned_data['bicycle_kind'],
-                         'language': get_language()}
-
         email = form.cleaned_data['email']
         mobile_number = form.cleaned_data['mobile_number']
 
         assert email or mobile_number, ("Neither email nor mobile phone "
                                         "number are given.")
 
-        if email:
-            creation_dict['email'] = email
-        if mobile_number:
-            creation_dict['mobile_number'] = mobile_number
+        try:
+            registration = self.register(form, form_data, email, mobile_number)
+        except RegistrationClosed:
+            form.add_error(None, TOO_MANY_REGISTRATIONS_ERROR)
+            return self.form_invalid(form)
 
-        registration = UserRegistration.objects.create(**creation_dict)
-
-        send_message_after_registration(registration=registration,
-                                        request=self.request)
+        count_registration(registration)
 
         self.success_url = reverse_lazy(
             'register:thanks',
@@ -63,18 +60,44 @@ class RegistrationView(FormView):
 
         return super(RegistrationView, self).form_valid(form)
 
+    def register(self, form, form_data, email, mobile_number):
+        with transaction.atomic():
+            # reserves a place in line by incrementing the LineCounter
+            candidate = Candidate.objects.create(**form_data)
+
+            if not line_within_limit():
+                # rolls back the transaction
+                raise RegistrationClosed()
+
+            creation_dict = {'candidate': candidate,
+                             'bicycle_kind': form.cleaned_data['bicycle_kind'],
+                             'language': get_language()}
+
+            if email:
+                creation_dict['email'] = email
+            if mobile_number:
+                creation_dict['mobile_number'] = mobile_number
+
+            registration = UserRegistration.objects.create(**creation_dict)
+
+            queue_message_after_registration(registration=registration,
+                                             request=self.request)
+
+        return registration
+
     def form_invalid(self, form):
         return super(RegistrationView, self).form_invalid(form)
 
-    def get(self, request, *args, **kwargs):
-
-        context_dict = {'open_for_registration': open_for_registration(),
-                        'too_many_registrations_error': TOO_MANY_REGISTRATIONS_ERROR,
-                        'choices': UserRegistration.BICYCLE_CHOICES,
-                        'show_steps': True,
-                        'step_2': 'class="active"',
-                        'form': RegistrationForm()}
-        return render(request, self.template_name, context_dict)
+    def get_context_data(self, **kwargs):
+        # also after a failed post, which may have closed the registration
+        context = super(RegistrationView, self).get_context_data(**kwargs)
+        context.update({
+            'open_for_registration': open_for_registration(),
+            'too_many_registrations_error': TOO_MANY_REGISTRATIONS_ERROR,
+            'choices': UserRegistration.BICYCLE_CHOICES,
+            'show_steps': True,
+            'step_2': 'class="active"'})
+        return context
 
 
 class ThanksView(View):
@@ -0,0 +1,126 @@
+/*
+ * Loads the remaining entries of the staff sidebars while scrolling and
+ * searches the candidates on the server.
+ *
+ * Every list of a sidebar has the URL of its JSON endpoint in data-url and
+ * the id of its last entry in data-next, as long as there are more entries.
+ */
+(function () {
+    'use strict';
+
+    var SCROLL_MARGIN = 200;
+    var SEARCH_DELAY = 250;
+
+    function appendEntries(list, entries, selected) {
+        entries.forEach(function (entry) {
+            var item = document.createElement('li');
+            var link = document.createElement('a');
+
+            item.setAttribute('data-id', entry.id);
+            if (String(entry.id) === selected) {
+                item.className = 'active';
+            }
+            link.href = entry.url;
+            link.textContent = entry.label;
+            item.appendChild(link);
+            list.appendChild(item);
+        });
+    }
+
+    function load(sidebar, list, reset) {
+        var url = list.getAttribute('data-url');
+        var next = list.getAttribute('data-next');
+        var query = sidebar.query;
+        var parameters = [];
+        var request;
+
+        if (reset) {
+            if (list.request) {
+                list.request.abort();
+            }
+        } else if (list.request || !next) {
+            return;
+        } else {
+            parameters.push('after=' + encodeURIComponent(next));
+        }
+        if (query) {
+            parameters.push('q=' + encodeURIComponent(query));
+        }
+
+        request = new XMLHttpRequest();
+        list.request = request;
+        request.open('GET', url + (url.indexOf('?') < 0 ? '?' : '&') +
+                     parameters.join('&'));
+        request.onload = function () {
+            var data;
+
+            list.request = null;
+            if (request.status !== 200) {
+                return;
+            }
+            data = JSON.parse(request.responseText);
+            if (reset) {
+                list.innerHTML = '';
+            }
+            appendEntries(list, data.entries,
+                          sidebar.getAttribute('data-selected'));
+            list.setAttribute('data-next', data.next === null ? '' : data.next);
+            loadVisible(sidebar);
+        };
+        request.onerror = function () {
+            list.request = null;
+        };
+        request.send();
+    }
+
+    function loadVisible(sidebar) {
+        var container = sidebar.parentNode;
+        var lists = sidebar.querySelectorAll('ul[data-url]');
+        var i;
+
+        if (container.scrollTop + container.clientHeight <
+                container.scrollHeight - SCROLL_MARGIN) {
+            return;
+        }
+        // only the first list with missing entries grows
+        for (i = 0; i < lists.length; i += 1) {
+            if (lists[i].request) {
+                return;
+            }
+            if (lists[i].getAttribute('data-next')) {
+                load(sidebar, lists[i], false);
+                return;
+            }
+        }
+    }
+
+    function init(sidebar) {
+        var search = sidebar.querySelector('.sidebar-search');
+        var timeout;
+
+        sidebar.query = '';
+        sidebar.parentNode.addEventListener('scroll', function () {
+            loadVisible(sidebar);
+        });
+
+        if (search) {
+            search.addEventListener('input', function () {
+                window.clearTimeout(timeout);
+                timeout = window.setTimeout(function () {
+                    var lists = sidebar.querySelectorAll('ul[data-url]');
+                    var i;
+
+                    sidebar.query = search.value.trim();
+                    for (i = 0; i < lists.length; i += 1) {
+                        load(sidebar, lists[i], true);
+                    }
+                }, SEARCH_DELAY);
+            });
+        }
+
+        loadVisible(sidebar);
+    }
+
+    Array.prototype.forEach.call(
+        document.querySelectorAll('.lazy-sidebar'), init);
+}());
@@ -0,0 +1,11 @@
+from __future__ import unicode_literals
+
+from django.apps import AppConfig
+
+
+class StaffConfig(AppConfig):
+    name = 'staff'
+
+    def ready(self):
+        # connect the signal handlers that invalidate the cached sidebars
+        import staff.sidebar  # noqa pylint: disable=unused-import
@@ -0,0 +1,112 @@
+"""CSV exports of the staff tables.
+
+The rows are read with QuerySet.iterator() and written to a
+StreamingHttpResponse one by one, so that neither the queryset nor the file
+is ever held in memory, even when the whole database is exported."""
+from django.http import StreamingHttpResponse
+from django.utils import six
+from django.utils.encoding import force_text
+import csv
+import zlib
+
+from register.models import Candidate, UserRegistration
+
+# flush the compressor after this many rows so the download keeps moving
+GZIP_FLUSH_INTERVAL = 1000
+
+CANDIDATE_COLUMNS = (
+    ('id', 'id'),
+    ('status', 'status'),
+    ('first_name', 'first_name'),
+    ('last_name', 'last_name'),
+    ('date_of_birth', 'date_of_birth'),
+    ('bicycle_kind', 'user_registration__bicycle_kind'),
+    ('bicycle_number', 'bicycle__bicycle_number'),
+    ('color', 'bicycle__color'),
+    ('brand', 'bicycle__brand'))
+
+BICYCLE_COLUMNS = (
+    ('id', 'id'),
+    ('bicycle_number', 'bicycle_number'),
+    ('lock_combination', 'lock_combination'),
+    ('color', 'color'),
+    ('brand', 'brand'),
+    ('general_remarks', 'general_remarks'),
+    ('date_of_handout', 'date_of_handout'),
+    ('candidate_id', 'candidate_id'),
+    ('first_name', 'candidate__first_name'),
+    ('last_name', 'candidate__last_name'))
+
+DISPLAY_VALUES = {
+    'status': dict(Candidate.CANDIDATE_STATUS),
+    'user_registration__bicycle_kind': dict(
+        UserRegistration.BICYCLE_CHOICES)}
+
+
+class Echo(object):
+    """File-like object that returns what is written to it instead of
+    buffering it, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def get_rows(queryset, columns):
+    """Yield the header and the rows of the queryset as lists of strings.
+
+    The values are fetched with a single query, joins included."""
+    lookups = [lookup for _, lookup in columns]
+    yield [name for name, _ in columns]
+
+    display_values = [DISPLAY_VALUES.get(lookup) for lookup in lookups]
+    for values in queryset.values_list(*lookups).iterator():
+        yield [force_text(display.get(value, value) if display else value)
+               if value is not None else ''
+               for display, value in zip(display_values, values)]
+
+
+def encode_rows(rows):
+    """Yield the rows as UTF-8 encoded lines of CSV."""
+    writer = csv.writer(Echo())
+    for row in rows:
+        if six.PY2:
+            # the csv module of Python 2 only writes byte strings
+            yield writer.writerow([value.encode('utf-8') for value in row])
+        else:
+            yield writer.writerow(row).encode('utf-8')
+
+
+def compress(chunks):
+    """Yield the gzip compressed chunks. The compressor is flushed after the
+    first chunk and then regularly, so that the first byte goes out
+    immediately."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for number, chunk in enumerate(chunks):
+        data = compressor.compress(chunk)
+        if number % GZIP_FLUSH_INTERVAL == 0:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_csv(request, queryset, columns, filename):
+    """Return a StreamingHttpResponse with the queryset as CSV file.
+
+    The file is compressed with gzip if the request has the parameter
+    gzip."""
+    # the rows are read after the view has returned, from the database
+    # that was chosen for the view
+    queryset = queryset.using(queryset.db)
+    lines = encode_rows(get_rows(queryset, columns))
+
+    if request.GET.get('gzip'):
+        response = StreamingHttpResponse(compress(lines),
+                                         content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(
+            lines, content_type='text/csv; charset=utf-8')
+
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
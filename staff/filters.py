@@ -11,6 +11,7 @@ from operator import or_
 from functools import reduce
 
 from register.models import Candidate, Bicycle, UserRegistration
+from register.search import search_candidates
 
 
 EMPTY_CHOICE = ('', '---------'),
@@ -38,7 +39,7 @@ class CandidateFilter(FilterSet):
                      Div(Field('bicycle_kind'),
                          css_class='col-xs-12 col-md-4'),
                      css_class='row'),
-                     FormAction(Submit('submit', 'Filter'))
+                     FormActions(Submit('submit', 'Filter'))
                  )
 
         self.helper.layout = Layout(*layout)
@@ -49,7 +50,11 @@ class CandidateFilter(FilterSet):
         fields = ['name', 'status', 'bicycle_kind']
 
     def name_filter(self, queryset, value):
-        if value:
+        if value.split():
+            matches = search_candidates(queryset, value)
+            if matches is not None:
+                return matches
+
             return queryset.filter(
                     reduce(or_, (Q(first_name__icontains=name) |
                                  Q(last_name__icontains=name)
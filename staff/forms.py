@@ -7,7 +7,7 @@ from django.utils.formats import date_format
 from django.utils.translation import ugettext_lazy
 
 from register.forms import SelectDateOfBirthWidget, MULTIPLE_REGISTRATION_ERROR
-from register.models import Bicycle, Candidate
+from register.models import Bicycle, Candidate, UserRegistration
 
 
 class CreateCandidateForm(forms.ModelForm):
@@ -231,3 +231,64 @@ class InviteForm(forms.Form):
     choice_2 = forms.IntegerField(min_value=0)
     choice_3 = forms.IntegerField(min_value=0)
     choice_4 = forms.IntegerField(min_value=0)
+
+
+PLAN_CHANGED_ERROR = ugettext_lazy(
+    'The numbers have changed, preview the plan again.')
+
+IMPORT_STOPPED_ERROR = ugettext_lazy(
+    'The file could not be read after %(imported)s people were imported: '
+    '%(error)s')
+
+
+class PlanInvitationsForm(forms.Form):
+    """Numbers of bicycles of each kind at each of the events."""
+
+    def __init__(self, events, *args, **kwargs):
+        super(PlanInvitationsForm, self).__init__(*args, **kwargs)
+        self.events = events
+        for event in events:
+            for kind, name in UserRegistration.BICYCLE_CHOICES:
+                field = forms.IntegerField(min_value=0, initial=0, label=name)
+                self.fields[self.get_field_name(event, kind)] = field
+
+    @staticmethod
+    def get_field_name(event, kind):
+        return 'capacity_%s_%s' % (event.id, kind)
+
+    @property
+    def rows(self):
+        """Pairs of event and the fields of its numbers of bicycles."""
+        return [(event, [self[self.get_field_name(event, kind)]
+                         for kind, _ in UserRegistration.BICYCLE_CHOICES])
+                for event in self.events]
+
+    def get_capacities(self):
+        """Return the numbers of bicycles by kind of the events with any
+        bicycles."""
+        capacities = {}
+        for event in self.events:
+            numbers = dict(
+                (kind, self.cleaned_data[self.get_field_name(event, kind)])
+                for kind, _ in UserRegistration.BICYCLE_CHOICES)
+            if any(numbers.values()):
+                capacities[event] = numbers
+        return capacities
+
+    def clean(self):
+        cleaned_data = super(PlanInvitationsForm, self).clean()
+        if not self.errors and not self.get_capacities():
+            raise ValidationError(
+                ugettext_lazy('Enter the bicycles of at least one event.'))
+        return cleaned_data
+
+
+class ImportCandidatesForm(forms.Form):
+    csv_file = forms.FileField(label=ugettext_lazy('CSV file'))
+
+    def __init__(self, *args, **kwargs):
+        super(ImportCandidatesForm, self).__init__(*args, **kwargs)
+
+        self.helper = FormHelper()
+        self.helper.add_input(Submit('submit', 'Import',
+                                     css_class='col-xs-3 btn-info'))
@@ -0,0 +1,270 @@
+"""Keyset pagination of the tables of the staff pages.
+
+django_tables2 paginates with Django's Paginator, which selects a page with
+OFFSET and counts all rows on every request, so the later pages of a large
+table get slower and slower. KeysetPaginator instead selects the rows that
+follow the last row of the previous page (or precede the first row of the
+next page) in the current sort order of the table, which costs the same on
+every page. The links of the pager carry the id of that row:
+
+    ?sort=last_name&page=7&after=1234
+
+The first and the last page are selected without a cursor, other page
+numbers without a cursor fall back to OFFSET. The number of rows is cached
+under the version of the data, like the sidebars.
+
+The rows are seeked in the order of SQLite, where NULL comes before all
+other values."""
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Page, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils import six
+from django.utils.encoding import force_bytes
+from django.utils.functional import cached_property
+from django_tables2 import RequestConfig
+from django_tables2.rows import BoundRows
+import hashlib
+
+from staff.sidebar import get_version
+
+AFTER_FIELD = 'after'
+BEFORE_FIELD = 'before'
+
+COUNT_TIMEOUT = 60 * 5
+
+
+def get_ordering(queryset):
+    """Return the ordering of the queryset as pairs of field and whether it
+    is descending, ending with the primary key. Returns None if the queryset
+    is ordered by something that cannot be filtered on, e.g. the rank of a
+    search."""
+    query = queryset.query
+    if query.extra_order_by:
+        return None
+    order_by = query.order_by or (query.default_ordering and
+                                  queryset.model._meta.ordering) or ()
+
+    pk_name = queryset.model._meta.pk.name
+    ordering = []
+    for name in order_by:
+        if not isinstance(name, six.string_types) or name == '?':
+            return None
+        descending = name.startswith('-')
+        name = name.lstrip('-')
+        if name in query.extra_select:
+            return None
+        if name == 'pk':
+            name = pk_name
+        ordering.append((name, descending))
+        if name == pk_name:
+            return ordering
+    ordering.append((pk_name, False))
+    return ordering
+
+
+def get_order_by(ordering):
+    return ['-' + name if descending else name
+            for name, descending in ordering]
+
+
+def reverse_ordering(ordering):
+    return [(name, not descending) for name, descending in ordering]
+
+
+def is_nullable(model, path):
+    """Can the value at the path of lookups be NULL, either itself or
+    because a relation on the way is missing? Annotations might be NULL."""
+    for name in path.split('__'):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return True
+        if field.null or not field.concrete:
+            return True
+        if not field.is_relation:
+            return False
+        model = field.related_model
+    return False
+
+
+def seek(queryset, ordering, values):
+    """Return the part of the queryset that comes after the row with the
+    given values of the fields of the ordering."""
+    condition = Q()
+    equal = Q()
+    for name, descending in ordering:
+        value = values[name]
+        if value is None:
+            beyond = Q() if descending else Q(**{name + '__isnull': False})
+            same = Q(**{name + '__isnull': True})
+        else:
+            beyond = Q(**{name + ('__lt' if descending else '__gt'): value})
+            if descending and is_nullable(queryset.model, name):
+                beyond |= Q(**{name + '__isnull': True})
+            same = Q(**{name: value})
+        if beyond:
+            condition |= equal & beyond
+        equal &= same
+
+    # a range on the first field lets the database start in its index
+    name, descending = ordering[0]
+    value = values[name]
+    if len(ordering) > 1 and value is not None:
+        if not descending:
+            condition &= Q(**{name + '__gte': value})
+        elif not is_nullable(queryset.model, name):
+            condition &= Q(**{name + '__lte': value})
+
+    return queryset.filter(condition)
+
+
+class KeysetPage(Page):
+    """Page of a KeysetPaginator. The ids of its first and its last row
+    select the neighbouring pages."""
+
+    def __init__(self, object_list, number, paginator, has_previous=None,
+                 has_next=None):
+        super(KeysetPage, self).__init__(object_list, number, paginator)
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    @cached_property
+    def records(self):
+        return [row.record for row in self.object_list]
+
+    def has_previous(self):
+        if self._has_previous is None:
+            return super(KeysetPage, self).has_previous()
+        return self._has_previous
+
+    def has_next(self):
+        if self._has_next is None:
+            return super(KeysetPage, self).has_next()
+        return self._has_next
+
+    # the number of rows is cached, so the numbers are not validated
+
+    def previous_page_number(self):
+        return max(self.number - 1, 1)
+
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_cursor(self):
+        return self.records[0].pk if self.records else None
+
+    @property
+    def next_cursor(self):
+        return self.records[-1].pk if self.records else None
+
+
+class KeysetPaginator(Paginator):
+    """Paginator for the rows of a table of a queryset. The page is selected
+    with the id after, of the last row of the previous page, or the id
+    before, of the first row of the next page. The number of rows is cached
+    under the version of the sidebar with that name."""
+
+    def __init__(self, object_list, per_page, after=None, before=None,
+                 version=None, **kwargs):
+        super(KeysetPaginator, self).__init__(object_list, per_page,
+                                              **kwargs)
+        self.after = after
+        self.before = before
+        self.version = version
+
+    @cached_property
+    def queryset(self):
+        return getattr(self.object_list.data, 'queryset', None)
+
+    @cached_property
+    def count(self):
+        if self.queryset is None:
+            return len(self.object_list)
+
+        queryset = self.queryset.order_by()
+        key = 'staff-table-count-%s' % hashlib.md5(force_bytes('%s-%s-%s' % (
+            get_version(self.version) if self.version else '',
+            queryset.db, queryset.query))).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, COUNT_TIMEOUT)
+        return count
+
+    def _get_page(self, *args, **kwargs):
+        return KeysetPage(*args, **kwargs)
+
+    def get_rows(self, queryset, size):
+        return BoundRows(list(queryset[:size]), table=self.object_list.table)
+
+    def page(self, number):
+        ordering = self.queryset is not None and get_ordering(self.queryset)
+        if not ordering:
+            return super(KeysetPaginator, self).page(number)
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+
+        cursor = self.after or self.before
+        values = cursor and self.queryset.filter(pk=cursor).prefetch_related(
+            None).values(*[name for name, _ in ordering]).first()
+        if values:
+            if self.after:
+                return self.get_next_page(number, ordering, values)
+            return self.get_previous_page(number, ordering, values)
+
+        if number == 1:
+            rows = self.get_rows(
+                self.queryset.order_by(*get_order_by(ordering)),
+                self.per_page + 1)
+            return KeysetPage(rows[:self.per_page], 1, self,
+                              has_previous=False,
+                              has_next=len(rows) > self.per_page)
+
+        number = self.validate_number(number)
+        if number == self.num_pages:
+            return self.get_last_page(number, ordering)
+        return super(KeysetPaginator, self).page(number)
+
+    def get_next_page(self, number, ordering, values):
+        queryset = seek(self.queryset.order_by(*get_order_by(ordering)),
+                        ordering, values)
+        rows = self.get_rows(queryset, self.per_page + 1)
+        return KeysetPage(rows[:self.per_page], number, self,
+                          has_previous=True,
+                          has_next=len(rows) > self.per_page)
+
+    def get_previous_page(self, number, ordering, values):
+        reverse = reverse_ordering(ordering)
+        queryset = seek(self.queryset.order_by(*get_order_by(reverse)),
+                        reverse, values)
+        rows = self.get_rows(queryset, self.per_page + 1)
+        has_previous = len(rows) > self.per_page
+        return KeysetPage(rows[self.per_page - 1::-1] if has_previous
+                          else rows[::-1],
+                          number if has_previous else 1, self,
+                          has_previous=has_previous, has_next=True)
+
+    def get_last_page(self, number, ordering):
+        size = self.count - (number - 1) * self.per_page
+        queryset = self.queryset.order_by(
+            *get_order_by(reverse_ordering(ordering)))
+        rows = self.get_rows(queryset, size)
+        return KeysetPage(rows[::-1], number, self, has_previous=True,
+                          has_next=False)
+
+
+def configure_table(request, table, per_page, version=None):
+    """Sort and paginate the table according to the request, like
+    RequestConfig, but with a KeysetPaginator."""
+    paginate = {'klass': KeysetPaginator, 'per_page': per_page,
+                'version': version}
+    for field in (AFTER_FIELD, BEFORE_FIELD):
+        try:
+            paginate[field] = int(request.GET[field])
+        except (KeyError, ValueError):
+            pass
+    RequestConfig(request, paginate=paginate).configure(table)
@@ -0,0 +1,191 @@
+"""Sidebars of the staff pages.
+
+The sidebars only contain the first window of their entries, further
+windows are loaded from the JSON endpoints while scrolling. The windows are
+selected with keyset pagination, so every window costs the same no matter
+how far down the list it is.
+
+Every sidebar has a version, which is replaced whenever a change of the
+data shown in the sidebar is committed. The rendered sidebars are cached
+under their version, so each sidebar is rendered only once after every
+change, no matter which of its entries is selected."""
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import formats, timezone
+from django.utils.html import escape
+from django.utils.translation import get_language
+
+from bwb.routers import use_primary
+from register.email import get_url_parameter
+from register.models import Bicycle, Candidate, HandoutEvent
+from register.models import candidates_updated, get_hash_value
+
+
+CANDIDATES = 'candidates'
+EVENTS = 'events'
+BICYCLES = 'bicycles'
+
+TIMEOUT = 60 * 60 * 24
+
+WINDOW_SIZE = 50
+
+CANDIDATE_ORDERING = ('id',)
+EVENT_ORDERING = ('due_date', 'id')
+BICYCLE_ORDERING = ('bicycle_number', 'id')
+
+
+def get_version_key(name):
+    return 'staff-sidebar-version-%s' % name
+
+
+def get_version(name):
+    key = get_version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, get_hash_value(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    # a new random value instead of an increment cannot get lost when two
+    # processes change the data at the same time
+    cache.set(get_version_key(name), get_hash_value(), None)
+
+
+def bump_version_on_commit(name):
+    # before the commit other processes would cache the old data under the
+    # new version
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def render_sidebar(name, template_name, get_context, selected_id):
+    """Return the rendered sidebar from the cache or render and cache it.
+    The sidebar is cached without a selection, the entry with the id
+    selected_id is marked afterwards."""
+    key = 'staff-sidebar-%s-%s-%s' % (name, get_version(name), get_language())
+    html = cache.get(key)
+    if html is None:
+        # the cached sidebar has to be as new as its version
+        with use_primary():
+            context = get_context()
+        html = render_to_string(template_name, context)
+        cache.set(key, html, TIMEOUT)
+    return select_entry(html, selected_id)
+
+
+def select_entry(html, selected_id):
+    """Mark the entry with the id selected_id in the rendered sidebar, whose
+    entries are <li data-id="..."> and whose selection is empty."""
+    if not selected_id:
+        return html
+    selected_id = escape(selected_id)
+    html = html.replace('data-selected=""',
+                        'data-selected="%s"' % selected_id, 1)
+    return html.replace('<li data-id="%s">' % selected_id,
+                        '<li class="active" data-id="%s">' % selected_id, 1)
+
+
+def seek(queryset, ordering, after):
+    """Return the part of the queryset that comes after the object with the
+    id after, if ordered by the given fields. The last field has to be
+    unique.
+
+    Ordered by id alone, the object may have been deleted in the meantime.
+    Otherwise its values are needed and nothing comes after a deleted
+    object."""
+    if tuple(ordering) == ('id',):
+        return queryset.filter(id__gt=after)
+
+    values = queryset.model.objects.filter(id=after).values(*ordering).first()
+    if values is None:
+        return queryset.none()
+
+    condition = Q()
+    for i, field in enumerate(ordering):
+        lookup = dict((f, values[f]) for f in ordering[:i])
+        lookup[field + '__gt'] = values[field]
+        condition |= Q(**lookup)
+    return queryset.filter(condition)
+
+
+def get_window(queryset, ordering, after=None, size=WINDOW_SIZE):
+    """Return a list of at most size objects following after and the id of
+    the last of them, if there are more objects, otherwise None."""
+    if after:
+        queryset = seek(queryset, ordering, after)
+    objects = list(queryset.order_by(*ordering)[:size + 1])
+    if len(objects) > size:
+        return objects[:size], objects[size - 1].id
+    return objects, None
+
+
+def search_candidates(queryset, query):
+    """Filter the candidates whose first or last name starts with every
+    word of the query."""
+    for name in query.split():
+        queryset = queryset.filter(Q(first_name__istartswith=name) |
+                                   Q(last_name__istartswith=name))
+    return queryset
+
+
+def get_candidate_window(status, query='', after=None):
+    queryset = Candidate.objects.filter(status=status).only(
+        'id', 'first_name', 'last_name')
+    return get_window(search_candidates(queryset, query), CANDIDATE_ORDERING,
+                      after)
+
+
+def get_event_window(after=None):
+    return get_window(HandoutEvent.objects.all(), EVENT_ORDERING, after)
+
+
+def get_bicycle_window(after=None):
+    queryset = Bicycle.objects.only('id', 'bicycle_number', 'candidate_id')
+    return get_window(queryset, BICYCLE_ORDERING, after)
+
+
+def get_candidate_entry(candidate):
+    return {'id': candidate.id,
+            'label': '%s %s' % (candidate.first_name, candidate.last_name),
+            'url': reverse('staff:candidate',
+                           kwargs={'candidate_id': candidate.id})}
+
+
+def get_event_entry(event):
+    return {'id': event.id,
+            'label': formats.date_format(timezone.localtime(event.due_date),
+                                         'DATETIME_FORMAT'),
+            'url': reverse('staff:event', kwargs={'event_id': event.id})}
+
+
+def get_bicycle_entry(bicycle):
+    url = reverse('staff:candidate',
+                  kwargs={'candidate_id': bicycle.candidate_id})
+    return {'id': bicycle.id,
+            'label': '# %s' % bicycle.bicycle_number,
+            'url': url + get_url_parameter('bicycle_id', bicycle.id)}
+
+
+@receiver(post_save, sender=Candidate)
+@receiver(post_delete, sender=Candidate)
+@receiver(candidates_updated)
+def handler_on_candidate_change(**kwargs):  # pylint: disable=unused-argument
+    bump_version_on_commit(CANDIDATES)
+
+
+@receiver(post_save, sender=HandoutEvent)
+@receiver(post_delete, sender=HandoutEvent)
+def handler_on_event_change(**kwargs):  # pylint: disable=unused-argument
+    bump_version_on_commit(EVENTS)
+
+
+@receiver(post_save, sender=Bicycle)
+@receiver(post_delete, sender=Bicycle)
+def handler_on_bicycle_change(**kwargs):  # pylint: disable=unused-argument
+    bump_version_on_commit(BICYCLES)
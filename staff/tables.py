@@ -1,6 +1,7 @@
 from django.conf import settings
 from django.conf.global_settings import SHORT_DATE_FORMAT
 from django.core.urlresolvers import reverse_lazy
+from django.db.models.query import QuerySet
 from django.utils import formats
 from django.utils.html import format_html
 
@@ -14,6 +15,14 @@ def format_date(value):
                                formats.get_format(SHORT_DATE_FORMAT,
                                                   lang=settings.LANGUAGE_CODE))
 
+
+def select_candidate_related(queryset):
+    """Fetch everything shown in a candidate table together with the
+    candidates, so that rendering a page does not query per row."""
+    return queryset.select_related(
+        'user_registration', 'bicycle').prefetch_related(
+            'invitations__handout_event')
+
 # pylint: disable=too-few-public-methods
 # pylint: disable=no-self-use
 
@@ -24,7 +33,9 @@ class EventTable(tables.Table):
     date_of_birth = tables.Column(verbose_name='Date of Birth')
     invitations = tables.Column(
         verbose_name='Invitations',
-        accessor='invitations')
+        accessor='invitations',
+        # the rows cannot be paginated in the order of a list
+        orderable=False)
     wanted_bicycle = tables.Column(
         verbose_name='Wanted bicycle',
         accessor='user_registration.bicycle_kind')
@@ -34,6 +45,8 @@ class EventTable(tables.Table):
         order_by='bicycle.bicycle_number')
 
     def __init__(self, data, event_id=None, *args, **kwargs):
+        if isinstance(data, QuerySet):
+            data = select_candidate_related(data)
         super(EventTable, self).__init__(data, *args, **kwargs)
         self.event_id = event_id
 
@@ -65,8 +78,9 @@ class EventTable(tables.Table):
     class Meta(object):
         model = Candidate
         attrs = {'class': 'bootstrap', 'width': '100%'}
-        template = 'django_tables2/bootstrap.html'
+        template = 'staff/table.html'
         empty_text = "There are currently no canditates in the database."
+        exclude = ('first_name_norm', 'last_name_norm')
         sequence = ('id', 'status', '...')
 
 
@@ -75,16 +89,22 @@ class CandidateTable(EventTable):
     class Meta(object):
         model = Candidate
         attrs = {'class': 'bootstrap', 'width': '100%'}
-        template = 'django_tables2/bootstrap.html'
+        template = 'staff/table.html'
         empty_text = "There are currently no canditates in the database."
+        exclude = ('first_name_norm', 'last_name_norm')
         sequence = ('id', 'status', '...')
 
 
 class BicycleTable(tables.Table):
 
-    def render_id(self, value):
-        bicycle = Bicycle.objects.get(id=value)
-        candidate_id = bicycle.candidate.id
+    def __init__(self, data, *args, **kwargs):
+        if isinstance(data, QuerySet):
+            # the candidate column shows the candidate of every bicycle
+            data = data.select_related('candidate')
+        super(BicycleTable, self).__init__(data, *args, **kwargs)
+
+    def render_id(self, value, record):
+        candidate_id = record.candidate_id
         candidate_url = (reverse_lazy('staff:candidate',
                                       kwargs={'candidate_id': candidate_id}) +
                          get_url_parameter('bicycle_id', value))
@@ -93,27 +113,20 @@ class BicycleTable(tables.Table):
     class Meta(object):
         model = Bicycle
         attrs = {'class': 'bootstrap', 'width': '100%'}
-        template = 'django_tables2/bootstrap.html'
+        template = 'staff/table.html'
         empty_text = "There are currently no bicycles in the database."
         sequence = ('id', 'bicycle_number', '...')
 
 
 class HandoutEventTable(tables.Table):
+    """Table of events. The data needs to be annotated with
+    number_of_invitations and number_handed_out."""
     invitations = tables.Column(
         verbose_name='Invitations',
-        accessor='invitations')
+        accessor='number_of_invitations')
     handed_out = tables.Column(
         verbose_name='Bikes handed out',
-        accessor='invitations')
-
-    def render_invitations(self, value):
-        return len(value.all())
-
-    def render_handed_out(self, value):
-        candidate_status = [
-            invitation.candidate.get_status() for invitation in value.all()
-        ]
-        return candidate_status.count(Candidate.WITH_BICYCLE)
+        accessor='number_handed_out')
 
     def render_id(self, value):
         event_url = (reverse_lazy('staff:event', kwargs={'event_id': value}))
@@ -122,6 +135,6 @@ class HandoutEventTable(tables.Table):
     class Meta(object):
         model = HandoutEvent
         attrs = {'class': 'bootstrap', 'width': '100%'}
-        template = 'django_tables2/bootstrap.html'
+        template = 'staff/table.html'
         empty_text = "There are currently no events in the database."
         sequence = ('id', 'due_date', '...')
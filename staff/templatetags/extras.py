@@ -1,28 +1,45 @@
 from django import template
+from django.utils.safestring import mark_safe
 
-from register.models import HandoutEvent, Candidate, Bicycle
+from register.models import Candidate
+from staff.sidebar import render_sidebar, CANDIDATES, EVENTS, BICYCLES
+from staff.sidebar import get_candidate_window, get_event_window
+from staff.sidebar import get_bicycle_window
 
 
 register = template.Library()
 
 
-@register.inclusion_tag('staff/event_sidebar.html')
+@register.simple_tag
 def get_event_list(event_id):
-    events = list(HandoutEvent.objects.all())
-    events.sort(key=lambda e: e.due_date)
-    return {'events': events,
-            'event_id': event_id}
+    def get_context():
+        events, next_id = get_event_window()
+        return {'events': events,
+                'next_id': next_id}
+    return mark_safe(render_sidebar(EVENTS, 'staff/event_sidebar.html',
+                                    get_context, event_id))
 
 
-@register.inclusion_tag('staff/candidate_sidebar.html')
+@register.simple_tag
 def get_candidate_list(candidate_id):
-    return {'status_and_candidates': Candidate.get_status_and_candidates(),
-            'candidate_id': candidate_id}
-
-
-@register.inclusion_tag('staff/bicycle_sidebar.html')
+    def get_context():
+        groups = []
+        for status, name in Candidate.CANDIDATE_STATUS:
+            candidates, next_id = get_candidate_window(status)
+            groups.append({'status': status,
+                           'name': name,
+                           'candidates': candidates,
+                           'next_id': next_id})
+        return {'groups': groups}
+    return mark_safe(render_sidebar(CANDIDATES, 'staff/candidate_sidebar.html',
+                                    get_context, candidate_id))
+
+
+@register.simple_tag
 def get_bicycle_list(bicycle_id):
-    bicycles = list(Bicycle.objects.all())
-    bicycles.sort(key=lambda b: b.bicycle_number)
-    return {'bicycles': bicycles,
-            'bicycle_id': bicycle_id}
+    def get_context():
+        bicycles, next_id = get_bicycle_window()
+        return {'bicycles': bicycles,
+                'next_id': next_id}
+    return mark_safe(render_sidebar(BICYCLES, 'staff/bicycle_sidebar.html',
+                                    get_context, bicycle_id))
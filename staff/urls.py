@@ -9,6 +9,10 @@ from staff.views import CandidateView, EventView, ManageView, EventOverviewView
 from staff.views import CreateEventView, AutoInviteView, ModifyCandidateView
 from staff.views import HandoverBicycleView, CandidateOverviewView
 from staff.views import RefundBicycleView, InviteCandidateView
+from staff.views import CandidateSidebarView, EventSidebarView
+from staff.views import BicycleSidebarView, ImportCandidatesView
+from staff.views import CandidateExportView, BicycleExportView
+from staff.views import EventExportView, MetricsView, PlanInvitationsView
 
 
 EVENT_PATTERN = r'^%s/(?P<event_id>[0-9]+)/$'
@@ -24,6 +28,9 @@ urlpatterns = [
     url(regex=r'^bicycle_overview.html$',
         view=login_required(BicycleOverviewView.as_view()),
         name='bicycle_overview'),
+    url(regex=r'^bicycle_overview.csv$',
+        view=login_required(BicycleExportView.as_view()),
+        name='bicycle_export'),
 
     # URLs related to events
     url(regex=r'^event_overview.html$',
@@ -32,21 +39,34 @@ urlpatterns = [
     url(regex=EVENT_PATTERN % 'event',
         view=login_required(EventView.as_view()),
         name='event'),
+    url(regex=r'^event/(?P<event_id>[0-9]+).csv$',
+        view=login_required(EventExportView.as_view()),
+        name='event_export'),
     url(regex=EVENT_PATTERN % 'invite',
         view=login_required(AutoInviteView.as_view()),
         name='invite'),
     url(regex=r'^create_event/$',
         view=login_required(CreateEventView.as_view()),
         name='create_event'),
+    url(regex=r'^plan_invitations/$',
+        view=login_required(PlanInvitationsView.as_view()),
+        name='plan_invitations'),
 
     # URLs related to candidates
     url(regex=r'^candidate_overview.html$',
         view=login_required(CandidateOverviewView.as_view(
             query_set=Candidate.objects.all())),
         name='candidate_overview'),
+    url(regex=r'^candidate_overview.csv$',
+        view=login_required(CandidateExportView.as_view(
+            query_set=Candidate.objects.all())),
+        name='candidate_export'),
     url(regex=r'^create_candidate.html$',
         view=login_required(CreateCandidateView.as_view()),
         name='create_candidate'),
+    url(regex=r'^import_candidates.html$',
+        view=login_required(ImportCandidatesView.as_view()),
+        name='import_candidates'),
 
 
     url(regex=CANDIDATE_PATTERN % 'candidate',
@@ -66,5 +86,21 @@ urlpatterns = [
         name='invite_candidate'),
     url(regex=CANDIDATE_PATTERN % 'delete_candidate',
         view=login_required(DeleteCandidateView.as_view()),
-        name='delete_candidate')
+        name='delete_candidate'),
+
+    # URLs of the entries of the sidebars
+    url(regex=r'^sidebar/candidates.json$',
+        view=login_required(CandidateSidebarView.as_view()),
+        name='candidate_sidebar'),
+    url(regex=r'^sidebar/events.json$',
+        view=login_required(EventSidebarView.as_view()),
+        name='event_sidebar'),
+    url(regex=r'^sidebar/bicycles.json$',
+        view=login_required(BicycleSidebarView.as_view()),
+        name='bicycle_sidebar'),
+
+    # authenticates itself, to allow scraping with a token
+    url(regex=r'^metrics$',
+        view=MetricsView.as_view(),
+        name='metrics')
 ]
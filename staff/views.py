@@ -1,23 +1,45 @@
+from django.conf import settings
 from django.core.urlresolvers import reverse_lazy
-from django.http import Http404
+from django.db import transaction
+from django.db.models import Count
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.http import JsonResponse
 from django.http.response import HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
 from django.views.generic import View, FormView
 from django.views.generic.base import TemplateView
-from django_tables2 import RequestConfig
-import random
+import codecs
 
-from register.email import send_message_after_invitation
-from register.models import Candidate, Bicycle, HandoutEvent, SiteConfiguration
+from bwb.routers import reads_from_replica
+from register.importer import COLUMNS, import_candidates
+from register.invite import invite_winners
+from register.metrics import count_invitations, render_metrics
+from register.models import Candidate, Bicycle, HandoutEvent
 from register.models import UserRegistration, Invitation
+from register.outbox import queue_message_after_invitation
+from register.planner import Plan, commit_plan, get_preview
+from register.planner import get_capacity_list, plan_invitations
+from staff.export import export_csv, CANDIDATE_COLUMNS, BICYCLE_COLUMNS
 from staff.filters import CandidateFilter, BicycleFilter
 from staff.forms import CreateCandidateForm, DeleteCandidateForm
 from staff.forms import HandoverForm, EventForm, InviteForm, RefundForm
 from staff.forms import ModifyCandidateForm, InviteCandidateForm
+from staff.forms import ImportCandidatesForm, PlanInvitationsForm
+from staff.forms import IMPORT_STOPPED_ERROR, PLAN_CHANGED_ERROR
+from staff.paginators import configure_table
 from staff.tables import CandidateTable, BicycleTable, EventTable
+from staff.sidebar import get_candidate_window, get_event_window
+from staff.sidebar import get_bicycle_window, get_candidate_entry
+from staff.sidebar import get_event_entry, get_bicycle_entry
+from staff.sidebar import BICYCLES, CANDIDATES, EVENTS
 from staff.tables import HandoutEventTable
 
 
+PLAN_SESSION_KEY = 'invitation-plan'
+
+
 class ManageView(TemplateView):
     template_name = 'staff/index.html'
 
@@ -25,23 +47,36 @@ class ManageView(TemplateView):
 class BicycleOverviewView(View):
     template_name = 'staff/bicycle_overview.html'
 
+    @reads_from_replica
     def get(self, request, *args, **kwargs):
         queryset = Bicycle.objects.all()
         matches = BicycleFilter(request.GET, queryset=queryset)
         table = BicycleTable(matches.qs)
-        RequestConfig(request, paginate={'per_page': 40}).configure(table)
+        configure_table(request, table, per_page=40, version=BICYCLES)
 
         context_dict = {'bicycles': table, 'filter': matches}
         return render(request, self.template_name, context_dict)
 
 
+class BicycleExportView(View):
+
+    @reads_from_replica
+    def get(self, request, *args, **kwargs):
+        matches = BicycleFilter(request.GET, queryset=Bicycle.objects.all())
+        return export_csv(request, matches.qs, BICYCLE_COLUMNS,
+                          'bicycles.csv')
+
+
 class EventOverviewView(TemplateView):
     template_name = 'staff/event_overview.html'
 
+    @reads_from_replica
     def get(self, request, *args, **kwargs):
-        queryset = HandoutEvent.objects.all()
+        queryset = HandoutEvent.objects.annotate(
+            number_of_invitations=Count('invitations', distinct=True),
+            number_handed_out=Count('invitations__candidate__bicycle'))
         table = HandoutEventTable(queryset)
-        RequestConfig(request, paginate={'per_page': 40}).configure(table)
+        configure_table(request, table, per_page=40, version=EVENTS)
 
         context_dict = {'handoutevents': table}
         return render(request, self.template_name, context_dict)
@@ -76,26 +111,13 @@ class AutoInviteView(FormView):
 
         event = get_object_or_404(HandoutEvent, id=event_id)
 
-        for choice, _ in UserRegistration.BICYCLE_CHOICES:
-            number_of_winners = form.cleaned_data['choice_%s' % choice]
-
-            # do have no bicycle and are registered with contact information
-            candidate = Candidate.registered_and_without_bicycle(choice)
-
-            # people that have not already been invited so many times
-            candidate = [
-                c for c in candidate if c.invitations.count() <
-                SiteConfiguration.get_solo().max_number_of_autoinvites]
-
-            winners = random.sample(candidate, min(len(candidate),
-                                                   number_of_winners))
+        number_of_winners = dict(
+            (choice, form.cleaned_data['choice_%s' % choice])
+            for choice, _ in UserRegistration.BICYCLE_CHOICES)
 
-            for winner in winners:
-                Invitation.objects.create(handout_event=event,
-                                          candidate=winner)
-
-                send_message_after_invitation(candidate=winner,
-                                              handout_event=event)
+        winners = invite_winners(event=event,
+                                 number_of_winners=number_of_winners)
+        count_invitations(len(winners), source='auto')
 
         self.success_url = reverse_lazy('staff:event',
                                         kwargs={'event_id': event.id})
@@ -110,20 +132,71 @@ class AutoInviteView(FormView):
         return render(request, self.template_name, context_dict)
 
 
+class PlanInvitationsView(FormView):
+    """Invitations to several upcoming events at once. The plan is shown
+    first and kept in the session until it is committed."""
+    template_name = 'staff/plan_invitations.html'
+    form_class = PlanInvitationsForm
+    success_url = reverse_lazy('staff:event_overview')
+
+    def get_form_kwargs(self):
+        kwargs = super(PlanInvitationsView, self).get_form_kwargs()
+        kwargs['events'] = list(HandoutEvent.objects.filter(
+            due_date__gte=timezone.now()).order_by('due_date', 'id'))
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        context = super(PlanInvitationsView, self).get_context_data(**kwargs)
+        context['bike_choices'] = UserRegistration.BICYCLE_CHOICES
+        return context
+
+    def post(self, request, *args, **kwargs):
+        if 'commit' in request.POST:
+            return self.commit(request)
+        return super(PlanInvitationsView, self).post(request, *args,
+                                                     **kwargs)
+
+    def form_valid(self, form):
+        plan = plan_invitations(form.get_capacities())
+        self.request.session[PLAN_SESSION_KEY] = plan.to_dict()
+        return self.render_to_response(self.get_context_data(
+            form=form, plan=plan, preview=get_preview(plan)))
+
+    def commit(self, request):
+        data = request.session.get(PLAN_SESSION_KEY)
+        if data is None:
+            # the plan has already been committed
+            return HttpResponseRedirect(
+                reverse_lazy('staff:plan_invitations'))
+
+        # the numbers might have been changed after the preview
+        plan = Plan.from_dict(data)
+        form = self.get_form()
+        if not form.is_valid():
+            return self.form_invalid(form)
+        if get_capacity_list(form.get_capacities()) != plan.capacities:
+            form.add_error(None, PLAN_CHANGED_ERROR)
+            return self.form_invalid(form)
+
+        invited = commit_plan(plan)
+        del request.session[PLAN_SESSION_KEY]
+        count_invitations(sum(len(candidate_ids)
+                              for candidate_ids in invited.values()),
+                          source='auto')
+        return HttpResponseRedirect(self.get_success_url())
+
+
 class EventView(View):
     template_name = 'staff/event.html'
 
+    @reads_from_replica
     def get(self, request, event_id, *args, **kwargs):
         event = get_object_or_404(HandoutEvent, id=event_id)
 
-        invited_candidates = [
-            invitation.candidate.id for invitation in event.invitations.all()
-        ]
-
-        queryset = Candidate.objects.filter(id__in=invited_candidates)
+        queryset = Candidate.objects.filter(invitations__handout_event=event)
         candidate_table = EventTable(data=queryset, event_id=event_id)
-        RequestConfig(request, paginate={'per_page': 100}).configure(
-            candidate_table)
+        configure_table(request, candidate_table, per_page=100,
+                        version=CANDIDATES)
 
         context_dict = {
             'candidates': candidate_table,
@@ -131,21 +204,43 @@ class EventView(View):
         return render(request, self.template_name, context_dict)
 
 
+class EventExportView(View):
+
+    @reads_from_replica
+    def get(self, request, event_id, *args, **kwargs):
+        event = get_object_or_404(HandoutEvent, id=event_id)
+
+        queryset = Candidate.objects.filter(invitations__handout_event=event)
+        return export_csv(request, queryset, CANDIDATE_COLUMNS,
+                          'event_%s.csv' % event.id)
+
+
 class CandidateOverviewView(View):
     template_name = 'staff/candidate_overview.html'
     query_set = None
 
+    @reads_from_replica
     def get(self, request, *args, **kwargs):
         matches = CandidateFilter(request.GET, queryset=self.query_set)
         candidates_table = CandidateTable(matches.qs)
-        RequestConfig(request, paginate={'per_page': 40}).configure(
-            candidates_table)
+        configure_table(request, candidates_table, per_page=40,
+                        version=CANDIDATES)
 
         context_dict = {'candidates': candidates_table,
                         'filter': matches}
         return render(request, self.template_name, context_dict)
 
 
+class CandidateExportView(View):
+    query_set = None
+
+    @reads_from_replica
+    def get(self, request, *args, **kwargs):
+        matches = CandidateFilter(request.GET, queryset=self.query_set)
+        return export_csv(request, matches.qs, CANDIDATE_COLUMNS,
+                          'candidates.csv')
+
+
 class CreateCandidateView(FormView):
     template_name = 'staff/create_candidate.html'
     form_class = CreateCandidateForm
@@ -156,14 +251,36 @@ class CreateCandidateView(FormView):
                      'last_name': form.cleaned_data['last_name'],
                      'date_of_birth': form.cleaned_data['date_of_birth']}
 
-        if Candidate.get_matching(**form_data):
-            raise Http404("This candidate already exists")
-
+        # CreateCandidateForm.clean has already checked for duplicates
         Candidate.objects.create(**form_data)
 
         return super(CreateCandidateView, self).form_valid(form)
 
 
+class ImportCandidatesView(FormView):
+    template_name = 'staff/import_candidates.html'
+    form_class = ImportCandidatesForm
+
+    def get_context_data(self, **kwargs):
+        context = super(ImportCandidatesView, self).get_context_data(**kwargs)
+        context['columns'] = COLUMNS
+        return context
+
+    def form_valid(self, form):
+        # the upload is read line by line and never completely in memory,
+        # utf-8-sig drops the byte order mark that Excel writes
+        lines = codecs.iterdecode(form.cleaned_data['csv_file'], 'utf-8-sig')
+        result = import_candidates(lines)
+        if result.error:
+            form.add_error('csv_file', IMPORT_STOPPED_ERROR % {
+                'imported': result.imported, 'error': result.error})
+            return self.render_to_response(self.get_context_data(
+                form=form, result=result))
+
+        return self.render_to_response(self.get_context_data(
+            form=self.form_class(), result=result))
+
+
 class CandidateMixin(object):
 
     def get_context_dict(self, candidate_id, event_id, bicycle_id, data=None):
@@ -271,14 +388,13 @@ class ModifyCandidateView(CandidateMixin, FormView):
     def form_valid(self, form):
         candidate_id = form.cleaned_data['candidate_id']
 
-        form_data = {'first_name': form.cleaned_data['first_name'],
-                     'last_name': form.cleaned_data['last_name'],
-                     'date_of_birth': form.cleaned_data['date_of_birth']}
-
-        if Candidate.get_matching(**form_data).exclude(id=candidate_id):
-            raise Http404("This candidate already exists")
+        candidate = get_object_or_404(Candidate, id=candidate_id)
 
-        Candidate.objects.filter(id=candidate_id).update(**form_data)
+        # ModifyCandidateForm.clean has already checked for duplicates
+        candidate.first_name = form.cleaned_data['first_name']
+        candidate.last_name = form.cleaned_data['last_name']
+        candidate.date_of_birth = form.cleaned_data['date_of_birth']
+        candidate.save()
 
         self.set_success_url(form)
 
@@ -346,12 +462,84 @@ class InviteCandidateView(CandidateMixin, FormView):
         if invitation_event not in candidate.events_not_invited_to:
             raise Http404("The Candidate is already invited to this event.")
 
-        Invitation.objects.create(candidate=candidate,
-                                  handout_event=invitation_event)
-
-        send_message_after_invitation(candidate=candidate,
+        with transaction.atomic():
+            Invitation.objects.create(candidate=candidate,
                                       handout_event=invitation_event)
 
+            queue_message_after_invitation(candidate=candidate,
+                                           handout_event=invitation_event)
+
+        count_invitations(1, source='manual')
+
         self.set_success_url(form)
 
         return super(InviteCandidateView, self).form_valid(form)
+
+
+class MetricsView(View):
+    """Metrics of all processes in the Prometheus text format. Besides
+    logged in staff, a scraper can authenticate with the header
+    'Authorization: Bearer <METRICS_TOKEN>'."""
+
+    def get(self, request, *args, **kwargs):
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if not (request.user.is_authenticated() or
+                (token and constant_time_compare(authorization,
+                                                 'Bearer %s' % token))):
+            return HttpResponseForbidden()
+
+        return HttpResponse(render_metrics(),
+                            content_type='text/plain; version=0.0.4')
+
+
+class SidebarView(View):
+    """Return a window of sidebar entries as JSON. The window starts after
+    the entry whose id is given by the parameter 'after'.
+
+    window returns the objects of a window and the id to continue after,
+    entry turns an object into an entry."""
+    window = None
+    entry = None
+
+    def get_window(self, request, after):
+        # pylint: disable=unused-argument
+        return self.window(after=after)
+
+    def get_entry(self, obj):
+        return self.entry(obj)
+
+    @reads_from_replica
+    def get(self, request, *args, **kwargs):
+        after = request.GET.get('after')
+        if after and not after.isdigit():
+            raise Http404("Invalid parameter 'after'.")
+
+        objects, next_id = self.get_window(request, after)
+        return JsonResponse({'entries': [self.get_entry(obj)
+                                         for obj in objects],
+                             'next': next_id})
+
+
+class CandidateSidebarView(SidebarView):
+    entry = staticmethod(get_candidate_entry)
+
+    def get_window(self, request, after):
+        try:
+            status = int(request.GET.get('status'))
+        except (TypeError, ValueError):
+            raise Http404("Invalid parameter 'status'.")
+
+        return get_candidate_window(status=status,
+                                    query=request.GET.get('q', ''),
+                                    after=after)
+
+
+class EventSidebarView(SidebarView):
+    window = staticmethod(get_event_window)
+    entry = staticmethod(get_event_entry)
+
+
+class BicycleSidebarView(SidebarView):
+    window = staticmethod(get_bicycle_window)
+    entry = staticmethod(get_bicycle_entry)
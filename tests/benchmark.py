@@ -0,0 +1,282 @@
+"""Benchmarks of all views on a generated dataset.
+
+Every view of bwb/urls.py, register/urls.py and staff/urls.py is requested
+through the test client. Wall time, number of queries and size of the
+response are recorded per view and compared to the baselines stored in
+benchmark_baselines.json, a view without a baseline fails. The benchmarks
+are not part of the normal test run:
+
+    ./manage.py test tests.benchmark
+
+The environment variable BENCHMARK_SCALES sets the numbers of candidates,
+e.g. 1000,10000,100000. With more than one scale a report shows how the
+time and the number of queries of every view grow with the data. With
+BENCHMARK_UPDATE=1 the baselines are overwritten with the results."""
+from __future__ import print_function
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import get_resolver, reverse
+from django.core.urlresolvers import RegexURLResolver
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+import json
+import math
+import os
+import timeit
+
+from register.dataset import populate
+from register.models import Bicycle, Candidate, HandoutEvent
+from register.models import UserRegistration
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baselines.json')
+
+SCALES = [int(scale) for scale in
+          os.environ.get('BENCHMARK_SCALES', '1000').split(',')]
+UPDATE_BASELINES = bool(os.environ.get('BENCHMARK_UPDATE'))
+
+# the best of this many requests is taken as the time of a view
+REPETITIONS = 3
+
+# allowed regressions relative to the baseline
+TIME_TOLERANCE = float(os.environ.get('BENCHMARK_TIME_TOLERANCE', 0.5))
+# differences of a few milliseconds are noise
+TIME_SLACK = 0.01
+BYTES_TOLERANCE = 0.2
+QUERY_TOLERANCE = 0
+
+# namespaces that are not benchmarked
+IGNORED_NAMESPACES = ('admin',)
+IGNORED_URL_NAMES = ('set_language',)
+
+
+def get_url_names(resolver=None, namespace=None):
+    """Return the names, including the namespace, of all URL patterns."""
+    resolver = resolver or get_resolver(None)
+    names = set()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, RegexURLResolver):
+            if pattern.namespace in IGNORED_NAMESPACES:
+                continue
+            names |= get_url_names(pattern,
+                                   pattern.namespace or namespace)
+        elif pattern.name and pattern.name not in IGNORED_URL_NAMES:
+            names.add('%s:%s' % (namespace, pattern.name) if namespace
+                      else pattern.name)
+    return names
+
+
+def get_requests():
+    """Return the benchmarked requests as triples of URL name, URL and query
+    parameters. The objects in the URLs are taken from the middle of the
+    dataset."""
+    def middle(queryset, ordering='pk'):
+        return queryset.order_by(ordering)[queryset.count() // 2]
+
+    # the primary keys of the registrations are random
+    registration = middle(UserRegistration.objects.filter(
+        candidate__bicycle__isnull=True), 'candidate_id')
+    candidate_id = registration.candidate_id
+    bicycle = middle(Bicycle.objects.all())
+    event_id = middle(HandoutEvent.objects.all()).id
+
+    candidate = {'candidate_id': candidate_id}
+    event = {'event_id': event_id}
+    user = {'user_id': registration.identifier}
+
+    requests = [
+        ('index', None, None),
+        ('legal', None, None),
+        ('login', None, None),
+        ('register:greeting', None, None),
+        ('register:registration', None, None),
+        ('register:thanks', user, None),
+        ('register:current-in-line', user, None),
+        ('staff:index', None, None),
+        ('staff:bicycle_overview', None, None),
+        ('staff:bicycle_export', None, None),
+        ('staff:event_overview', None, None),
+        ('staff:event', event, None),
+        ('staff:event_export', event, None),
+        ('staff:invite', event, None),
+        ('staff:create_event', None, None),
+        ('staff:plan_invitations', None, None),
+        ('staff:candidate_overview', None, None),
+        ('staff:candidate_overview', None, {'name': 'an'}),
+        ('staff:candidate_overview', None,
+         {'sort': 'last_name', 'page': 2, 'after': candidate_id}),
+        ('staff:candidate_export', None, None),
+        ('staff:create_candidate', None, None),
+        ('staff:import_candidates', None, None),
+        ('staff:candidate', candidate, {'event_id': event_id}),
+        ('staff:modify_candidate', candidate, None),
+        ('staff:handover_bicycle', candidate, None),
+        ('staff:refund_bicycle', {'candidate_id': bicycle.candidate_id},
+         {'bicycle_id': bicycle.id}),
+        ('staff:invite_candidate', candidate, None),
+        ('staff:delete_candidate', candidate, None),
+        ('staff:candidate_sidebar', None,
+         {'status': Candidate.WAITING}),
+        ('staff:candidate_sidebar', None,
+         {'status': Candidate.WAITING, 'after': candidate_id}),
+        ('staff:event_sidebar', None, None),
+        ('staff:bicycle_sidebar', None, None),
+        ('staff:metrics', None, None),
+        # logs the client out, so it comes last
+        ('logout', None, None)]
+
+    return [(name, reverse(name, kwargs=kwargs), data)
+            for name, kwargs, data in requests]
+
+
+def get_key(name, data):
+    if not data:
+        return name
+    return '%s?%s' % (name, '&'.join('%s=%s' % item
+                                     for item in sorted(data.items())))
+
+
+def get_exponent(small, large, scale_small, scale_large):
+    """Return the exponent k of the growth n**k between two scales."""
+    if small <= 0 or large <= 0:
+        return 0.0
+    return math.log(float(large) / small) / math.log(
+        float(scale_large) / scale_small)
+
+
+def get_complexity(exponent):
+    if exponent < 0.3:
+        return 'O(1)'
+    if exponent < 1.3:
+        return 'O(n)'
+    return 'worse than O(n)'
+
+
+def load_baselines():
+    try:
+        with open(BASELINE_FILE) as baseline_file:
+            return json.load(baseline_file)
+    except IOError:
+        return {}
+
+
+def save_baselines(baselines):
+    with open(BASELINE_FILE, 'w') as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        baseline_file.write('\n')
+
+
+class BenchmarkTestCase(TestCase):
+    # results by scale and view
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super(BenchmarkTestCase, cls).tearDownClass()
+        cls.print_report()
+        if UPDATE_BASELINES:
+            baselines = load_baselines()
+            baselines.update(
+                (str(scale), results)
+                for scale, results in cls.results.items())
+            save_baselines(baselines)
+
+    @classmethod
+    def print_report(cls):
+        scales = sorted(cls.results)
+        print()
+        for scale in scales:
+            print('%s candidates' % scale)
+            for key, result in sorted(cls.results[scale].items()):
+                print('  %-50s %8.1f ms %5d queries %9d bytes' % (
+                    key, result['time'] * 1000, result['queries'],
+                    result['bytes']))
+
+        if len(scales) < 2:
+            return
+
+        small, large = scales[0], scales[-1]
+        print('growth from %s to %s candidates' % (small, large))
+        for key in sorted(cls.results[large]):
+            before, after = cls.results[small][key], cls.results[large][key]
+            time_exponent = get_exponent(before['time'], after['time'],
+                                         small, large)
+            query_exponent = get_exponent(before['queries'],
+                                          after['queries'], small, large)
+            print('  %-50s time %-16s queries %s' % (
+                key, get_complexity(time_exponent),
+                get_complexity(query_exponent)))
+
+    def setUp(self):
+        User.objects.create_user(username='staff', password='password')
+        cache.clear()
+
+    def measure(self, url, data):
+        self.client.login(username='staff', password='password')
+        times = []
+        for _ in range(REPETITIONS):
+            with CaptureQueriesContext(connection) as context:
+                start = timeit.default_timer()
+                response = self.client.get(url, data or {})
+                if response.streaming:
+                    size = sum(len(chunk)
+                               for chunk in response.streaming_content)
+                else:
+                    size = len(response.content)
+                times.append(timeit.default_timer() - start)
+            self.assertLess(response.status_code, 400, url)
+
+        return {'time': min(times), 'queries': len(context), 'bytes': size}
+
+    def check_regressions(self, scale, results):
+        baselines = load_baselines().get(str(scale), {})
+        regressions = []
+        for key, result in sorted(results.items()):
+            baseline = baselines.get(key)
+            if baseline is None:
+                regressions.append('%s: no baseline, run the benchmarks '
+                                   'with BENCHMARK_UPDATE=1' % key)
+                continue
+            if result['queries'] > baseline['queries'] * (
+                    1 + QUERY_TOLERANCE):
+                regressions.append('%s: %s queries instead of %s' % (
+                    key, result['queries'], baseline['queries']))
+            if result['time'] > (baseline['time'] * (1 + TIME_TOLERANCE) +
+                                 TIME_SLACK):
+                regressions.append('%s: %.1f ms instead of %.1f ms' % (
+                    key, result['time'] * 1000, baseline['time'] * 1000))
+            if result['bytes'] > baseline['bytes'] * (1 + BYTES_TOLERANCE):
+                regressions.append('%s: %s bytes instead of %s' % (
+                    key, result['bytes'], baseline['bytes']))
+        return regressions
+
+    def run_benchmark(self, scale):
+        populate(candidates=scale, events=max(scale // 400, 2),
+                 invite_rate=0.4, handout_rate=0.6)
+
+        requests = get_requests()
+        self.assertEqual(set(name for name, _, _ in requests),
+                         get_url_names(),
+                         "Every URL needs to be benchmarked.")
+
+        results = dict((get_key(name, data), self.measure(url, data))
+                       for name, url, data in requests)
+        self.results[scale] = results
+
+        if not UPDATE_BASELINES:
+            regressions = self.check_regressions(scale, results)
+            self.assertFalse(regressions, '\n'.join(regressions))
+
+
+def add_benchmark(scale):
+    def test(self):
+        self.run_benchmark(scale)
+    # the name sorts the tests by scale
+    setattr(BenchmarkTestCase, 'test_%09d_candidates' % scale, test)
+
+
+for benchmark_scale in SCALES:
+    add_benchmark(benchmark_scale)
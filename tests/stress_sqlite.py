@@ -0,0 +1,121 @@
+"""Concurrent write stress test of SQLite with and without the tuning of
+bwb/database.py.
+
+Several processes write registrations into a temporary database file as
+fast as they can, each in a transaction like RegistrationView.register:
+insert the candidate, increment the line counter, read it and insert the
+registration. The script prints the committed transactions per second and
+the number of "database is locked" errors for the default configuration of
+Django and for DEFAULT_PRAGMAS:
+
+    python -m tests.stress_sqlite --processes 8 --seconds 10
+"""
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from bwb.database import apply_pragmas, DEFAULT_PRAGMAS, BUSY_TIMEOUT
+
+# the default of Python's sqlite3 module, which Django uses
+DEFAULT_TIMEOUT = 5
+
+SCHEMA = (
+    "CREATE TABLE candidate (id INTEGER PRIMARY KEY, first_name TEXT, "
+    "last_name TEXT, date_of_birth TEXT)",
+    "CREATE TABLE registration (id INTEGER PRIMARY KEY, "
+    "candidate_id INTEGER REFERENCES candidate (id), email TEXT)",
+    "CREATE TABLE line_counter (id INTEGER PRIMARY KEY, in_line INTEGER)",
+    "INSERT INTO line_counter (id, in_line) VALUES (1, 0)")
+
+CONFIGURATIONS = (
+    ('default', (), DEFAULT_TIMEOUT),
+    ('tuned', DEFAULT_PRAGMAS, BUSY_TIMEOUT))
+
+
+def connect(path, pragmas, timeout):
+    connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    apply_pragmas(connection.cursor(), pragmas)
+    return connection
+
+
+def register(cursor, number):
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(
+            "INSERT INTO candidate (first_name, last_name, date_of_birth) "
+            "VALUES (?, 'Test', '1980-01-01')", ('First %s' % number,))
+        candidate_id = cursor.lastrowid
+        cursor.execute(
+            "UPDATE line_counter SET in_line = in_line + 1 WHERE id = 1")
+        cursor.execute("SELECT in_line FROM line_counter WHERE id = 1")
+        cursor.fetchall()
+        cursor.execute(
+            "INSERT INTO registration (candidate_id, email) "
+            "VALUES (?, 'test@example.com')", (candidate_id,))
+        cursor.execute("COMMIT")
+    except sqlite3.OperationalError:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+def work(path, pragmas, timeout, seconds, results):
+    cursor = connect(path, pragmas, timeout).cursor()
+    committed, locked = 0, 0
+    end = time.time() + seconds
+    while time.time() < end:
+        try:
+            register(cursor, committed)
+            committed += 1
+        except sqlite3.OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            locked += 1
+    results.put((committed, locked))
+
+
+def run(name, pragmas, timeout, processes, seconds):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'stress.sqlite3')
+        connection = connect(path, pragmas, timeout)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        connection.close()
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(
+            target=work, args=(path, pragmas, timeout, seconds, results))
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        totals = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        shutil.rmtree(directory)
+
+    committed = sum(result[0] for result in totals)
+    locked = sum(result[1] for result in totals)
+    print('%-8s %8.0f transactions/s %6d locked' % (
+        name, committed / float(seconds), locked))
+    return committed, locked
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    arguments = parser.parse_args()
+
+    for name, pragmas, timeout in CONFIGURATIONS:
+        run(name, pragmas, timeout, arguments.processes, arguments.seconds)
+
+
+if __name__ == '__main__':
+    main()
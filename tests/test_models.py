@@ -1,16 +1,46 @@
+from datetime import datetime, timedelta
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.management import call_command, CommandError
 from django.core.validators import validate_email
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
 from hypothesis import given, settings, HealthCheck
 from hypothesis.extra.django import TestCase as HypothesisTestCase
 from hypothesis.extra.django.models import models
 from hypothesis.strategies import integers, random_module
 from hypothesis.strategies import just, text, builds, lists, sampled_from
+import codecs
+import json
+import numpy as np
+import os
 import phonenumbers
+import shutil
+import smtplib
+import socket
+import sqlite3
+import tempfile
 
 from faker import Faker
 
+from bwb.database import BUSY_TIMEOUT, copy_database
+from register.dataset import add_bicycle, populate
 from register.forms import parse_mobile_number, MOBILE_PHONE_PREFIXES
 from register.models import Candidate, UserRegistration, MAX_NAME_LENGTH
+from register.invite import invite_winners
+from register.lottery import Pool, draw, draw_winners, get_pool, get_weights
+from register.planner import Plan, commit_plan, plan_invitations
+from register.phone import validate_many, is_mobile_number, INVALID_NUMBER
+from register.phone import INVALID_MOBILE_NUMBER, BAD_FORMAT_NUMBER
+from register.models import Bicycle, QueuePosition, HandoutEvent, Invitation
+from register.models import SiteConfiguration, OutgoingMessage, LineCounter
+from register.models import LotteryDraw, MetricSample
+from register.metrics import registry, MESSAGE_LATENCY
+from register.email import send_messages
+from register.outbox import claim_due_messages, deliver_due_messages
+from register.importer import import_candidates
 
 
 # filter text that only contains of whitespace
@@ -150,3 +180,667 @@ class ModelTestCase(HypothesisTestCase):
 #             'identifier', flat=True))
 #         self.assertEqual(
 #             len(identifier_set), UserRegistration.objects.count())
+
+
+class RegistrationMixin(object):
+
+    def register(self, first_name, bicycle_kind=UserRegistration.MALE):
+        candidate = Candidate.objects.create(first_name=first_name,
+                                             last_name='Test',
+                                             date_of_birth='1980-01-01')
+        return UserRegistration.objects.create(candidate=candidate,
+                                               bicycle_kind=bicycle_kind,
+                                               email='test@example.com')
+
+    def hand_over(self, registration):
+        return Bicycle.objects.create(candidate=registration.candidate,
+                                      bicycle_number=1,
+                                      lock_combination=1234,
+                                      color='red',
+                                      brand='test')
+
+
+class QueuePositionTestCase(RegistrationMixin, TestCase):
+
+    def assert_positions(self, *registrations):
+        self.assertEqual(
+            [registration.number_in_line() for registration in registrations],
+            list(range(1, len(registrations) + 1)))
+
+    def test_registration(self):
+        first, second, third = [self.register(name) for name in 'abc']
+        child = self.register('d', bicycle_kind=UserRegistration.CHILD_BIG)
+
+        self.assert_positions(first, second, third)
+        self.assert_positions(child)
+
+    def test_handover_and_refund(self):
+        first, second, third = [self.register(name) for name in 'abc']
+
+        bicycle = self.hand_over(second)
+        self.assertIsNone(second.number_in_line())
+        self.assert_positions(first, third)
+
+        bicycle.delete()
+        self.assert_positions(first, second, third)
+
+    def test_candidate_deletion(self):
+        first, second, third = [self.register(name) for name in 'abc']
+        self.hand_over(first)
+
+        second.candidate.delete()
+        first.candidate.delete()
+        self.assert_positions(third)
+        self.assertEqual(QueuePosition.objects.count(), 1)
+
+    def test_rebuild(self):
+        registrations = [self.register(name) for name in 'abcd']
+        self.hand_over(registrations[1])
+        QueuePosition.objects.all().delete()
+
+        QueuePosition.rebuild()
+        self.assert_positions(registrations[0], *registrations[2:])
+
+
+class InviteWinnersTestCase(TestCase):
+
+    def setUp(self):
+        for i in range(10):
+            candidate = Candidate.objects.create(first_name=str(i),
+                                                 last_name='Test',
+                                                 date_of_birth='1980-01-01')
+            UserRegistration.objects.create(
+                candidate=candidate,
+                bicycle_kind=UserRegistration.MALE if i % 2 else
+                UserRegistration.FEMALE,
+                email='test@example.com')
+
+    def tearDown(self):
+        # the cached configuration survives the rollback of the test
+        SiteConfiguration.clear_cache()
+
+    def create_event(self, day):
+        return HandoutEvent.objects.create(
+            due_date=datetime(2016, 5, day, 10, tzinfo=timezone.utc))
+
+    def test_number_of_winners(self):
+        event = self.create_event(1)
+        winners = invite_winners(event, {UserRegistration.MALE: 2,
+                                         UserRegistration.FEMALE: 10})
+
+        self.assertEqual(len(winners), 7)
+        self.assertEqual(event.invitations.count(), 7)
+        self.assertEqual(
+            Candidate.objects.filter(status=Candidate.INVITED).count(), 7)
+
+    def test_max_number_of_autoinvites(self):
+        config = SiteConfiguration.get_solo()
+        config.max_number_of_autoinvites = 1
+        config.save()
+
+        invite_winners(self.create_event(1), {UserRegistration.MALE: 3})
+        winners = invite_winners(self.create_event(2),
+                                 {UserRegistration.MALE: 5})
+        self.assertEqual(len(winners), 2)
+
+    def test_recorded_seed(self):
+        event = self.create_event(1)
+        invite_winners(event, {UserRegistration.MALE: 2}, seed=42)
+
+        lottery_draw = LotteryDraw.objects.get(handout_event=event)
+        self.assertEqual(lottery_draw.seed, 42)
+        self.assertEqual(lottery_draw.pool_size, 10)
+        self.assertEqual(lottery_draw.number_of_winners, 2)
+
+    def test_pool(self):
+        event = self.create_event(1)
+        invited = Candidate.objects.first()
+        Invitation.objects.create(handout_event=event, candidate=invited)
+        now = timezone.now() + timedelta(days=2)
+
+        pool = get_pool([event], now)
+        self.assertEqual(pool.candidate_ids.tolist(), list(
+            Candidate.objects.exclude(id=invited.id).order_by(
+                'id').values_list('id', flat=True)))
+        self.assertEqual(sorted(set(pool.bicycle_kinds.tolist())),
+                         sorted([UserRegistration.FEMALE,
+                                 UserRegistration.MALE]))
+        self.assertTrue(np.all(np.abs(pool.waiting_days - 2) < 0.001))
+        self.assertTrue(np.all(pool.invitation_counts == 0))
+
+    def test_reproducible(self):
+        pool = get_pool([self.create_event(1)], timezone.now())
+        number_of_winners = {UserRegistration.MALE: 3,
+                             UserRegistration.FEMALE: 2}
+        winners = draw_winners(pool, number_of_winners, 7, 2)
+
+        self.assertEqual(len(set(winners)), 5)
+        self.assertEqual(draw_winners(pool, number_of_winners, 7, 2),
+                         winners)
+
+
+class PlannerTestCase(TestCase):
+
+    def setUp(self):
+        self.candidates = []
+        for i in range(10):
+            candidate = Candidate.objects.create(first_name=str(i),
+                                                 last_name='Test',
+                                                 date_of_birth='1980-01-01')
+            UserRegistration.objects.create(
+                candidate=candidate,
+                bicycle_kind=UserRegistration.MALE if i % 2 else
+                UserRegistration.FEMALE,
+                email='test@example.com')
+            self.candidates.append(candidate)
+        self.first_event = HandoutEvent.objects.create(
+            due_date='2016-05-01 10:00Z')
+        self.second_event = HandoutEvent.objects.create(
+            due_date='2016-05-08 10:00Z')
+
+    def tearDown(self):
+        SiteConfiguration.clear_cache()
+
+    def test_allocation(self):
+        plan = plan_invitations({
+            self.second_event: {UserRegistration.MALE: 3},
+            self.first_event: {UserRegistration.MALE: 3,
+                               UserRegistration.FEMALE: 1}})
+
+        self.assertEqual(
+            [(event_id, kind, len(candidate_ids))
+             for event_id, kind, candidate_ids in plan.allocation],
+            [(self.first_event.id, UserRegistration.MALE, 3),
+             (self.first_event.id, UserRegistration.FEMALE, 1),
+             (self.second_event.id, UserRegistration.MALE, 2)])
+        candidate_ids = sum((candidate_ids for _, _, candidate_ids
+                             in plan.allocation), [])
+        self.assertEqual(len(set(candidate_ids)), 6)
+        self.assertEqual(plan.pool_size, 10)
+        self.assertEqual(
+            plan.capacities,
+            sorted([(self.first_event.id, UserRegistration.MALE, 3),
+                    (self.first_event.id, UserRegistration.FEMALE, 1),
+                    (self.second_event.id, UserRegistration.MALE, 3)]))
+
+    def test_existing_invitations(self):
+        invited = self.candidates[1]
+        Invitation.objects.create(candidate=invited,
+                                  handout_event=self.second_event)
+
+        male = UserRegistration.MALE
+        plan = plan_invitations({self.first_event: {male: 5},
+                                 self.second_event: {male: 2}})
+
+        self.assertEqual(plan.pool_size, 9)
+        planned = sum((candidate_ids
+                       for _, _, candidate_ids in plan.allocation), [])
+        self.assertNotIn(invited.id, planned)
+        self.assertEqual(
+            [(event_id, len(candidate_ids))
+             for event_id, _, candidate_ids in plan.allocation],
+            [(self.first_event.id, 4)])
+
+    def test_commit(self):
+        male = UserRegistration.MALE
+        plan = plan_invitations({self.first_event: {male: 2},
+                                 self.second_event: {male: 2}}, seed=3)
+        capacities = plan.capacities
+        plan = Plan.from_dict(json.loads(json.dumps(plan.to_dict())))
+        self.assertEqual(plan.capacities, capacities)
+        with_bicycle = plan.allocation[0][2][0]
+        add_bicycle(with_bicycle, 1)
+
+        invited = commit_plan(plan, notify=False)
+
+        self.assertEqual([len(candidate_ids)
+                          for candidate_ids in invited.values()], [1, 2])
+        self.assertEqual(Invitation.objects.count(), 3)
+        self.assertEqual(
+            Candidate.objects.filter(status=Candidate.INVITED).count(), 3)
+        self.assertEqual(
+            list(LotteryDraw.objects.order_by('handout_event').values_list(
+                'seed', 'number_of_winners')), [(3, 1), (3, 2)])
+
+
+class LotteryTestCase(TestCase):
+
+    def test_weights(self):
+        pool = Pool(candidate_ids=np.arange(4),
+                    bicycle_kinds=np.ones(4, dtype=np.int64),
+                    waiting_days=np.array([0.0, 9.0, 9.0, 9.0]),
+                    invitation_counts=np.array([0, 0, 1, 2]))
+        self.assertEqual(get_weights(pool, 2).tolist(),
+                         [1.0, 10.0, 5.0, 0.0])
+
+    def test_without_replacement(self):
+        winners = draw(np.arange(1, 6), np.array([0.0, 1.0, 0.0, 2.0, 3.0]),
+                       5, np.random.RandomState(0))
+        self.assertEqual(sorted(winners.tolist()), [2, 4, 5])
+
+    def test_chances(self):
+        candidate_ids = np.array([1, 2])
+        weights = np.array([1.0, 99.0])
+        wins = sum(draw(candidate_ids, weights, 1,
+                        np.random.RandomState(seed))[0] == 2
+                   for seed in range(200))
+        self.assertGreater(wins, 190)
+
+    def test_large_pool(self):
+        size = 10 ** 6
+        random_state = np.random.RandomState(0)
+        pool = Pool(candidate_ids=np.arange(size),
+                    bicycle_kinds=random_state.randint(1, 5, size),
+                    waiting_days=random_state.uniform(0, 700, size),
+                    invitation_counts=random_state.randint(0, 3, size))
+
+        winners = draw_winners(pool, {UserRegistration.MALE: 100}, 1, 2)
+        self.assertEqual(len(set(winners)), 100)
+        self.assertTrue(np.all(pool.bicycle_kinds[winners] ==
+                               UserRegistration.MALE))
+        self.assertTrue(np.all(pool.invitation_counts[winners] < 2))
+
+
+class OutboxTestCase(TestCase):
+
+    def queue_message(self, email):
+        candidate = Candidate.objects.create(first_name='Test',
+                                             last_name='Test',
+                                             date_of_birth='1980-01-01')
+        registration = UserRegistration.objects.create(
+            candidate=candidate, bicycle_kind=UserRegistration.MALE,
+            email=email)
+        return OutgoingMessage.objects.create(registration=registration,
+                                              subject='subject',
+                                              message='message')
+
+    def test_delivery(self):
+        outgoing_message = self.queue_message('test@example.com')
+
+        self.assertEqual(deliver_due_messages(), (1, 0))
+        self.assertEqual(deliver_due_messages(), (0, 0))
+
+        outgoing_message.refresh_from_db()
+        self.assertEqual(outgoing_message.status, OutgoingMessage.SENT)
+
+    def test_retry(self):
+        # messages without any contact information can not be sent
+        outgoing_message = self.queue_message('')
+
+        self.assertEqual(deliver_due_messages(), (0, 1))
+        # the next attempt is delayed
+        self.assertEqual(deliver_due_messages(), (0, 0))
+
+        outgoing_message.refresh_from_db()
+        self.assertEqual(outgoing_message.status, OutgoingMessage.PENDING)
+        self.assertEqual(outgoing_message.attempts, 1)
+
+        OutgoingMessage.objects.update(
+            next_attempt=outgoing_message.date_of_creation)
+        self.assertEqual(deliver_due_messages(max_attempts=2), (0, 1))
+
+        outgoing_message.refresh_from_db()
+        self.assertEqual(outgoing_message.status, OutgoingMessage.FAILED)
+
+    def test_claim(self):
+        self.queue_message('test@example.com')
+
+        self.assertEqual(len(claim_due_messages(10)), 1)
+        # another process does not get the claimed message
+        self.assertEqual(claim_due_messages(10), [])
+        self.assertEqual(deliver_due_messages(), (0, 0))
+
+    def test_expired_claim(self):
+        outgoing_message = self.queue_message('test@example.com')
+        claim_due_messages(10)
+
+        # the process that claimed the message died before sending it
+        OutgoingMessage.objects.update(
+            next_attempt=outgoing_message.date_of_creation)
+        self.assertEqual(deliver_due_messages(), (1, 0))
+
+    def test_command_flushes_metrics(self):
+        registry.flush()
+        self.queue_message('test@example.com')
+
+        call_command('deliver_messages', stdout=StringIO())
+        self.assertFalse(registry.pending)
+        self.assertEqual(MetricSample.objects.get(
+            name=MESSAGE_LATENCY + '_count',
+            labels='channel="email"').value, 1)
+
+
+class FakeConnection(object):
+    """Connection to a mail server that raises the given exceptions, one per
+    call of send_messages(), and sends the messages otherwise."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.is_open = False
+        self.number_of_connections = 0
+        self.sent = []
+
+    def open(self):
+        if not self.is_open:
+            self.is_open = True
+            self.number_of_connections += 1
+
+    def close(self):
+        self.is_open = False
+
+    def send_messages(self, emails):
+        failure = self.failures.pop(0) if self.failures else None
+        if isinstance(failure, smtplib.SMTPServerDisconnected):
+            self.is_open = False
+        if failure is not None:
+            raise failure
+        self.sent.extend(emails)
+        return len(emails)
+
+
+class SendMessagesTestCase(RegistrationMixin, TestCase):
+
+    def tearDown(self):
+        # the latencies are written in the transaction of the test
+        registry.flush()
+
+    def send(self, connection):
+        return send_messages([(self.register(name), 'subject', 'message')
+                              for name in 'abc'], connection=connection)
+
+    def test_one_connection(self):
+        connection = FakeConnection()
+        self.assertEqual(self.send(connection), [None, None, None])
+        self.assertEqual(connection.number_of_connections, 1)
+        self.assertEqual(len(connection.sent), 3)
+
+    def test_reconnect(self):
+        connection = FakeConnection(
+            [smtplib.SMTPServerDisconnected('Connection lost')])
+        self.assertEqual(self.send(connection), [None, None, None])
+        self.assertEqual(connection.number_of_connections, 2)
+        self.assertEqual(len(connection.sent), 3)
+
+    def test_refused_recipient(self):
+        refused = smtplib.SMTPRecipientsRefused(
+            {'b@example.com': (550, b'User unknown')})
+        connection = FakeConnection([None, refused])
+        self.assertEqual(self.send(connection), [None, refused, None])
+        self.assertEqual(connection.number_of_connections, 1)
+        self.assertEqual(len(connection.sent), 2)
+
+    def test_unreachable(self):
+        error = socket.error('Connection refused')
+        connection = FakeConnection([error, error])
+        self.assertEqual(self.send(connection), [error, error, error])
+        self.assertEqual(connection.sent, [])
+
+
+class CandidateStatusTestCase(RegistrationMixin, TestCase):
+
+    def get_status(self, registration):
+        return Candidate.objects.get(id=registration.candidate_id).status
+
+    def test_single_writes(self):
+        registration = self.register('a')
+        self.assertEqual(self.get_status(registration), Candidate.WAITING)
+
+        event = HandoutEvent.objects.create(due_date='2016-05-01 10:00Z')
+        invitation = Invitation.objects.create(
+            candidate=registration.candidate, handout_event=event)
+        self.assertEqual(self.get_status(registration), Candidate.INVITED)
+
+        bicycle = self.hand_over(registration)
+        self.assertEqual(self.get_status(registration), Candidate.WITH_BICYCLE)
+
+        bicycle.delete()
+        self.assertEqual(self.get_status(registration), Candidate.INVITED)
+
+        invitation.delete()
+        self.assertEqual(self.get_status(registration), Candidate.WAITING)
+
+    def test_update_all_statuses(self):
+        registrations = [self.register(name) for name in 'abcde']
+        self.hand_over(registrations[1])
+        Candidate.objects.update(status=Candidate.INVITED)
+
+        Candidate.update_all_statuses(chunk_size=2)
+        self.assertEqual(
+            [self.get_status(registration) for registration in registrations],
+            [Candidate.WAITING, Candidate.WITH_BICYCLE] +
+            [Candidate.WAITING] * 3)
+
+
+class GetMatchingTestCase(TestCase):
+
+    def test_case_insensitive(self):
+        Candidate.objects.create(first_name=u'J\xf6rg', last_name='Meyer',
+                                 date_of_birth='1980-01-01')
+
+        self.assertTrue(Candidate.get_matching(first_name=u'J\xd6RG',
+                                               last_name='meyer',
+                                               date_of_birth='1980-01-01'))
+        self.assertFalse(Candidate.get_matching(first_name=u'J\xf6rg',
+                                                last_name='Meyer',
+                                                date_of_birth='1980-01-02'))
+
+
+class LineCounterTestCase(RegistrationMixin, TestCase):
+
+    def assert_counter(self):
+        self.assertEqual(LineCounter.get_value(), Candidate.total_in_line())
+
+    def test_counter(self):
+        registrations = [self.register(name) for name in 'abcd']
+        self.assert_counter()
+
+        bicycle = self.hand_over(registrations[0])
+        self.hand_over(registrations[1])
+        self.assert_counter()
+
+        bicycle.delete()
+        self.assert_counter()
+
+        registrations[1].candidate.delete()
+        registrations[2].candidate.delete()
+        self.assert_counter()
+        self.assertEqual(LineCounter.get_value(), 2)
+
+
+class SiteConfigurationTestCase(TestCase):
+
+    def tearDown(self):
+        SiteConfiguration.clear_cache()
+
+    def test_cached(self):
+        SiteConfiguration.get_solo()
+        with self.assertNumQueries(0):
+            SiteConfiguration.get_solo()
+
+    def test_invalidation(self):
+        SiteConfiguration.get_solo()
+
+        # another process saves the configuration
+        SiteConfiguration.objects.update(max_number_of_registrations=5)
+        cache.set(SiteConfiguration.VERSION_KEY, 'changed', None)
+        self.assertEqual(
+            SiteConfiguration.get_solo().max_number_of_registrations, 200)
+
+        # the check interval has passed
+        version, _, instance = SiteConfiguration._local_copy
+        SiteConfiguration._local_copy = (version, 0, instance)
+
+        self.assertEqual(
+            SiteConfiguration.get_solo().max_number_of_registrations, 5)
+
+
+class SiteConfigurationCommitTestCase(TransactionTestCase):
+
+    def tearDown(self):
+        SiteConfiguration.clear_cache()
+
+    def test_save_in_transaction(self):
+        version = SiteConfiguration.get_version()
+        with transaction.atomic():
+            config = SiteConfiguration.get_solo()
+            config.max_number_of_registrations = 5
+            config.save()
+            self.assertEqual(SiteConfiguration.get_version(), version)
+        self.assertNotEqual(SiteConfiguration.get_version(), version)
+
+    def test_rollback(self):
+        version = SiteConfiguration.get_version()
+        try:
+            with transaction.atomic():
+                SiteConfiguration.get_solo().save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(SiteConfiguration.get_version(), version)
+
+
+class PhoneNumberTestCase(TestCase):
+
+    def test_prefixes(self):
+        for prefix in MOBILE_PHONE_PREFIXES:
+            self.assertTrue(is_mobile_number(prefix[1:] + '1234567'))
+        self.assertFalse(is_mobile_number('3402162248'))
+        self.assertFalse(is_mobile_number('151'))
+
+    def test_validate_many(self):
+        self.assertEqual(
+            validate_many(['01631703322', '01631', '034021622483', 'abc']),
+            [('+49 163 1703322', None),
+             (None, INVALID_NUMBER),
+             (None, INVALID_MOBILE_NUMBER),
+             (None, BAD_FORMAT_NUMBER)])
+
+
+class ImportCandidatesTestCase(RegistrationMixin, TestCase):
+
+    def test_import(self):
+        self.register('Existing')
+        lines = [
+            'first_name,last_name,date_of_birth,bicycle_kind,email,'
+            'mobile_number',
+            'Anna,Test,1990-02-03,2,anna@example.com,',
+            'Ben,Test,1990-02-03,1,,01631703322',
+            'ben,TEST,1990-02-03,1,ben@example.com,',
+            'existing,test,1980-01-01,1,test@example.com,',
+            'Carl,Test,1990-13-03,1,carl@example.com,',
+            'Dora,Test,1990-02-03,5,dora@example.com,',
+            'Emil,Test,1990-02-03,1,,01631',
+            'Frida,Test,1990-02-03,1,,']
+
+        result = import_candidates(lines, chunk_size=3)
+
+        self.assertEqual(result.imported, 2)
+        self.assertEqual([line for line, _ in result.rejected],
+                         [4, 5, 6, 7, 8, 9])
+        self.assertEqual(
+            UserRegistration.objects.get(
+                candidate__first_name='Ben').mobile_number.as_e164,
+            '+491631703322')
+        self.assertEqual(LineCounter.get_value(), 3)
+        self.assertEqual(QueuePosition.objects.filter(
+            bicycle_kind=UserRegistration.MALE).count(), 2)
+        self.assertEqual(Candidate.objects.filter(
+            status=Candidate.WAITING).count(), 3)
+
+    def test_undecodable_line(self):
+        lines = codecs.iterdecode([
+            b'first_name,last_name,date_of_birth,bicycle_kind,email\n',
+            b'Anna,Test,1990-02-03,2,anna@example.com\n',
+            b'Ben,Test,1990-02-03,1,ben@example.com\n',
+            b'C\xe4rl,Test,1990-02-03,1,carl@example.com\n'], 'utf-8')
+
+        result = import_candidates(lines, chunk_size=1)
+
+        self.assertEqual(result.imported, 2)
+        self.assertIn('decode', result.error)
+        self.assertEqual(Candidate.objects.filter(
+            status=Candidate.WAITING).count(), 2)
+        self.assertEqual(QueuePosition.objects.count(), 2)
+
+
+class DatasetTestCase(TestCase):
+
+    def get_names(self):
+        return list(Candidate.objects.order_by('id').values_list(
+            'first_name', 'last_name', 'date_of_birth'))
+
+    def test_populate(self):
+        populate(candidates=30, events=3, invite_rate=0.5, handout_rate=0.5,
+                 batch_size=7)
+        self.assertEqual(Candidate.objects.count(), 30)
+        self.assertEqual(UserRegistration.objects.count(), 30)
+        self.assertEqual(HandoutEvent.objects.count(), 3)
+        self.assertEqual(LineCounter.get_value(), Candidate.objects.filter(
+            bicycle__isnull=True).count())
+
+    def test_reproducible(self):
+        populate(candidates=20)
+        names = self.get_names()
+        Candidate.objects.all().delete()
+
+        populate(candidates=20)
+        self.assertEqual(self.get_names(), names)
+
+
+class DatabaseTuningTestCase(TestCase):
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], BUSY_TIMEOUT * 1000)
+
+
+class ReplicaTestCase(TransactionTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'replica.sqlite3')
+        for name in ('Ben', 'Lea'):
+            Candidate.objects.create(first_name=name, last_name='Test',
+                                     date_of_birth='1980-01-01')
+        connection.ensure_connection()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def count_candidates(self):
+        replica = sqlite3.connect(self.path)
+        try:
+            return replica.execute(
+                'SELECT COUNT(*) FROM register_candidate').fetchone()[0]
+        finally:
+            replica.close()
+
+    def test_copy(self):
+        copy_database(connection.connection, self.path)
+        self.assertEqual(self.count_candidates(), 2)
+
+        # the copy replaces the old file
+        Candidate.objects.filter(first_name='Ben').delete()
+        copy_database(connection.connection, self.path)
+        self.assertEqual(self.count_candidates(), 1)
+        self.assertFalse(os.path.exists(self.path + '.new'))
+
+    def test_refresh_replica(self):
+        connections.databases['replica'] = dict(
+            connections.databases['default'], NAME=self.path)
+        try:
+            with override_settings(DATABASE_REPLICA='replica'):
+                call_command('refresh_replica', stdout=StringIO())
+                self.assertEqual(
+                    Candidate.objects.using('replica').count(), 2)
+        finally:
+            connections['replica'].close()
+            del connections['replica']
+            del connections.databases['replica']
+
+    def test_refresh_without_replica(self):
+        with self.assertRaises(CommandError):
+            call_command('refresh_replica', stdout=StringIO())
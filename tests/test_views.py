@@ -1,17 +1,50 @@
+from django.conf import settings as django_settings
+from django.contrib.auth.models import AnonymousUser, User
 from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.core.validators import EmailValidator
+from django.db import connection, transaction
 from django.forms.fields import Field
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.utils.html import escape
+from django.utils.six import StringIO
 from hypothesis import given, settings, HealthCheck, example
 from hypothesis.extra.django import TestCase as HypothesisTestCase
 from hypothesis.strategies import random_module
+from datetime import timedelta
+from logging.handlers import BufferingHandler
+import gzip
+import io
+import logging
+import tempfile
+import time
 
+from bwb.profiling import get_repeated_queries
+from bwb.routers import PrimaryReplicaRouter, PIN_SESSION_KEY
+from bwb.routers import use_replica, use_primary
 from bwb.sms_settings import SMS_GATEWAY_ADDRESS
+from register.dataset import add_candidate
 from register.forms import INVALID_NUMBER, MULTIPLE_REGISTRATION_ERROR,\
     INVALID_MOBILE_NUMBER, BAD_FORMAT_NUMBER, TERMS_AND_CONDITIONS_ERROR,\
     EMAIL_OR_PHONE_ERROR, TOO_MANY_REGISTRATIONS_ERROR
-from register.models import Candidate, SiteConfiguration
+from register.forms import RegistrationForm
+from register.metrics import registry, count_invitations, MESSAGE_LATENCY
+from register.models import Candidate, SiteConfiguration, UserRegistration
+from register.models import Bicycle, HandoutEvent, Invitation
+from register.models import LineCounter, OutgoingMessage
+from register.outbox import deliver_due_messages
+from register.views import RegistrationView
+from staff.sidebar import bump_version, get_version, render_sidebar
+from staff.sidebar import WINDOW_SIZE
+from staff.sidebar import BICYCLES, CANDIDATES, EVENTS
+from staff.forms import PLAN_CHANGED_ERROR
+from staff.views import PLAN_SESSION_KEY
 from tests.test_models import name_strategy, email_strategy, date_strategy,\
     bicycle_kind_strategy, phone_strategy_clean
 
@@ -40,6 +73,11 @@ class ContactViewTestCase(HypothesisTestCase):
         self.assertRedirects(response, reverse('register:thanks',
                                                kwargs={'user_id': identifier}))
 
+        # the message is only queued by the request
+        self.assertEqual(len(mail.outbox),  # @UndefinedVariable
+                         number_of_emails - 1)
+        deliver_due_messages()
+
         if 'email' in post_dict:
             email_address = post_dict['email']
         elif 'mobile_number' in post_dict:
@@ -146,6 +184,36 @@ class ContactViewTestCase(HypothesisTestCase):
                                post_dict=post_dict,
                                empty_outbox=False)
 
+    def test_line_full_after_validation(self):
+        self.addCleanup(SiteConfiguration.clear_cache)
+        config = SiteConfiguration.get_solo()
+        config.max_number_of_registrations = 2
+        config.save()
+        add_candidate('First', 'In line', '1980-01-01')
+
+        post_dict = {'first_name': 'Late',
+                     'last_name': 'Holger',
+                     'date_of_birth': '1982-05-12',
+                     'bicycle_kind': 2,
+                     'email': 'asdf@gmx.de',
+                     'agree': 'True'}
+        form = RegistrationForm(post_dict)
+        self.assertTrue(form.is_valid())
+
+        # somebody else takes the last place in the meantime
+        add_candidate('Second', 'In line', '1980-01-01')
+        self.assertEqual(LineCounter.get_value(), 2)
+
+        request = RequestFactory().post(self.url, post_dict)
+        request.user = AnonymousUser()
+        response = RegistrationView(request=request).form_valid(form)
+
+        self.assertIn(TOO_MANY_REGISTRATIONS_ERROR, form.non_field_errors())
+        self.assertContains(response, TOO_MANY_REGISTRATIONS_ERROR)
+        self.assertEqual(Candidate.objects.count(), 2)
+        self.assertEqual(LineCounter.get_value(), 2)
+        self.assertEqual(OutgoingMessage.objects.count(), 0)
+
     @settings(suppress_health_check=[HealthCheck.too_slow])
     @given(first_name=name_strategy,
            last_name=name_strategy,
@@ -386,6 +454,355 @@ class ThanksViewTestCase(HypothesisTestCase):
                             status_code=200)
 
 
+class CurrentInLineViewTestCase(TestCase):
+
+    def setUp(self):
+        candidate = Candidate.objects.create(first_name='Test',
+                                             last_name='Test',
+                                             date_of_birth='1980-01-01')
+        self.registration = UserRegistration.objects.create(
+            candidate=candidate, bicycle_kind=UserRegistration.MALE,
+            email='test@example.com')
+        self.url = reverse('register:current-in-line',
+                           kwargs={'user_id': self.registration.identifier})
+
+    def test_in_line(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Currently you are number 1')
+
+    def test_not_in_line(self):
+        Bicycle.objects.create(candidate=self.registration.candidate,
+                               bicycle_number=1, lock_combination=1234,
+                               color='red', brand='test')
+
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Currently you are number')
+        self.assertContains(response, 'bicycle received')
+
+
+class StaffTestCase(TestCase):
+
+    def setUp(self):
+        # the versions of the sidebars are only replaced on commit, which
+        # never happens in a TestCase, so nothing may survive from the last
+        cache.clear()
+        User.objects.create_user(username='staff', password='password')
+        self.client.login(username='staff', password='password')
+        self.event = HandoutEvent.objects.create(due_date=timezone.now())
+
+    def add_candidates(self, number):
+        """Add registered candidates that are invited to the event, every
+        second of them with a bicycle."""
+        for i in range(number):
+            candidate = Candidate.objects.create(first_name='First %s' % i,
+                                                 last_name='Last',
+                                                 date_of_birth='1980-01-01')
+            UserRegistration.objects.create(
+                candidate=candidate, bicycle_kind=UserRegistration.MALE,
+                email='test@example.com')
+            Invitation.objects.create(candidate=candidate,
+                                      handout_event=self.event)
+            if i % 2:
+                Bicycle.objects.create(candidate=candidate,
+                                       bicycle_number=i,
+                                       lock_combination=1234,
+                                       color='red',
+                                       brand='test')
+        # as if the candidates had been committed
+        for name in (BICYCLES, CANDIDATES, EVENTS):
+            bump_version(name)
+
+    def count_queries(self, url):
+        # the first request fills the caches
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+
+class TableQueryCountTestCase(StaffTestCase):
+
+    def check_constant_number_of_queries(self, url):
+        self.add_candidates(3)
+        number_of_queries = self.count_queries(url)
+
+        self.add_candidates(30)
+        self.assertEqual(self.count_queries(url), number_of_queries)
+
+    def test_candidate_overview(self):
+        self.check_constant_number_of_queries(
+            reverse('staff:candidate_overview'))
+
+    def test_event(self):
+        self.check_constant_number_of_queries(
+            reverse('staff:event', kwargs={'event_id': self.event.id}))
+
+    def test_bicycle_overview(self):
+        self.check_constant_number_of_queries(
+            reverse('staff:bicycle_overview'))
+
+    def test_event_overview(self):
+        for day in range(1, 10):
+            HandoutEvent.objects.create(
+                due_date='2016-05-%02d 10:00Z' % day)
+        self.check_constant_number_of_queries(
+            reverse('staff:event_overview'))
+
+    def test_no_normalized_names(self):
+        self.add_candidates(1)
+        for url in (reverse('staff:candidate_overview'),
+                    reverse('staff:event',
+                            kwargs={'event_id': self.event.id})):
+            table = self.client.get(url).context['candidates']
+            names = [column.name for column in table.columns]
+            self.assertIn('first_name', names)
+            self.assertNotIn('first_name_norm', names)
+            self.assertNotIn('last_name_norm', names)
+
+    def test_event_overview_counts(self):
+        self.add_candidates(5)
+        table = self.client.get(
+            reverse('staff:event_overview')).context['handoutevents']
+        row = table.rows[0]
+        self.assertEqual(row.get_cell('invitations'), 5)
+        self.assertEqual(row.get_cell('handed_out'), 2)
+
+
+class SidebarTestCase(StaffTestCase):
+
+    def test_selection_not_cached(self):
+        other_event = HandoutEvent.objects.create(due_date=timezone.now())
+        contexts = []
+
+        def get_context():
+            contexts.append(None)
+            return {'events': [self.event, other_event], 'next_id': None}
+
+        def render(selected_id):
+            return render_sidebar(EVENTS, 'staff/event_sidebar.html',
+                                  get_context, selected_id)
+
+        html = render(self.event.id)
+        self.assertIn('data-selected="%s"' % self.event.id, html)
+        self.assertIn('<li class="active" data-id="%s">' % self.event.id,
+                      html)
+        self.assertIn('<li data-id="%s">' % other_event.id, html)
+
+        html = render(other_event.id)
+        self.assertIn('<li data-id="%s">' % self.event.id, html)
+        self.assertIn('<li class="active" data-id="%s">' % other_event.id,
+                      html)
+
+        self.assertNotIn('class="active"', render(None))
+        self.assertEqual(len(contexts), 1)
+
+    def get_window(self, name, **data):
+        response = self.client.get(reverse(name), data)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def add_candidate(self, first_name, last_name):
+        return Candidate.objects.create(first_name=first_name,
+                                        last_name=last_name,
+                                        date_of_birth='1980-01-01')
+
+    def test_windows(self):
+        for day in range(1, WINDOW_SIZE + 5):
+            HandoutEvent.objects.create(
+                due_date=timezone.now() - timedelta(days=day))
+
+        window = self.get_window('staff:event_sidebar')
+        self.assertEqual(len(window['entries']), WINDOW_SIZE)
+        self.assertEqual(window['next'], window['entries'][-1]['id'])
+
+        rest = self.get_window('staff:event_sidebar', after=window['next'])
+        self.assertEqual(len(rest['entries']), 5)
+        self.assertIsNone(rest['next'])
+        self.assertEqual(
+            [entry['id'] for entry in window['entries'] + rest['entries']],
+            list(HandoutEvent.objects.order_by('due_date', 'id').values_list(
+                'id', flat=True)))
+
+    def test_full_window(self):
+        for day in range(1, WINDOW_SIZE):
+            HandoutEvent.objects.create(
+                due_date=timezone.now() - timedelta(days=day))
+
+        window = self.get_window('staff:event_sidebar')
+        self.assertEqual(len(window['entries']), WINDOW_SIZE)
+        self.assertIsNone(window['next'])
+
+    def test_after_deleted_candidate(self):
+        candidates = [self.add_candidate('First %s' % i, 'Last')
+                      for i in range(3)]
+        deleted_id = candidates[1].id
+        candidates[1].delete()
+
+        window = self.get_window(
+            'staff:candidate_sidebar', after=deleted_id,
+            status=Candidate.objects.get(id=candidates[0].id).status)
+        self.assertEqual([entry['id'] for entry in window['entries']],
+                         [candidates[2].id])
+
+    def test_after_deleted_event(self):
+        event_id = self.event.id
+        self.event.delete()
+        window = self.get_window('staff:event_sidebar', after=event_id)
+        self.assertEqual(window, {'entries': [], 'next': None})
+
+    def test_search(self):
+        anna = self.add_candidate('Anna', 'Schmidt')
+        bernd = self.add_candidate('Bernd', 'Anders')
+        self.add_candidate('Carla', 'Meier')
+        status = Candidate.objects.get(id=anna.id).status
+
+        def search(query):
+            window = self.get_window('staff:candidate_sidebar',
+                                     status=status, q=query)
+            return [entry['id'] for entry in window['entries']]
+
+        self.assertEqual(search('an'), [anna.id, bernd.id])
+        self.assertEqual(search('an sch'), [anna.id])
+        self.assertEqual(search('x'), [])
+
+    def test_invalid_parameters(self):
+        url = reverse('staff:candidate_sidebar')
+        self.assertEqual(self.client.get(url, {'status': 'x'}).status_code,
+                         404)
+        self.assertEqual(self.client.get(url, {'status': Candidate.WAITING,
+                                               'after': 'x'}).status_code,
+                         404)
+
+
+class SidebarVersionTestCase(TransactionTestCase):
+
+    def test_bumped_on_commit(self):
+        version = get_version(EVENTS)
+        with transaction.atomic():
+            HandoutEvent.objects.create(due_date=timezone.now())
+            # other processes must not cache the old rows under a new version
+            self.assertEqual(get_version(EVENTS), version)
+        self.assertNotEqual(get_version(EVENTS), version)
+
+    def test_not_bumped_on_rollback(self):
+        version = get_version(EVENTS)
+        try:
+            with transaction.atomic():
+                HandoutEvent.objects.create(due_date=timezone.now())
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(get_version(EVENTS), version)
+
+
+class KeysetPaginationTestCase(StaffTestCase):
+    url = reverse('staff:candidate_overview')
+
+    def get_page(self, data):
+        response = self.client.get(self.url, data)
+        self.assertEqual(response.status_code, 200)
+        return response.context['candidates'].page
+
+    def get_ids(self, page):
+        return [row.record.id for row in page.object_list]
+
+    def walk(self, sort):
+        """Return the ids of the pages following the next links and of the
+        pages following the previous links back from the last page."""
+        forward = []
+        page = self.get_page({'sort': sort})
+        forward.append(self.get_ids(page))
+        while page.has_next():
+            page = self.get_page({'sort': sort,
+                                  'page': page.next_page_number(),
+                                  'after': page.next_cursor})
+            forward.append(self.get_ids(page))
+
+        backward = [self.get_ids(page)]
+        while page.has_previous():
+            page = self.get_page({'sort': sort,
+                                  'page': page.previous_page_number(),
+                                  'before': page.previous_cursor})
+            backward.insert(0, self.get_ids(page))
+        self.assertEqual(page.number, 1)
+        return forward, backward
+
+    def test_sort_orders(self):
+        self.add_candidates(90)
+        for sort, order_by in (('id', ['id']),
+                               ('-first_name', ['-first_name', 'id']),
+                               ('bicycle', ['bicycle__bicycle_number',
+                                            'id']),
+                               ('-bicycle', ['-bicycle__bicycle_number',
+                                             'id'])):
+            expected = list(Candidate.objects.order_by(
+                *order_by).values_list('id', flat=True))
+            forward, backward = self.walk(sort)
+            self.assertEqual(sum(forward, []), expected, sort)
+            self.assertEqual(len(forward), 3)
+            self.assertEqual(sum(backward, []), expected, sort)
+
+    def test_last_page(self):
+        self.add_candidates(90)
+        page = self.get_page({'sort': 'first_name', 'page': 3})
+        expected = list(Candidate.objects.order_by(
+            'first_name', 'id').values_list('id', flat=True))
+        self.assertEqual(self.get_ids(page), expected[80:])
+        self.assertFalse(page.has_next())
+
+    def test_constant_number_of_queries(self):
+        self.add_candidates(45)
+        cursor = self.get_page({'sort': 'last_name'}).next_cursor
+        number_of_queries = self.count_queries(
+            '%s?sort=last_name&page=2&after=%s' % (self.url, cursor))
+
+        self.add_candidates(90)
+        cursor = self.get_page({'sort': 'last_name', 'page': 3}).next_cursor
+        self.assertEqual(self.count_queries(
+            '%s?sort=last_name&page=4&after=%s' % (self.url, cursor)),
+                         number_of_queries)
+
+    def test_cached_count(self):
+        self.add_candidates(3)
+        self.get_page({})
+        with CaptureQueriesContext(connection) as context:
+            self.get_page({})
+        self.assertFalse([query for query in context.captured_queries
+                          if 'COUNT(' in query['sql']])
+
+
+class CandidateSearchTestCase(StaffTestCase):
+
+    def search(self, name):
+        response = self.client.get(reverse('staff:candidate_overview'),
+                                   {'name': name})
+        return ['%s %s' % (row.record.first_name, row.record.last_name)
+                for row in response.context['candidates'].rows]
+
+    def test_prefix(self):
+        self.add_candidates(3)
+        Candidate.objects.create(first_name='Anna', last_name='Firsching',
+                                 date_of_birth='1980-01-01')
+
+        self.assertEqual(self.search('anna'), ['Anna Firsching'])
+        self.assertEqual(len(self.search('firs')), 4)
+        self.assertEqual(self.search('nobody'), [])
+
+    def test_ranking(self):
+        self.add_candidates(3)
+
+        results = self.search('first 2')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0], 'First 2 Last')
+
+    def test_updated_names(self):
+        self.add_candidates(1)
+        Candidate.objects.update(first_name='Berta')
+
+        self.assertEqual(self.search('berta'), ['Berta Last'])
+        self.assertEqual(self.search('first'), [])
+
 # class CurrentInLineViewTestCase(HypothesisTestCase):
 #     url = reverse('register:current-in-line')
 #
@@ -436,3 +853,289 @@ class ThanksViewTestCase(HypothesisTestCase):
 #     def test_successfull_post(self):
 #         response = self.client.post(self.url, {'language': 'de'})
 #         self.assertEqual(response.status_code, 302)
+
+
+class ExportTestCase(StaffTestCase):
+
+    def export(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data or {})
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        return content, len(context)
+
+    def test_candidates(self):
+        self.add_candidates(4)
+        content, _ = self.export(reverse('staff:candidate_export'),
+                                 {'status': Candidate.INVITED})
+
+        lines = content.decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:3],
+                         ['id', 'status', 'first_name'])
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(',')[1:2], ['invited'])
+        self.assertEqual(lines[1].split(',')[5], "men's bicycle")
+
+    def test_non_ascii(self):
+        Candidate.objects.create(first_name=u'J\xf6rg',
+                                 last_name=u'M\xfcller',
+                                 date_of_birth='1980-01-01')
+        content, _ = self.export(reverse('staff:candidate_export'))
+        self.assertEqual(content.decode('utf-8').splitlines()[1].split(
+            ',')[2:4], [u'J\xf6rg', u'M\xfcller'])
+
+    def test_constant_number_of_queries(self):
+        url = reverse('staff:candidate_export')
+        self.add_candidates(3)
+        _, number_of_queries = self.export(url)
+
+        self.add_candidates(30)
+        self.assertEqual(self.export(url)[1], number_of_queries)
+
+    def test_event_gzip(self):
+        self.add_candidates(3)
+        content, _ = self.export(
+            reverse('staff:event_export', kwargs={'event_id': self.event.id}),
+            {'gzip': 1})
+
+        lines = gzip.GzipFile(fileobj=io.BytesIO(content)).read().decode(
+            'utf-8').splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_bicycles(self):
+        self.add_candidates(4)
+        content, _ = self.export(reverse('staff:bicycle_export'))
+        self.assertEqual(len(content.decode('utf-8').splitlines()), 3)
+
+
+class ImportCandidatesViewTestCase(StaffTestCase):
+
+    def test_byte_order_mark(self):
+        content = (u'\ufefffirst_name,last_name,date_of_birth,bicycle_kind,'
+                   u'email\nJ\xf6rg,M\xfcller,1990-02-03,1,'
+                   u'joerg@example.com\n').encode('utf-8')
+        response = self.client.post(
+            reverse('staff:import_candidates'),
+            {'csv_file': SimpleUploadedFile('candidates.csv', content)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].imported, 1)
+        self.assertEqual(response.context['result'].rejected, [])
+        self.assertTrue(Candidate.objects.filter(
+            first_name=u'J\xf6rg', last_name=u'M\xfcller').exists())
+
+    def test_command_byte_order_mark(self):
+        content = (u'\ufefffirst_name,last_name,date_of_birth,bicycle_kind,'
+                   u'email\nJ\xf6rg,M\xfcller,1990-02-03,1,'
+                   u'joerg@example.com\n').encode('utf-8')
+        with tempfile.NamedTemporaryFile(suffix='.csv') as csv_file:
+            csv_file.write(content)
+            csv_file.flush()
+            call_command('import_candidates', csv_file.name,
+                         stdout=StringIO(), stderr=StringIO())
+
+        self.assertTrue(Candidate.objects.filter(
+            first_name=u'J\xf6rg', last_name=u'M\xfcller').exists())
+
+    def test_undecodable_file(self):
+        content = (b'first_name,last_name,date_of_birth,bicycle_kind,email\n'
+                   b'Anna,Test,1990-02-03,2,anna@example.com\n'
+                   b'C\xe4rl,Test,1990-02-03,1,carl@example.com\n')
+        response = self.client.post(
+            reverse('staff:import_candidates'),
+            {'csv_file': SimpleUploadedFile('candidates.csv', content)})
+
+        # the first chunk holds both lines, so nothing has been imported
+        self.assertEqual(response.context['result'].imported, 0)
+        self.assertContains(response, 'after 0 people were imported')
+        self.assertFalse(Candidate.objects.filter(
+            first_name='Anna').exists())
+
+
+class PlanInvitationsTestCase(StaffTestCase):
+    url = reverse('staff:plan_invitations')
+
+    def setUp(self):
+        super(PlanInvitationsTestCase, self).setUp()
+        self.upcoming_event = HandoutEvent.objects.create(
+            due_date=timezone.now() + timedelta(days=7))
+        # two candidates without a bicycle, invited once to self.event
+        self.add_candidates(4)
+
+    def get_data(self, **numbers):
+        return dict(('capacity_%s_%s' % (self.upcoming_event.id, kind),
+                     numbers.get('choice_%s' % kind, 0))
+                    for kind, _ in UserRegistration.BICYCLE_CHOICES)
+
+    def test_preview_and_commit(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'capacity_%s_%s' % (
+            self.upcoming_event.id, UserRegistration.MALE))
+
+        response = self.client.post(self.url, self.get_data(choice_1=5))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['plan'].number_of_invitations, 2)
+        self.assertContains(response, 'First 0')
+        self.assertEqual(self.upcoming_event.invitations.count(), 0)
+
+        response = self.client.post(self.url,
+                                    dict(self.get_data(choice_1=5),
+                                         commit=''))
+        self.assertRedirects(response, reverse('staff:event_overview'))
+        self.assertEqual(self.upcoming_event.invitations.count(), 2)
+        self.assertNotIn(PLAN_SESSION_KEY, self.client.session)
+
+        # the plan is only committed once
+        response = self.client.post(self.url,
+                                    dict(self.get_data(choice_1=5),
+                                         commit=''))
+        self.assertRedirects(response, self.url)
+        self.assertEqual(self.upcoming_event.invitations.count(), 2)
+
+    def test_changed_numbers(self):
+        self.client.post(self.url, self.get_data(choice_1=5))
+
+        response = self.client.post(self.url,
+                                    dict(self.get_data(choice_1=1),
+                                         commit=''))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PLAN_CHANGED_ERROR,
+                      response.context['form'].non_field_errors())
+        self.assertEqual(self.upcoming_event.invitations.count(), 0)
+
+        # the plan is kept until it is committed
+        self.assertIn(PLAN_SESSION_KEY, self.client.session)
+        response = self.client.post(self.url,
+                                    dict(self.get_data(choice_1=5),
+                                         commit=''))
+        self.assertRedirects(response, reverse('staff:event_overview'))
+        self.assertEqual(self.upcoming_event.invitations.count(), 2)
+
+    def test_no_bicycles(self):
+        response = self.client.post(self.url, self.get_data())
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['form'].is_valid())
+        self.assertNotIn(PLAN_SESSION_KEY, self.client.session)
+
+
+PROFILED_MIDDLEWARE = (['bwb.profiling.ProfilingMiddleware'] +
+                       list(django_settings.MIDDLEWARE_CLASSES))
+
+
+@override_settings(MIDDLEWARE_CLASSES=PROFILED_MIDDLEWARE,
+                   PROFILING_ENABLED=True, PROFILING_SLOW_REQUEST=0)
+class ProfilingTestCase(StaffTestCase):
+
+    def test_server_timing(self):
+        self.add_candidates(3)
+        # assertLogs() is missing on Python 2
+        handler = BufferingHandler(10)
+        logger = logging.getLogger('bwb.profiling')
+        logger.addHandler(handler)
+        try:
+            response = self.client.get(reverse('staff:candidate_overview'))
+        finally:
+            logger.removeHandler(handler)
+        self.assertTrue(any(record.levelno == logging.WARNING
+                            for record in handler.buffer))
+
+        timings = [timing.split(';')[0]
+                   for timing in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings, ['sql', 'render', 'view', 'total'])
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('staff:candidate_overview'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_repeated_queries(self):
+        queries = [{'sql': 'SELECT * FROM a WHERE id = %s' % i, 'time': '0'}
+                   for i in range(3)]
+        queries.append({'sql': "SELECT * FROM b WHERE name = 'x'",
+                        'time': '0'})
+        self.assertEqual(get_repeated_queries(queries),
+                         [(3, 'SELECT * FROM a WHERE id = ?')])
+
+
+class MetricsTestCase(StaffTestCase):
+
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        # increments of earlier tests are rolled back with this test
+        registry.flush()
+
+    def get_samples(self, **extra):
+        response = self.client.get(reverse('staff:metrics'), **extra)
+        self.assertEqual(response.status_code, 200)
+        return dict(line.rsplit(' ', 1)
+                    for line in response.content.decode('utf-8').splitlines()
+                    if not line.startswith('#'))
+
+    def test_metrics(self):
+        self.add_candidates(2)
+        count_invitations(3, source='auto')
+        registry.observe(MESSAGE_LATENCY, 0.02, channel='sms')
+
+        samples = self.get_samples()
+        self.assertEqual(samples['bwb_invitations_total{source="auto"}'],
+                         '3.0')
+        self.assertEqual(samples['bwb_invitations_per_run_bucket{le="1.0"}'],
+                         '0.0')
+        self.assertEqual(samples['bwb_invitations_per_run_bucket{le="5.0"}'],
+                         '1.0')
+        self.assertEqual(
+            samples['bwb_message_send_seconds_count{channel="sms"}'], '1.0')
+        self.assertEqual(samples['bwb_queue_length{bicycle_kind="1"}'], '1.0')
+        self.assertEqual(samples['bwb_line_length'], '1.0')
+
+    @override_settings(
+        MIDDLEWARE_CLASSES=(['register.metrics.MetricsMiddleware'] +
+                            list(django_settings.MIDDLEWARE_CLASSES)))
+    def test_request_latency(self):
+        self.client.get(reverse('staff:candidate_overview'))
+        samples = self.get_samples()
+        self.assertEqual(samples['bwb_request_seconds_count'
+                                 '{url_name="staff:candidate_overview"}'],
+                         '1.0')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_authentication(self):
+        self.client.logout()
+        response = self.client.get(reverse('staff:metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        self.get_samples(HTTP_AUTHORIZATION='Bearer secret')
+
+
+class RouterTestCase(StaffTestCase):
+
+    def setUp(self):
+        super(RouterTestCase, self).setUp()
+        self.router = PrimaryReplicaRouter()
+
+    @override_settings(DATABASE_REPLICA='replica')
+    def test_routing(self):
+        self.assertEqual(self.router.db_for_read(Candidate), 'default')
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Candidate), 'replica')
+            self.assertEqual(self.router.db_for_write(Candidate), 'default')
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Candidate),
+                                 'default')
+            self.assertEqual(self.router.db_for_read(Candidate), 'replica')
+
+    def test_without_replica(self):
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(Candidate), 'default')
+
+    @override_settings(
+        DATABASE_REPLICA='replica',
+        MIDDLEWARE_CLASSES=(list(django_settings.MIDDLEWARE_CLASSES) +
+                            ['bwb.routers.PinPrimaryMiddleware']))
+    def test_pinned_after_post(self):
+        self.client.get(reverse('staff:index'))
+        self.assertNotIn(PIN_SESSION_KEY, self.client.session)
+
+        self.client.post(reverse('staff:create_event'),
+                         {'due_date': '01.06.2016 10:00'})
+        self.assertGreater(self.client.session[PIN_SESSION_KEY], time.time())